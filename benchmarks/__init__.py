@@ -0,0 +1,8 @@
+"""Бенчмарки Shinobi Casino.
+
+    python -m benchmarks run --out results.json        # синтетическая база + все замеры
+    python -m benchmarks compare old.json new.json     # разница между двумя прогонами
+
+Отдельные скрипты: bench_indexes.py (индексы схемы), load_async.py
+(режимы sync/async под нагрузкой).
+"""
@@ -0,0 +1,129 @@
+"""python -m benchmarks run|compare — см. benchmarks/__init__.py"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import ROOT, import_main
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def cmd_run(args):
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    fresh = not os.path.exists(path)
+    main = import_main(path)
+
+    if fresh:
+        from benchmarks.seed import seed_database
+
+        print(f"Заполняем {path}: {args.users:,} игроков, {args.history:,} строк истории...")
+        started = time.perf_counter()
+        with main.db.connection() as conn:
+            seed_database(conn, args.users, args.history, password_hash=main.hash_password("bench"),
+                          progress=True)
+        main.db.rebuild_user_stats()
+        main.leaderboard.warm()
+        print(f"  готово за {time.perf_counter() - started:.1f} с")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "users": args.users,
+            "history_rows": args.history,
+            "db_mode": main.adb.mode,
+        }
+    }
+
+    if not args.skip_micro:
+        from benchmarks.micro import run_micro
+
+        print("Микробенчмарки:")
+        report["micro"] = run_micro(main, args.users, args.iterations, args.budget, progress=True)
+
+    if not args.skip_traffic:
+        from benchmarks.traffic import run_traffic
+
+        print(f"Смешанный трафик: {args.clients} клиентов, {args.duration:.0f} с...")
+        traffic = report["traffic"] = run_traffic(main, args.users, args.clients, args.duration)
+        for route, r in traffic["routes"].items():
+            print(f"  {route:<32} p50 {r['p50_us'] / 1000:>8.2f} мс  p99 {r['p99_us'] / 1000:>8.2f} мс  "
+                  f"{r['throughput']:>9,.1f} rps")
+        print(f"  всего: {traffic['throughput']:,.1f} rps")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Результаты: {args.out}")
+
+
+def _flatten(report: dict) -> dict:
+    rows = {}
+    for name, r in report.get("micro", {}).items():
+        rows[f"micro {name}"] = r
+    for route, r in report.get("traffic", {}).get("routes", {}).items():
+        rows[f"traffic {route}"] = r
+    return rows
+
+
+def cmd_compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    print(f"{'замер':<48}{'p50 было':>12}{'p50 стало':>12}{'Δ p50':>9}{'Δ p99':>9}{'Δ опс':>9}")
+    old_rows, new_rows = _flatten(old), _flatten(new)
+    for name in sorted(set(old_rows) & set(new_rows)):
+        a, b = old_rows[name], new_rows[name]
+
+        def delta(key: str) -> str:
+            return f"{(b[key] - a[key]) / a[key]:+.0%}" if a[key] else "—"
+
+        print(f"{name:<48}{a['p50_us']:>12.2f}{b['p50_us']:>12.2f}"
+              f"{delta('p50_us'):>9}{delta('p99_us'):>9}{delta('throughput'):>9}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="заполнить базу и выполнить замеры")
+    run.add_argument("--db", help="база (если файла нет — будет создана и заполнена)")
+    run.add_argument("--users", type=int, default=100_000)
+    run.add_argument("--history", type=int, default=50_000_000, help="строк game_history")
+    run.add_argument("--iterations", type=int, default=5000, help="повторов на микробенчмарк")
+    run.add_argument("--budget", type=float, default=2.0, help="секунд максимум на микробенчмарк")
+    run.add_argument("--clients", type=int, default=50, help="одновременных клиентов трафика")
+    run.add_argument("--duration", type=float, default=20.0, help="секунд смешанного трафика")
+    run.add_argument("--skip-micro", action="store_true")
+    run.add_argument("--skip-traffic", action="store_true")
+    run.add_argument("--out", help="файл JSON с результатами")
+
+    compare = commands.add_parser("compare", help="сравнить два JSON-отчета")
+    compare.add_argument("old")
+    compare.add_argument("new")
+
+    args = parser.parse_args()
+    {"run": cmd_run, "compare": cmd_compare}[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
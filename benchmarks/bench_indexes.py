@@ -0,0 +1,109 @@
+"""Бенчмарк индексов схемы: планы запросов и задержки до и после миграции v2.
+
+Запуск:
+    python benchmarks/bench_indexes.py                 # 10M строк истории
+    python benchmarks/bench_indexes.py --rows 1000000  # быстрее
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import import_main  # noqa: E402
+from benchmarks.seed import seed_database  # noqa: E402
+
+# main создает базу при импорте — уводим ее во временный файл
+main = import_main(os.path.join(tempfile.mkdtemp(), "import.db"))
+
+QUERIES = {
+    "stats": (
+        "SELECT COUNT(*), SUM(bet_amount), SUM(win_amount) FROM game_history WHERE user_id = ?",
+        True,
+    ),
+    "recent_history": (
+        "SELECT id, game_type, bet_amount, win_amount, played_at FROM game_history "
+        "WHERE user_id = ? ORDER BY played_at DESC LIMIT 50",
+        True,
+    ),
+    "missions": ("SELECT * FROM missions WHERE user_id = ?", True),
+    "mission_update": (
+        "UPDATE missions SET progress = progress + 1 "
+        "WHERE user_id = ? AND mission_type = 'play_10_games' AND completed = 0",
+        True,
+    ),
+    "leaderboard": (
+        "SELECT username, village, ryo, rank, total_earned FROM users ORDER BY ryo DESC LIMIT 10",
+        False,
+    ),
+}
+
+
+def measure(conn: sqlite3.Connection, users: int, budget: float, iterations: int) -> dict:
+    rng = random.Random(7)
+    report = {}
+    for name, (sql, per_user) in QUERIES.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, (1,) if per_user else ())]
+        timings = []
+        deadline = time.perf_counter() + budget
+        while len(timings) < iterations and time.perf_counter() < deadline:
+            params = (rng.randint(1, users),) if per_user else ()
+            started = time.perf_counter()
+            conn.execute("BEGIN")
+            conn.execute(sql, params).fetchall()
+            conn.rollback()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        report[name] = {
+            "plan": plan,
+            "runs": len(timings),
+            "p50_ms": statistics.median(timings),
+            "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        }
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="строк в game_history")
+    parser.add_argument("--users", type=int, default=100_000, help="пользователей")
+    parser.add_argument("--iterations", type=int, default=200, help="повторов на запрос")
+    parser.add_argument("--budget", type=float, default=10.0, help="максимум секунд на запрос")
+    parser.add_argument("--db", help="путь к файлу базы (по умолчанию — временный)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench_indexes.db")
+    conn = sqlite3.connect(path, isolation_level=None)
+    main.migrate(conn, target=1)
+
+    print(f"Заполняем {path}: {args.users:,} пользователей, {args.rows:,} строк истории...")
+    started = time.perf_counter()
+    seed_database(conn, args.users, args.rows)
+    print(f"  готово за {time.perf_counter() - started:.1f} с")
+
+    before = measure(conn, args.users, args.budget, args.iterations)
+
+    started = time.perf_counter()
+    main.migrate(conn, target=2)
+    print(f"Миграция до v2 заняла {time.perf_counter() - started:.1f} с")
+
+    after = measure(conn, args.users, args.budget, args.iterations)
+
+    for name in QUERIES:
+        b, a = before[name], after[name]
+        print(f"\n== {name}")
+        print(f"  до:    p50 {b['p50_ms']:9.3f} мс  p95 {b['p95_ms']:9.3f} мс  ({b['runs']} прогонов)")
+        print(f"         план: {'; '.join(b['plan'])}")
+        print(f"  после: p50 {a['p50_ms']:9.3f} мс  p95 {a['p95_ms']:9.3f} мс  ({a['runs']} прогонов)")
+        print(f"         план: {'; '.join(a['plan'])}")
+        if a["p50_ms"]:
+            print(f"  ускорение p50: x{b['p50_ms'] / a['p50_ms']:.1f}")
+
+
+if __name__ == "__main__":
+    main_cli()
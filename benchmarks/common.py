@@ -0,0 +1,50 @@
+"""Общие помощники бенчмарков: импорт main на нужной базе и статистика замеров"""
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_main(db_path: str):
+    """Импортирует main так, чтобы он открыл базу db_path (main создает базу при импорте)"""
+    if "main" in sys.modules:
+        return sys.modules["main"]
+    os.environ["SHINOBI_DB_PATH"] = db_path
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import main
+    return main
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(timings_ns: list, elapsed: float) -> dict:
+    """Сводка по замерам одной операции (времена в наносекундах)"""
+    values = sorted(timings_ns)
+    return {
+        "count": len(values),
+        "throughput": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "mean_us": round(statistics.fmean(values) / 1000, 3) if values else 0.0,
+        "p50_us": round(percentile(values, 0.50) / 1000, 3),
+        "p95_us": round(percentile(values, 0.95) / 1000, 3),
+        "p99_us": round(percentile(values, 0.99) / 1000, 3),
+    }
+
+
+def measure(fn, iterations: int, budget: float) -> dict:
+    """Вызывает fn() до iterations раз (или пока не кончится budget секунд)"""
+    timings = []
+    started = time.perf_counter()
+    deadline = started + budget
+    clock = time.perf_counter_ns
+    while len(timings) < iterations and time.perf_counter() < deadline:
+        t0 = clock()
+        fn()
+        timings.append(clock() - t0)
+    return summarize(timings, time.perf_counter() - started)
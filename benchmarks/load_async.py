@@ -0,0 +1,145 @@
+"""Нагрузочный тест: синхронный и асинхронный режим базы (SHINOBI_DB_MODE).
+
+Для каждого режима поднимает отдельный uvicorn на временной базе,
+регистрирует игроков и гоняет --clients одновременных клиентов, которые
+без пауз делают ставки (и изредка читают статистику) в течение --duration
+секунд. Печатает p50/p95/p99 и запросы в секунду.
+
+Нужен httpx:
+    pip install httpx
+    python benchmarks/load_async.py --clients 1000 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GAMES = ["roulette", "slots", "dice", "blackjack"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def wait_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(base_url + "/")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Сервер не запустился")
+
+
+async def run_load(base_url: str, clients: int, duration: float) -> dict:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        names = [f"load{i}" for i in range(clients)]
+        for start in range(0, clients, 100):
+            await asyncio.gather(*(
+                client.post("/api/register", json={"username": name, "password": "x", "village": "konoha"})
+                for name in names[start:start + 100]
+            ))
+
+        latencies = []
+        errors = 0
+        stop_at = time.monotonic() + duration
+
+        async def worker(name: str):
+            nonlocal errors
+            rng = random.Random(name)
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                try:
+                    if rng.random() < 0.1:
+                        response = await client.get(f"/api/stats/{name}")
+                    else:
+                        game = rng.choice(GAMES)
+                        response = await client.post(f"/api/game/{game}", json={
+                            "username": name, "bet": 1, "element": "fire"
+                        })
+                    if response.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(name) for name in names))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+    }
+
+
+def bench_mode(mode: str, clients: int, duration: float) -> dict:
+    port = free_port()
+    env = dict(os.environ,
+               SHINOBI_DB_MODE=mode,
+               SHINOBI_DB_PATH=os.path.join(tempfile.mkdtemp(), f"load_{mode}.db"),
+               SHINOBI_RATE_LIMIT_PER_SECOND="0")  # клиенты шлют запросы без пауз
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning", "--no-access-log", "--backlog", str(max(2048, clients * 2))],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        asyncio.run(wait_ready(base_url))
+        return asyncio.run(run_load(base_url, clients, duration))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000, help="одновременных клиентов")
+    parser.add_argument("--duration", type=float, default=30.0, help="секунд нагрузки на режим")
+    parser.add_argument("--modes", default="sync,async", help="режимы через запятую")
+    parser.add_argument("--out", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes.split(","):
+        print(f"▶ режим {mode}: {args.clients} клиентов, {args.duration:.0f} с...")
+        results[mode] = bench_mode(mode, args.clients, args.duration)
+        r = results[mode]
+        print(f"  {r['rps']:>9} rps  p50 {r['p50_ms']:>8} мс  p95 {r['p95_ms']:>8} мс  "
+              f"p99 {r['p99_ms']:>8} мс  ошибок {r['errors']}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"clients": args.clients, "duration": args.duration, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
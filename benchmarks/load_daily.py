@@ -0,0 +1,179 @@
+"""Нагрузочный тест ежедневной награды: волна получений сразу после сброса.
+
+Заполняет временную базу --users игроками (benchmarks.seed), у всех
+награда становится доступна в одну и ту же секунду, поднимает сервер
+(`--workers 0` — один uvicorn, иначе `main.py serve --workers N`) и
+--clients одновременными клиентами забирает награду за каждого игрока.
+Доля --repeat игроков жмет кнопку дважды одновременно — второй запрос
+должен получить 400, а не второе начисление. После прогона база
+сверяется: ровно одна запись daily_rewards на игрока и прибавка Рё
+ровно DAILY_REWARD_AMOUNT каждому.
+
+Нужен httpx:
+    pip install httpx
+    python benchmarks/load_daily.py --users 50000 --clients 256 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import import_main  # noqa: E402
+from benchmarks.load_async import free_port, percentile, wait_ready  # noqa: E402
+from benchmarks.load_workers import start_server  # noqa: E402
+from benchmarks.seed import seed_database  # noqa: E402
+
+# main создает базу при импорте — уводим ее во временный файл
+main = import_main(os.path.join(tempfile.mkdtemp(), "import.db"))
+
+
+def prepare(path: str, users: int) -> dict:
+    """База, где награда у всех только что стала доступна; возвращает балансы до прогона"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    main.migrate(conn)
+    seed_database(conn, users, 0)
+    conn.execute("UPDATE users SET last_daily_reward = ?", (int(time.time()) - main.DAILY_REWARD_INTERVAL,))
+    # Новый ранг закрыл бы миссию reach_chunin и добавил ее награду к балансу
+    conn.execute("UPDATE missions SET completed = 1")
+    balances = dict(conn.execute("SELECT id, ryo FROM users"))
+    conn.close()
+    return balances
+
+
+async def drive(base_url: str, names: list, clients: int) -> dict:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    latencies = []
+    counts = {"ok": 0, "rejected": 0, "errors": 0}
+    queue = list(reversed(names))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+
+        async def claim(name: str):
+            started = time.perf_counter()
+            try:
+                response = await client.post("/api/claim-daily-reward", json={"username": name})
+            except httpx.HTTPError:
+                counts["errors"] += 1
+                return
+            if response.status_code == 200:
+                counts["ok"] += 1
+            elif response.status_code == 400:
+                counts["rejected"] += 1
+            else:
+                counts["errors"] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        async def worker():
+            while queue:
+                name = queue.pop()
+                if isinstance(name, tuple):
+                    await asyncio.gather(claim(name[0]), claim(name[0]))
+                else:
+                    await claim(name)
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+    return {"latencies": latencies, **counts}
+
+
+def drive_process(task: tuple) -> dict:
+    return asyncio.run(drive(*task))
+
+
+def verify(path: str, before: dict) -> dict:
+    conn = sqlite3.connect(path)
+    rewards = conn.execute("SELECT COUNT(*), COUNT(DISTINCT user_id) FROM daily_rewards").fetchone()
+    wrong = sum(1 for user_id, ryo in conn.execute("SELECT id, ryo FROM users")
+                if ryo - before[user_id] != main.DAILY_REWARD_AMOUNT)
+    conn.close()
+    return {"rewards": rewards[0], "rewarded_users": rewards[1], "wrong_balances": wrong}
+
+
+def bench(users: int, clients: int, workers: int, repeat: float, load_procs: int) -> dict:
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "load_daily.db")
+    print(f"Заполняем базу: {users:,} игроков...")
+    before = prepare(path, users)
+
+    rng = random.Random(7)
+    names = [(f"user{i}",) if rng.random() < repeat else f"user{i}" for i in range(1, users + 1)]
+    rng.shuffle(names)
+
+    port = free_port()
+    env = dict(os.environ,
+               SHINOBI_DB_MODE="async",
+               SHINOBI_DB_PATH=path,
+               SHINOBI_WRITER_SOCKET=os.path.join(directory, "writer.sock"))
+    server = start_server(workers, port, env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        asyncio.run(wait_ready(base_url, timeout=60.0))
+        per_proc = max(1, clients // load_procs)
+        tasks = [(base_url, names[i::load_procs], per_proc) for i in range(load_procs)]
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=load_procs) as pool:
+            parts = list(pool.map(drive_process, tasks))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    latencies = sorted(value for part in parts for value in part["latencies"])
+    return {
+        "users": users,
+        "requests": len(latencies),
+        "elapsed_s": round(elapsed, 2),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "ok": sum(part["ok"] for part in parts),
+        "rejected": sum(part["rejected"] for part in parts),
+        "errors": sum(part["errors"] for part in parts),
+        "repeated": sum(1 for name in names if isinstance(name, tuple)),
+        **verify(path, before),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50_000, help="игроков, забирающих награду")
+    parser.add_argument("--clients", type=int, default=256, help="одновременных запросов")
+    parser.add_argument("--workers", type=int, default=0, help="воркеров serve (0 — один uvicorn)")
+    parser.add_argument("--repeat", type=float, default=0.1, help="доля игроков, жмущих дважды одновременно")
+    parser.add_argument("--load-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="процессов генератора нагрузки")
+    parser.add_argument("--deadline", type=float, default=60.0, help="целевое время волны, с")
+    parser.add_argument("--out", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    r = bench(args.users, args.clients, args.workers, args.repeat, args.load_procs)
+    mark = "✅" if r["elapsed_s"] <= args.deadline else "❌"
+    print(f"  {r['requests']:,} запросов за {r['elapsed_s']} с {mark} (цель {args.deadline:.0f} с)  "
+          f"{r['rps']} rps  p50 {r['p50_ms']} мс  p95 {r['p95_ms']} мс  p99 {r['p99_ms']} мс")
+    print(f"  начислено {r['ok']:,}, отказов 400: {r['rejected']:,} (повторных нажатий {r['repeated']:,}), "
+          f"ошибок {r['errors']}")
+    consistent = (r["ok"] == r["users"] and r["rewards"] == r["users"] == r["rewarded_users"]
+                  and r["wrong_balances"] == 0)
+    print(f"  {'✅' if consistent else '❌'} в базе: {r['rewards']:,} наград у {r['rewarded_users']:,} игроков, "
+          f"неверных балансов {r['wrong_balances']}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(dict(r, clients=args.clients, workers=args.workers, cpu_count=os.cpu_count()),
+                      f, indent=2, ensure_ascii=False)
+    if not consistent:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,155 @@
+"""Нагрузочный тест входов: scrypt в пуле процессов против задержки игр.
+
+Для каждого N из --kdf-workers поднимает uvicorn на временной базе с
+SHINOBI_KDF_WORKERS=N (0 — scrypt прямо в цикле событий, как без пула) и
+одновременно гоняет два вида клиентов: --game-clients без пауз делают
+ставки, --login-clients без пауз входят в систему. Первым идет прогон без
+входов — относительно него видно, насколько волна входов замедлила игры.
+Печатает успешные входы в секунду, отказы 503 (очередь хеширования полна)
+и p50/p95/p99 ставок.
+
+Нужен httpx:
+    pip install httpx
+    python benchmarks/load_login.py --kdf-workers 0,2,4 --game-clients 200 --login-clients 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_async import GAMES, ROOT, free_port, percentile, wait_ready  # noqa: E402
+
+
+async def register(client: httpx.AsyncClient, names: list):
+    """Регистрация тоже идет через scrypt — небольшими порциями, с повтором после 503"""
+    async def one(name: str):
+        while True:
+            response = await client.post("/api/register", json={"username": name, "password": "x", "village": "konoha"})
+            if response.status_code != 503:
+                return
+            await asyncio.sleep(0.1)
+
+    for start in range(0, len(names), 8):
+        await asyncio.gather(*(one(name) for name in names[start:start + 8]))
+
+
+async def run_load(base_url: str, game_clients: int, login_clients: int, duration: float) -> dict:
+    clients = game_clients + login_clients
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        gamers = [f"game{i}" for i in range(game_clients)]
+        visitors = [f"login{i}" for i in range(login_clients)]
+        await register(client, gamers + visitors)
+
+        game_latencies, login_latencies = [], []
+        counts = {"rejected": 0, "errors": 0}
+        stop_at = time.monotonic() + duration
+
+        async def gamer(name: str):
+            rng = random.Random(name)
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"/api/game/{rng.choice(GAMES)}", json={
+                        "username": name, "bet": 1, "element": "fire"
+                    })
+                except httpx.HTTPError:
+                    counts["errors"] += 1
+                    continue
+                if response.status_code >= 500:
+                    counts["errors"] += 1
+                game_latencies.append((time.perf_counter() - started) * 1000)
+
+        async def visitor(name: str):
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/api/login", params={"username": name, "password": "x"})
+                except httpx.HTTPError:
+                    counts["errors"] += 1
+                    continue
+                if response.status_code == 503:
+                    counts["rejected"] += 1
+                    await asyncio.sleep(float(response.headers.get("retry-after", "1")) / 10)
+                elif response.status_code != 200:
+                    counts["errors"] += 1
+                else:
+                    login_latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(gamer(name) for name in gamers), *(visitor(name) for name in visitors))
+        elapsed = time.perf_counter() - started
+
+    game_latencies.sort()
+    login_latencies.sort()
+    return {
+        "game_rps": round(len(game_latencies) / elapsed, 1),
+        "game_p50_ms": round(percentile(game_latencies, 0.50), 2),
+        "game_p95_ms": round(percentile(game_latencies, 0.95), 2),
+        "game_p99_ms": round(percentile(game_latencies, 0.99), 2),
+        "login_rps": round(len(login_latencies) / elapsed, 1),
+        "login_p95_ms": round(percentile(login_latencies, 0.95), 2),
+        "rejected": counts["rejected"],
+        "errors": counts["errors"],
+    }
+
+
+def bench(kdf_workers: int, game_clients: int, login_clients: int, duration: float) -> dict:
+    port = free_port()
+    env = dict(os.environ,
+               SHINOBI_KDF_WORKERS=str(kdf_workers),
+               SHINOBI_DB_PATH=os.path.join(tempfile.mkdtemp(), "load_login.db"),
+               SHINOBI_RATE_LIMIT_PER_SECOND="0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning", "--no-access-log", "--backlog", "4096"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        asyncio.run(wait_ready(base_url))
+        return asyncio.run(run_load(base_url, game_clients, login_clients, duration))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kdf-workers", default=f"0,{max(1, (os.cpu_count() or 2) // 2)}",
+                        help="размеры пула scrypt через запятую (0 — в цикле событий)")
+    parser.add_argument("--game-clients", type=int, default=200, help="клиентов, которые делают ставки")
+    parser.add_argument("--login-clients", type=int, default=50, help="клиентов, которые входят в систему")
+    parser.add_argument("--duration", type=float, default=20.0, help="секунд нагрузки на прогон")
+    parser.add_argument("--out", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    workers = [int(n) for n in args.kdf_workers.split(",")]
+    runs = [("без входов", workers[-1], 0)] + [(f"пул {n}" if n else "в цикле событий", n, args.login_clients)
+                                               for n in workers]
+    results = {}
+    for label, kdf_workers, login_clients in runs:
+        print(f"▶ {label}: {args.game_clients} игроков, {login_clients} входящих, {args.duration:.0f} с...")
+        r = results[label] = bench(kdf_workers, args.game_clients, login_clients, args.duration)
+        print(f"  ставки {r['game_rps']:>8} rps  p50 {r['game_p50_ms']:>8} мс  p95 {r['game_p95_ms']:>8} мс  "
+              f"p99 {r['game_p99_ms']:>8} мс | входы {r['login_rps']:>6} rps  p95 {r['login_p95_ms']:>8} мс  "
+              f"503: {r['rejected']}  ошибок {r['errors']}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"game_clients": args.game_clients, "login_clients": args.login_clients,
+                       "duration": args.duration, "cpu_count": os.cpu_count(), "results": results},
+                      f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,150 @@
+"""Нагрузочный тест многопроцессного режима: пропускная способность от числа воркеров.
+
+Для каждого N из --workers поднимает `main.py serve --workers N` (N воркеров
+uvicorn и процесс-писатель) на временной базе и гоняет смешанную нагрузку:
+клиенты без пауз делают ставки и изредка читают статистику, как в
+load_async.py. Первым идет обычный однопроцессный сервер (режим async) —
+относительно него считается ускорение. Нагрузку дают --load-procs
+процессов, чтобы генератор сам не стал узким местом; ядер должно хватать
+и на сервер, и на генератор.
+
+Нужен httpx:
+    pip install httpx
+    python benchmarks/load_workers.py --workers 2,4,8 --clients 512 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_async import GAMES, ROOT, free_port, percentile, wait_ready  # noqa: E402
+
+
+async def register(base_url: str, names: list):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+        for start in range(0, len(names), 100):
+            await asyncio.gather(*(
+                client.post("/api/register", json={"username": name, "password": "x", "village": "konoha"})
+                for name in names[start:start + 100]
+            ))
+
+
+async def drive(base_url: str, names: list, duration: float) -> dict:
+    limits = httpx.Limits(max_connections=len(names), max_keepalive_connections=len(names))
+    latencies = []
+    errors = 0
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        stop_at = time.monotonic() + duration
+
+        async def worker(name: str):
+            nonlocal errors
+            rng = random.Random(name)
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                try:
+                    if rng.random() < 0.1:
+                        response = await client.get(f"/api/stats/{name}")
+                    else:
+                        response = await client.post(f"/api/game/{rng.choice(GAMES)}", json={
+                            "username": name, "bet": 1, "element": "fire"
+                        })
+                    if response.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        await asyncio.gather(*(worker(name) for name in names))
+    return {"latencies": latencies, "errors": errors}
+
+
+def drive_process(task: tuple) -> dict:
+    return asyncio.run(drive(*task))
+
+
+def start_server(workers: int, port: int, env: dict) -> subprocess.Popen:
+    if workers == 0:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                   "--log-level", "warning", "--no-access-log", "--backlog", "4096"]
+    else:
+        command = [sys.executable, "main.py", "serve", "--workers", str(workers), "--port", str(port)]
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def bench(workers: int, clients: int, duration: float, load_procs: int) -> dict:
+    """workers=0 — один процесс без писателя"""
+    port = free_port()
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ,
+               SHINOBI_DB_MODE="async",
+               SHINOBI_DB_PATH=os.path.join(directory, "load.db"),
+               SHINOBI_WRITER_SOCKET=os.path.join(directory, "writer.sock"),
+               SHINOBI_RATE_LIMIT_PER_SECOND="0")  # клиенты шлют запросы без пауз
+    server = start_server(workers, port, env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        asyncio.run(wait_ready(base_url, timeout=60.0))
+        names = [f"load{i}" for i in range(clients)]
+        asyncio.run(register(base_url, names))
+
+        tasks = [(base_url, names[i::load_procs], duration) for i in range(load_procs)]
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=load_procs) as pool:
+            parts = list(pool.map(drive_process, tasks))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    latencies = sorted(value for part in parts for value in part["latencies"])
+    return {
+        "requests": len(latencies),
+        "errors": sum(part["errors"] for part in parts),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=",".join(str(n) for n in (2, 4, os.cpu_count() or 1)),
+                        help="числа воркеров через запятую")
+    parser.add_argument("--clients", type=int, default=512, help="одновременных клиентов")
+    parser.add_argument("--duration", type=float, default=20.0, help="секунд нагрузки на прогон")
+    parser.add_argument("--load-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="процессов генератора нагрузки")
+    parser.add_argument("--out", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    runs = [0] + sorted({int(n) for n in args.workers.split(",") if int(n) > 0})
+    results = {}
+    for workers in runs:
+        label = "1 процесс" if workers == 0 else f"{workers} воркеров"
+        print(f"▶ {label}: {args.clients} клиентов, {args.duration:.0f} с...")
+        r = results[workers] = bench(workers, args.clients, args.duration, args.load_procs)
+        speedup = r["rps"] / results[0]["rps"] if results[0]["rps"] else 0.0
+        print(f"  {r['rps']:>9} rps  x{speedup:.2f}  p50 {r['p50_ms']:>8} мс  p95 {r['p95_ms']:>8} мс  "
+              f"p99 {r['p99_ms']:>8} мс  ошибок {r['errors']}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"clients": args.clients, "duration": args.duration, "cpu_count": os.cpu_count(),
+                       "results": {str(workers): r for workers, r in results.items()}}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,98 @@
+"""Микробенчмарки методов Database, таблицы лидеров и игр из main.GAMES"""
+import random
+
+from benchmarks.common import measure
+
+VILLAGES = ["konoha", "suna", "kiri", "iwa"]
+
+
+def database_cases(main, users: int) -> dict:
+    """Операции Database на случайных игроках user1..userN"""
+    db = main.db
+    rng = random.Random(11)
+
+    def any_user() -> int:
+        return rng.randint(1, users)
+
+    # Отдельный игрок для записи, чтобы ставки не упирались в баланс
+    writer_id = db.create_user(f"bench_writer_{rng.random()}", "x", "konoha") or 1
+    db.update_balance(writer_id, 10 ** 12)
+    writer = db.get_user_by_id(writer_id)
+
+    def cold_get_user():
+        user_id = any_user()
+        db.users.invalidate(user_id)
+        db.get_user(f"user{user_id}")
+
+    hot_name = f"user{any_user()}"
+    db.get_user(hot_name)
+    token, _ = main.session_tokens.issue(any_user())
+    # Свои экземпляры: лимит не должен срабатывать, а кэш — вытеснять ответы приложения
+    limiter = main.RateLimiter(rate=10 ** 9)
+    replies = main.IdempotencyCache()
+    replies.begin("bench", "fingerprint")
+    replies.finish("bench", b'{"success": true}')
+
+    return {
+        "db.get_user[cache_miss]": cold_get_user,
+        "db.get_user[cache_hit]": lambda: db.get_user(hot_name),
+        "db.get_user_by_id": lambda: db.get_user_by_id(any_user()),
+        "session_tokens.decode": lambda: main.session_tokens.decode(token),
+        "rate_limiter.acquire": lambda: limiter.acquire(("id", any_user())),
+        "idempotency.begin[replay]": lambda: replies.begin("bench", "fingerprint"),
+        "db.settle_bet": lambda: db.settle_bet(writer.id, "dice", 10, 20, "win"),
+        "db.settle_batch[10]": lambda: db.settle_batch(writer.id, "dice", [10] * 10,
+                                                       [main.GAMES["dice"].play(10, "konoha") for _ in range(10)]),
+        "db.check_daily_reward": lambda: db.check_daily_reward(any_user()),
+        "db.get_missions": lambda: db.get_missions(any_user()),
+        "db.get_stats": lambda: db.get_stats(any_user()),
+        "db.get_game_stats": lambda: db.get_game_stats(any_user()),
+        "db.get_history[50]": lambda: db.get_history(any_user(), 50),
+        "leaderboard.top": lambda: main.leaderboard.top(10),
+        "leaderboard.position": lambda: main.leaderboard.position(any_user()),
+        "leaderboard.around": lambda: main.leaderboard.around(any_user(), 5),
+    }
+
+
+def tournament_cases(main, users: int) -> dict:
+    """Турнирная таблица в памяти, где участвуют все user1..userN"""
+    rng = random.Random(12)
+    engine = main.TournamentEngine(main.db, persist_interval=0)
+    engine.on_created({"id": 0, "name": "bench", "scoring": "net_win", "games": "", "prizes": "[]",
+                       "starts_at": 0, "ends_at": 2 ** 62, "status": "active", "closed_at": None})
+
+    def bet_event(user_id: int) -> dict:
+        bet = rng.randint(1, 100)
+        return {"user_id": user_id, "username": f"user{user_id}", "game_type": "dice",
+                "rounds": [(bet, bet * rng.choice((0, 2)), "bench")]}
+
+    for user_id in range(1, users + 1):
+        engine.on_bet(bet_event(user_id))
+
+    return {
+        "tournaments.on_bet": lambda: engine.on_bet(bet_event(rng.randint(1, users))),
+        "tournaments.top": lambda: engine.top(0, 10),
+        "tournaments.position": lambda: engine.position(0, rng.randint(1, users), 5),
+    }
+
+
+def game_cases(main) -> dict:
+    cases = {"game_rng.below[36]": lambda: main.game_rng.below(36)}
+    for village in VILLAGES:
+        for name, game in main.GAMES.items():
+            cases[f"play_{name}[{village}]"] = lambda g=game, v=village: g.play(100, v, "fire")
+    return cases
+
+
+def run_micro(main, users: int, iterations: int, budget: float, progress: bool = False) -> dict:
+    results = {}
+    for group, cases in (("database", database_cases(main, users)),
+                          ("tournaments", tournament_cases(main, users)), ("games", game_cases(main))):
+        for name, fn in cases.items():
+            fn()  # прогрев
+            results[name] = dict(measure(fn, iterations, budget), group=group)
+            if progress:
+                r = results[name]
+                print(f"  {name:<32} p50 {r['p50_us']:>10.2f} мкс  p99 {r['p99_us']:>10.2f} мкс  "
+                      f"{r['throughput']:>12,.0f} оп/с")
+    return results
@@ -0,0 +1,67 @@
+"""Синтетическая база для бенчмарков: пользователи, миссии и история игр"""
+import random
+import sqlite3
+import time
+
+GAMES = ["roulette", "slots", "dice", "blackjack"]
+VILLAGES = ["konoha", "suna", "kiri", "iwa"]
+MISSIONS = (("play_10_games", 500), ("earn_5000_ryo", 1000), ("reach_chunin", 2000))
+HISTORY_START = 1_700_000_000
+
+
+def seed_database(conn: sqlite3.Connection, users: int, history_rows: int,
+                  password_hash: str = "x", seed: int = 42, progress: bool = False):
+    """Заполняет пустую базу (схема уже создана).
+
+    Игроки называются user1..userN; история размазана по секундам,
+    начиная с HISTORY_START, чтобы played_at шел по возрастанию.
+    """
+    rng = random.Random(seed)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO users (id, username, password_hash, village, ryo, rank, total_earned) "
+        "VALUES (?, ?, ?, ?, ?, 'genin', 0)",
+        ((i, f"user{i}", password_hash, rng.choice(VILLAGES), rng.randint(0, 2_000_000))
+         for i in range(1, users + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO missions (user_id, mission_type, progress, completed, reward) VALUES (?, ?, 0, 0, ?)",
+        ((i, mission, reward) for i in range(1, users + 1) for mission, reward in MISSIONS),
+    )
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'ryo_ledger'").fetchone():
+        # Схема с журналом Рё (v7+): балансы — проводками opening, уже учтенными снимком
+        conn.execute("INSERT INTO ryo_ledger (user_id, reason, delta) SELECT id, 0, ryo FROM users ORDER BY id")
+        conn.execute(
+            "INSERT INTO ledger_snapshots (seq, created_at, accounts) "
+            "SELECT MAX(seq), CAST(strftime('%s', 'now') AS INTEGER), COUNT(*) FROM ryo_ledger"
+        )
+    conn.commit()
+
+    def history(start: int, count: int):
+        for i in range(start, start + count):
+            bet = rng.randint(10, 1000)
+            win = bet * rng.choice((0, 0, 1, 2))
+            yield (rng.randint(1, users), rng.choice(GAMES), bet, win, "win" if win else "lose",
+                   time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(HISTORY_START + i)))
+
+    batch = 1_000_000
+    started = time.perf_counter()
+    for start in range(0, history_rows, batch):
+        count = min(batch, history_rows - start)
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO game_history (user_id, game_type, bet_amount, win_amount, result, played_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            history(start, count),
+        )
+        conn.commit()
+        if progress:
+            done = start + count
+            print(f"  история: {done:,}/{history_rows:,} ({done / (time.perf_counter() - started):,.0f} строк/с)")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'analytics_rollups'").fetchone():
+        # Схема со сводками аналитики (v8+): историю не учитывать — ее строит rebuild-analytics
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) "
+                     "SELECT 'analytics_history_id', COALESCE(MAX(id), 0) FROM game_history")
+        conn.commit()
+    conn.execute("PRAGMA synchronous = NORMAL")
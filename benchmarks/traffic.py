@@ -0,0 +1,95 @@
+"""Смешанный трафик к ASGI-приложению внутри процесса (httpx.ASGITransport).
+
+Сценарии повторяют то, что делает фронтенд в index.html:
+- вход: /api/login, затем /api/missions и /api/daily-reward;
+- игра: /api/game/{игра}, затем /api/missions (loadMissions после игры);
+- вкладки: /api/leaderboard и /api/stats;
+- регистрация и получение ежедневной награды — изредка.
+"""
+import asyncio
+import random
+import time
+
+import httpx
+
+from benchmarks.common import summarize
+
+GAMES = ["roulette", "slots", "dice", "blackjack"]
+
+# Сценарий -> вес в общем потоке
+TRAFFIC_MIX = {
+    "bet": 60,
+    "leaderboard": 12,
+    "stats": 10,
+    "login": 10,
+    "claim": 5,
+    "register": 3,
+}
+
+
+async def _flow(client: httpx.AsyncClient, flow: str, username: str, rng: random.Random, record):
+    async def call(route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter_ns()
+        response = await client.request(method, url, **kwargs)
+        record(route, time.perf_counter_ns() - started, response.status_code)
+
+    if flow == "bet":
+        game = rng.choice(GAMES)
+        await call(f"POST /api/game/{game}", "POST", f"/api/game/{game}",
+                   json={"username": username, "bet": rng.choice((10, 50, 100)), "element": "fire"})
+        await call("GET /api/missions", "GET", f"/api/missions/{username}")
+    elif flow == "leaderboard":
+        await call("GET /api/leaderboard", "GET", "/api/leaderboard")
+    elif flow == "stats":
+        await call("GET /api/stats", "GET", f"/api/stats/{username}")
+    elif flow == "login":
+        await call("POST /api/login", "POST", "/api/login", params={"username": username, "password": "bench"})
+        await call("GET /api/missions", "GET", f"/api/missions/{username}")
+        await call("GET /api/daily-reward", "GET", f"/api/daily-reward/{username}")
+    elif flow == "claim":
+        await call("POST /api/claim-daily-reward", "POST", "/api/claim-daily-reward", json={"username": username})
+    elif flow == "register":
+        await call("POST /api/register", "POST", "/api/register",
+                   json={"username": f"new_{rng.getrandbits(64):x}", "password": "bench", "village": "konoha"})
+
+
+async def _run(app, users: int, clients: int, duration: float, seed: int) -> dict:
+    timings = {}
+    statuses = {}
+
+    def record(route: str, elapsed_ns: int, status: int):
+        timings.setdefault(route, []).append(elapsed_ns)
+        bucket = statuses.setdefault(route, {})
+        bucket[status] = bucket.get(status, 0) + 1
+
+    flows = list(TRAFFIC_MIX)
+    weights = [TRAFFIC_MIX[f] for f in flows]
+    transport = httpx.ASGITransport(app=app)
+    stop_at = time.monotonic() + duration
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker(index: int):
+            rng = random.Random(seed + index)
+            while time.monotonic() < stop_at:
+                username = f"user{rng.randint(1, users)}"
+                await _flow(client, rng.choices(flows, weights)[0], username, rng, record)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    routes = {route: dict(summarize(values, elapsed), statuses=statuses[route])
+              for route, values in sorted(timings.items())}
+    total = sum(len(values) for values in timings.values())
+    return {
+        "clients": clients,
+        "duration_s": round(elapsed, 3),
+        "requests": total,
+        "throughput": round(total / elapsed, 1),
+        "mix": TRAFFIC_MIX,
+        "routes": routes,
+    }
+
+
+def run_traffic(main, users: int, clients: int, duration: float, seed: int = 7) -> dict:
+    return asyncio.run(_run(main.app, users, clients, duration, seed))
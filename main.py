@@ -1,18 +1,198 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from contextlib import closing, contextmanager, asynccontextmanager
+from collections import OrderedDict, deque
+from dataclasses import dataclass, replace
+import os
+import sys
+import pickle
+import queue
 import sqlite3
+import threading
+import bisect
+import cProfile
+import io
+import csv
+import base64
+import urllib.request
+import pstats
+import re
+import struct
+import itertools
+import json
+import signal
+import socket
+import subprocess
+import contextvars
+import time
 import hashlib
+import hmac
+import math
+import multiprocessing
 import random
+import asyncio
+import functools
 import uvicorn
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timedelta, timezone
+
+# Настройки базы данных
+DB_PATH = os.getenv("SHINOBI_DB_PATH", "shinobi_casino.db")
+DB_POOL_SIZE = int(os.getenv("SHINOBI_DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("SHINOBI_DB_POOL_TIMEOUT", "5.0"))
+
+# Прагмы применяются один раз при открытии соединения
+DB_PRAGMAS = {
+    "journal_mode": os.getenv("SHINOBI_DB_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SHINOBI_DB_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SHINOBI_DB_CACHE_KB", "16384")) * -1,  # отрицательное значение = КиБ
+    "mmap_size": int(os.getenv("SHINOBI_DB_MMAP_MB", "256")) * 1024 * 1024,
+    "busy_timeout": int(os.getenv("SHINOBI_DB_BUSY_TIMEOUT_MS", "5000")),
+    "temp_store": "MEMORY",
+}
+
+# Служебные маршруты (/api/admin/*)
+ADMIN_TOKEN = os.getenv("SHINOBI_ADMIN_TOKEN", "")  # пусто — служебные маршруты закрыты
+
+# Отложенная пакетная запись истории игр (выключена по умолчанию)
+HISTORY_BUFFER_ENABLED = os.getenv("SHINOBI_HISTORY_BUFFER", "0") == "1"
+HISTORY_BATCH_ROWS = int(os.getenv("SHINOBI_HISTORY_BATCH_ROWS", "500"))
+HISTORY_FLUSH_MS = int(os.getenv("SHINOBI_HISTORY_FLUSH_MS", "50"))
+HISTORY_QUEUE_SIZE = int(os.getenv("SHINOBI_HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_PUT_TIMEOUT = float(os.getenv("SHINOBI_HISTORY_PUT_TIMEOUT", "1.0"))
+HISTORY_RETRY_SECONDS = 1.0  # через сколько повторить пачку, которую не удалось записать
+
+# Архив истории игр: строки старше ARCHIVE_AFTER_DAYS переезжают в помесячные файлы
+ARCHIVE_DIR = os.getenv("SHINOBI_ARCHIVE_DIR", "")  # пусто — рядом с базой, <имя базы>_archive
+ARCHIVE_AFTER_DAYS = int(os.getenv("SHINOBI_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_CHUNK_ROWS = int(os.getenv("SHINOBI_ARCHIVE_CHUNK_ROWS", "2000"))
+ARCHIVE_PAUSE_MS = int(os.getenv("SHINOBI_ARCHIVE_PAUSE_MS", "20"))
+ARCHIVE_INTERVAL = float(os.getenv("SHINOBI_ARCHIVE_INTERVAL", "0"))  # секунды между проходами, 0 — выключено
+
+# Аналитика: сводки ставок по играм и деревням за минуту, час и день
+ANALYTICS_INTERVAL = float(os.getenv("SHINOBI_ANALYTICS_INTERVAL", "5"))  # секунды между проходами, 0 — только командой
+ANALYTICS_CHUNK_ROWS = int(os.getenv("SHINOBI_ANALYTICS_CHUNK_ROWS", "5000"))
+ANALYTICS_RETENTION_DAYS = {  # 0 — хранить всегда
+    "minute": int(os.getenv("SHINOBI_ANALYTICS_MINUTE_DAYS", "2")),
+    "hour": int(os.getenv("SHINOBI_ANALYTICS_HOUR_DAYS", "90")),
+    "day": int(os.getenv("SHINOBI_ANALYTICS_DAY_DAYS", "0")),
+}
+ANALYTICS_MAX_ROWS = 10000
+
+# Турниры
+TOURNAMENT_PERSIST_SECONDS = float(os.getenv("SHINOBI_TOURNAMENT_PERSIST_SECONDS", "10"))
+TOURNAMENT_MAX_PRIZES = 100
+TOURNAMENT_MAX_PRIZE = 10 ** 9  # за одно место; сумма призов далеко от предела INTEGER (2^63)
+TOURNAMENT_MIN_DAYS = 1 / 24
+TOURNAMENT_MAX_DAYS = 366
+
+# Метрики
+SQL_METRICS_ENABLED = os.getenv("SHINOBI_SQL_METRICS", "1") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("SHINOBI_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("SHINOBI_PROFILE_SLOW_MS", "250"))
+PROFILE_KEEP = int(os.getenv("SHINOBI_PROFILE_KEEP", "20"))
+
+# Асинхронный доступ к базе: "async" — свои пулы потоков и единый писатель,
+# "sync" — как раньше, через общий пул потоков Starlette, "remote" — записи
+# уходят процессу-писателю (воркеры многопроцессного режима)
+DB_MODE = os.getenv("SHINOBI_DB_MODE", "async")
+DB_READ_WORKERS = int(os.getenv("SHINOBI_DB_READ_WORKERS", str(DB_POOL_SIZE)))
+DB_WRITE_BATCH = int(os.getenv("SHINOBI_DB_WRITE_BATCH", "64"))
+
+# Процесс-писатель многопроцессного режима
+WRITER_SOCKET = os.getenv("SHINOBI_WRITER_SOCKET", "") or os.path.splitext(DB_PATH)[0] + ".writer.sock"
+WRITER_TIMEOUT = float(os.getenv("SHINOBI_WRITER_TIMEOUT", "30.0"))
+
+# Кэш пользователей
+USER_CACHE_SIZE = int(os.getenv("SHINOBI_USER_CACHE_SIZE", "100000"))
+USER_CACHE_TTL = float(os.getenv("SHINOBI_USER_CACHE_TTL", "30.0"))
+
+# Генератор случайных чисел для игр: пусто — os.urandom, иначе воспроизводимый поток от seed
+RNG_SEED = os.getenv("SHINOBI_RNG_SEED", "")
+RNG_BUFFER_BYTES = int(os.getenv("SHINOBI_RNG_BUFFER_BYTES", "4096"))
+
+# Пакетные ставки
+BATCH_MAX_ROUNDS = int(os.getenv("SHINOBI_BATCH_MAX_ROUNDS", "1000"))
+
+# История игр: максимальная страница API и размер пачки при выгрузке
+HISTORY_PAGE_MAX = int(os.getenv("SHINOBI_HISTORY_PAGE_MAX", "500"))
+HISTORY_EXPORT_CHUNK = int(os.getenv("SHINOBI_HISTORY_EXPORT_CHUNK", "1000"))
+
+# Пароли: scrypt в отдельном пуле процессов
+PASSWORD_SCRYPT_N = int(os.getenv("SHINOBI_SCRYPT_N", "16384"))
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+KDF_WORKERS = int(os.getenv("SHINOBI_KDF_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+KDF_MAX_PENDING = int(os.getenv("SHINOBI_KDF_MAX_PENDING", "32"))
+
+# Стартовый баланс и ежедневная награда
+SIGNUP_RYO = 1000
+DAILY_REWARD_AMOUNT = 500
+DAILY_REWARD_INTERVAL = 24 * 3600  # секунды между наградами
+
+# Журнал Рё: балансы из памяти сворачиваются в users снимком каждые N проводок или T секунд
+LEDGER_SNAPSHOT_ENTRIES = int(os.getenv("SHINOBI_LEDGER_SNAPSHOT_ENTRIES", "10000"))
+LEDGER_SNAPSHOT_SECONDS = float(os.getenv("SHINOBI_LEDGER_SNAPSHOT_SECONDS", "30"))
+
+# Токены сессии
+SESSION_SECRET = os.getenv("SHINOBI_SESSION_SECRET", "")  # пусто — секрет из таблицы settings
+SESSION_TTL = int(os.getenv("SHINOBI_SESSION_TTL", str(7 * 24 * 3600)))
+SESSION_CACHE_SIZE = int(os.getenv("SHINOBI_SESSION_CACHE_SIZE", "100000"))
+SESSION_REQUIRED = os.getenv("SHINOBI_SESSION_REQUIRED", "0") == "1"
+
+# Допуск ставок и наград: лимит частоты на игрока и повторы по Idempotency-Key
+RATE_LIMIT_PER_SECOND = float(os.getenv("SHINOBI_RATE_LIMIT_PER_SECOND", "20"))  # 0 — без лимита
+RATE_LIMIT_BURST = int(os.getenv("SHINOBI_RATE_LIMIT_BURST", "40"))
+RATE_LIMIT_SWEEP_SECONDS = 60
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("SHINOBI_IDEMPOTENCY_CACHE_SIZE", "100000"))
+IDEMPOTENCY_TTL = float(os.getenv("SHINOBI_IDEMPOTENCY_TTL", "3600"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Таблица лидеров в памяти
+LEADERBOARD_CACHE_TTL = float(os.getenv("SHINOBI_LEADERBOARD_CACHE_TTL", "1.0"))
+LEADERBOARD_MAX_LIMIT = 1000
+LEADERBOARD_CACHE_SIZE = 256
+
+# Поток событий для фронтенда (SSE)
+STREAM_QUEUE_SIZE = int(os.getenv("SHINOBI_STREAM_QUEUE_SIZE", "64"))
+STREAM_PING_SECONDS = float(os.getenv("SHINOBI_STREAM_PING_SECONDS", "15"))
+STREAM_LEADERBOARD_INTERVAL = float(os.getenv("SHINOBI_STREAM_LEADERBOARD_INTERVAL", "1.0"))
+STREAM_LEADERBOARD_SIZE = 10
+# Открытые потоки SSE не закрываются сами: столько секунд uvicorn ждет их при остановке
+STREAM_SHUTDOWN_SECONDS = 5
+
+
+@asynccontextmanager
+async def lifespan(app):
+    adb.start()
+    if adb.remote:
+        await adb.remote.connect()
+    if tournaments:
+        tournaments.start()
+    stream_hub.start()
+    yield
+    # Дописываем очередь записи и буфер истории, закрываем соединения
+    await stream_hub.close()
+    password_hasher.close()
+    await adb.close()
+    if missions:
+        missions.flush()
+    if tournaments:
+        tournaments.close()
+    db.close()
+
 
 # Инициализация приложения (ТОЛЬКО ОДИН РАЗ!)
 app = FastAPI(
     title="🎌 Shinobi Casino: Village Legacy",
     description="Игровая вселенная с системой заработка",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # Настройка CORS
@@ -30,369 +210,4889 @@ class UserCreate(BaseModel):
     password: str
     village: str = "konoha"
 
-class GameRequest(BaseModel):
+class LoginRequest(BaseModel):
     username: str
+    password: str
+
+class GameRequest(BaseModel):
+    username: Optional[str] = None
     bet: int
     element: Optional[str] = None
 
 class DailyReward(BaseModel):
-    username: str
+    username: Optional[str] = None
 
+class BatchGameRequest(BaseModel):
+    username: Optional[str] = None
+    bet: Optional[int] = None
+    rounds: int = Field(1, ge=1, le=BATCH_MAX_ROUNDS)
+    bets: Optional[List[int]] = Field(None, min_length=1, max_length=BATCH_MAX_ROUNDS)
+    element: Optional[str] = None
 
-# База данных
-class Database:
-    def __init__(self):
-        self.init_database()
+class TournamentCreate(BaseModel):
+    name: str
+    scoring: Literal["net_win", "biggest_multiplier", "wagered"] = "net_win"
+    games: List[str] = []  # пусто — все игры
+    prizes: List[int]      # призы за места с первого
+    starts_at: Optional[str] = None  # ISO, UTC; по умолчанию — сейчас
+    days: float = Field(7, ge=TOURNAMENT_MIN_DAYS, le=TOURNAMENT_MAX_DAYS)
+
+
+# Ранги: минимальный баланс -> звание (от старшего к младшему)
+RANKS = [
+    (1000000, 'kage'),
+    (100000, 'jonin'),
+    (10000, 'chunin'),
+    (0, 'genin'),
+]
+
+
+def rank_sql(balance_expr: str) -> str:
+    """SQL-выражение CASE, вычисляющее ранг так же, как calculate_rank"""
+    branches = " ".join(f"WHEN {balance_expr} >= {threshold} THEN '{rank}'" for threshold, rank in RANKS[:-1])
+    return f"CASE {branches} ELSE '{RANKS[-1][1]}' END"
+
+
+# Журнал Рё: коды причин проводок (хранятся числом)
+LEDGER_OPENING = 0      # остаток на момент перехода на журнал (миграция v7)
+LEDGER_SIGNUP = 1       # стартовый баланс
+LEDGER_BET = 2          # раунд игры: выигрыш минус ставка
+LEDGER_DAILY_REWARD = 3
+LEDGER_MISSION = 4
+LEDGER_ADJUSTMENT = 5   # update_balance
+LEDGER_TOURNAMENT = 6   # приз турнира
+LEDGER_REASONS = {
+    LEDGER_OPENING: 'opening',
+    LEDGER_SIGNUP: 'signup',
+    LEDGER_BET: 'bet',
+    LEDGER_DAILY_REWARD: 'daily_reward',
+    LEDGER_MISSION: 'mission',
+    LEDGER_ADJUSTMENT: 'adjustment',
+    LEDGER_TOURNAMENT: 'tournament',
+}
+# В total_earned идут положительные проводки, кроме стартовых
+LEDGER_EARNED_SQL = f"CASE WHEN delta > 0 AND reason > {LEDGER_SIGNUP} THEN delta ELSE 0 END"
+
+
+def ledger_earned(reason: int, delta: int) -> int:
+    """Сколько проводка добавляет к total_earned — так же, как LEDGER_EARNED_SQL"""
+    return delta if delta > 0 and reason > LEDGER_SIGNUP else 0
+
+
+# Миссии
+@dataclass(frozen=True)
+class MissionSpec:
+    trigger: str     # 'bets' — сыгранные раунды, 'earned' — total_earned, 'rank' — достигнут ли ранг
+    target: int
+    reward: int
+    checkpoint: int  # прогресс пишется в базу, когда пересекает кратное этому числу
+
+
+MISSION_SPECS = {
+    'play_10_games': MissionSpec('bets', 10, 500, 5),
+    'earn_5000_ryo': MissionSpec('earned', 5000, 1000, 1000),
+    'reach_chunin': MissionSpec('rank', 1, 2000, 1),
+}
+MISSION_RANK = 'chunin'  # reach_chunin: этот ранг или старше
+
+
+def mission_target_sql() -> str:
+    """SQL-выражение CASE: цель миссии по mission_type"""
+    branches = " ".join(f"WHEN '{mission_type}' THEN {spec.target}" for mission_type, spec in MISSION_SPECS.items())
+    return f"CASE mission_type {branches} END"
+
+
+# Турниры
+@dataclass(frozen=True)
+class ScoringRule:
+    points: object   # (ставка, выигрыш) -> очки раунда
+    aggregate: str   # 'sum' — очки раундов складываются, 'max' — в зачет идет лучший раунд
+    sql: str         # очки раунда по строке game_history — для пересчета по истории
+
+
+TOURNAMENT_SCORING = {
+    'net_win': ScoringRule(lambda bet, win: win - bet, 'sum', 'win_amount - bet_amount'),
+    'wagered': ScoringRule(lambda bet, win: bet, 'sum', 'bet_amount'),
+    'biggest_multiplier': ScoringRule(lambda bet, win: round(win / bet, 4) if bet else 0.0, 'max',
+                                      'ROUND(CAST(win_amount AS REAL) / bet_amount, 4)'),
+}
+TOURNAMENT_COLUMNS = ("id", "name", "scoring", "games", "prizes", "starts_at", "ends_at", "status", "closed_at")
+
+
+# Метрики
+LATENCY_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.5, 2.5)
+
+METRIC_HELP = {
+    "shinobi_http_request_duration_seconds": ("histogram", "Время обработки HTTP-запроса по маршруту"),
+    "shinobi_sql_statement_duration_seconds": ("histogram", "Время выполнения SQL-запроса по виду запроса и таблице"),
+    "shinobi_sql_commits_total": ("counter", "Коммиты SQLite"),
+    "shinobi_sql_rollbacks_total": ("counter", "Откаты SQLite"),
+    "shinobi_bets_total": ("counter", "Сыгранные раунды по игре, деревне и исходу"),
+    "shinobi_wagered_ryo_total": ("counter", "Сумма ставок в Рё"),
+    "shinobi_payout_ryo_total": ("counter", "Сумма выплат в Рё"),
+    "shinobi_kdf_duration_seconds": ("histogram", "Время хеширования и проверки пароля (с ожиданием в очереди)"),
+    "shinobi_kdf_rejected_total": ("counter", "Входы и регистрации, отклоненные из-за очереди хеширования"),
+}
+
+
+class Metrics:
+    """Счетчики и гистограммы с накоплением по потокам.
+
+    Каждый поток пишет в свои словари без блокировок; при выдаче /metrics
+    значения всех потоков складываются. Метка — кортеж пар (имя, значение).
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._stores = []
+        self._stores_lock = threading.Lock()
+        self._collectors = []
+
+    def _store(self):
+        store = getattr(self._local, "store", None)
+        if store is None:
+            store = self._local.store = ({}, {})
+            with self._stores_lock:
+                self._stores.append(store)
+        return store
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        counters = self._store()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: tuple, seconds: float):
+        histograms = self._store()[1]
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def add_collector(self, collector):
+        """collector() -> список (имя, тип, справка, метки, значение) для текущих значений"""
+        self._collectors.append(collector)
+
+    def _merged(self):
+        with self._stores_lock:
+            stores = list(self._stores)
+        counters, histograms = {}, {}
+        for store_counters, store_histograms in stores:
+            for key, value in list(store_counters.items()):
+                counters[key] = counters.get(key, 0) + value
+            for key, values in list(store_histograms.items()):
+                merged = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(list(values)):
+                    merged[i] += value
+        return counters, histograms
 
-    def init_database(self):
-        conn = sqlite3.connect("shinobi_casino.db")
+    @staticmethod
+    def _labels(labels: tuple, extra: tuple = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ") for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus"""
+        counters, histograms = self._merged()
+        lines = []
+        described = set()
+
+        def describe(name: str, kind: str, help_text: str):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, *METRIC_HELP.get(name, ("counter", name)))
+            lines.append(f"{name}{self._labels(labels)} {value}")
+
+        for (name, labels), values in sorted(histograms.items()):
+            describe(name, *METRIC_HELP.get(name, ("histogram", name)))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, (('le', bound),))} {cumulative}")
+            cumulative += values[len(self.buckets)]
+            lines.append(f"{name}_bucket{self._labels(labels, (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {values[-1]}")
+            lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+
+        for collector in self._collectors:
+            for name, kind, help_text, labels, value in collector():
+                describe(name, kind, help_text)
+                lines.append(f"{name}{self._labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+_SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+["\[]?([\w.]+)', re.IGNORECASE)
+_sql_labels = {}
+
+
+def sql_labels(sql: str) -> tuple:
+    """Метки запроса: вид (select, insert, ...) и первая таблица.
+
+    Полный текст в метки не идет: у каждой метки своя гистограмма, а разных
+    текстов сотни. Имя базы перед таблицей (архивы) отбрасывается.
+    """
+    labels = _sql_labels.get(sql)
+    if labels is None:
+        words = sql.split(None, 1)
+        match = _SQL_TABLE.search(sql)
+        labels = (("operation", words[0].lower() if words else ""),
+                  ("table", match.group(1).rsplit(".", 1)[-1].lower() if match else ""))
+        if len(_sql_labels) < 10000:
+            _sql_labels[sql] = labels
+    return labels
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe("shinobi_sql_statement_duration_seconds", sql_labels(sql),
+                            time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe("shinobi_sql_statement_duration_seconds", sql_labels(sql),
+                            time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, которое замеряет каждый запрос и считает коммиты"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        cursor = self.cursor()
+        cursor.execute(sql, parameters)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        cursor = self.cursor()
+        cursor.executemany(sql, seq_of_parameters)
+        return cursor
+
+    def commit(self):
+        if self.in_transaction:
+            metrics.inc("shinobi_sql_commits_total")
+        return super().commit()
+
+    def rollback(self):
+        if self.in_transaction:
+            metrics.inc("shinobi_sql_rollbacks_total")
+        return super().rollback()
+
+
+# Пул соединений
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite с привязкой к потоку.
+
+    Поток получает соединение из пула при первом обращении и держит его,
+    пока не выйдет из самого внешнего ``with pool.connection()``. Вложенные
+    вызовы в том же потоке получают то же самое соединение.
+    """
+
+    def __init__(self, path: str = DB_PATH, size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT, pragmas: Optional[dict] = None):
+        if size < 1:
+            raise ValueError("Размер пула должен быть не меньше 1")
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = DB_PRAGMAS if pragmas is None else pragmas
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+        self._closed = False
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+
+    def _open(self) -> sqlite3.Connection:
+        factory = InstrumentedConnection if SQL_METRICS_ENABLED else sqlite3.Connection
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, factory=factory)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Пул соединений закрыт")
+            can_open = len(self._all) < self.size
+            if can_open:
+                self.misses += 1
+                # Резервируем место до открытия, чтобы не превысить размер пула
+                self._all.append(None)
+
+        if can_open:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._lock:
+                    self._all.remove(None)
+                raise
+            with self._lock:
+                self._all[self._all.index(None)] = conn
+            return conn
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError("Нет свободных соединений с базой данных")
+        with self._lock:
+            self.waits += 1
+            self.wait_time += time.perf_counter() - started
+        return conn
+
+    def _checkin(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Выдает соединение текущего потока (реентерабельно)"""
+        local = self._local
+        if getattr(local, "depth", 0):
+            local.depth += 1
+            try:
+                yield local.conn
+            finally:
+                local.depth -= 1
+            return
+
+        conn = self._checkout()
+        local.conn = conn
+        local.depth = 1
+        try:
+            yield conn
+        finally:
+            local.depth = 0
+            local.conn = None
+            self._checkin(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            opened = len([c for c in self._all if c is not None])
+            return {
+                "size": self.size,
+                "open": opened,
+                "idle": self._idle.qsize(),
+                "in_use": opened - self._idle.qsize(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.wait_time / self.waits * 1000, 3) if self.waits else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def rebuild_user_stats(cursor, archives: tuple = (), stats_table: str = 'user_stats',
+                       game_stats_table: str = 'user_game_stats'):
+    """Заполняет агрегаты статистики по всей game_history (внутри транзакции).
+
+    archives — пути помесячных архивов истории: их агрегаты досчитываются
+    поверх основной таблицы. Таблицы-приемники можно подменить (check-stats
+    считает во временные).
+    """
+    cursor.execute(f'DELETE FROM {stats_table}')
+    cursor.execute(f'DELETE FROM {game_stats_table}')
+    cursor.execute(f'''
+        INSERT INTO {stats_table} (user_id, games_played, total_bet, total_win, biggest_win, last_played_at)
+        SELECT user_id, COUNT(*), COALESCE(SUM(bet_amount), 0), COALESCE(SUM(win_amount), 0),
+               COALESCE(MAX(win_amount), 0), MAX(played_at)
+        FROM game_history
+        GROUP BY user_id
+    ''')
+    cursor.execute(f'''
+        INSERT INTO {game_stats_table} (user_id, game_type, games_played, total_bet, total_win, biggest_win)
+        SELECT user_id, game_type, COUNT(*), COALESCE(SUM(bet_amount), 0), COALESCE(SUM(win_amount), 0),
+               COALESCE(MAX(win_amount), 0)
+        FROM game_history
+        GROUP BY user_id, game_type
+    ''')
+
+    for path in archives:
+        with closing(sqlite3.connect(path)) as archive:
+            cursor.executemany(f'''
+                INSERT INTO {stats_table} (user_id, games_played, total_bet, total_win, biggest_win, last_played_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    games_played = games_played + excluded.games_played,
+                    total_bet = total_bet + excluded.total_bet,
+                    total_win = total_win + excluded.total_win,
+                    biggest_win = MAX(biggest_win, excluded.biggest_win),
+                    last_played_at = MAX(COALESCE(last_played_at, ''), excluded.last_played_at)
+            ''', archive.execute('''
+                SELECT user_id, COUNT(*), COALESCE(SUM(bet_amount), 0), COALESCE(SUM(win_amount), 0),
+                       COALESCE(MAX(win_amount), 0), MAX(played_at)
+                FROM game_history
+                GROUP BY user_id
+            '''))
+            cursor.executemany(f'''
+                INSERT INTO {game_stats_table} (user_id, game_type, games_played, total_bet, total_win, biggest_win)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, game_type) DO UPDATE SET
+                    games_played = games_played + excluded.games_played,
+                    total_bet = total_bet + excluded.total_bet,
+                    total_win = total_win + excluded.total_win,
+                    biggest_win = MAX(biggest_win, excluded.biggest_win)
+            ''', archive.execute('''
+                SELECT user_id, game_type, COUNT(*), COALESCE(SUM(bet_amount), 0), COALESCE(SUM(win_amount), 0),
+                       COALESCE(MAX(win_amount), 0)
+                FROM game_history
+                GROUP BY user_id, game_type
+            '''))
+
+
+def ledger_tail(cursor, user_id: Optional[int] = None) -> dict:
+    """Проводки после последнего снимка: user_id -> (изменение ryo, изменение total_earned).
+
+    Баланс игрока — строка users плюс его хвост журнала. Хвост не длиннее
+    LEDGER_SNAPSHOT_ENTRIES проводок, поэтому проход по нему недорогой.
+    """
+    condition = 'AND user_id = ?' if user_id is not None else ''
+    cursor.execute(f'''
+        SELECT user_id, SUM(delta), SUM({LEDGER_EARNED_SQL})
+        FROM ryo_ledger
+        WHERE seq > (SELECT COALESCE(MAX(seq), 0) FROM ledger_snapshots) {condition}
+        GROUP BY user_id
+    ''', () if user_id is None else (user_id,))
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+def migrate(conn: sqlite3.Connection, target: Optional[int] = None) -> int:
+    """Доводит схему до версии target (по умолчанию — до последней).
+
+    Каждая миграция выполняется в своей транзакции вместе с обновлением
+    PRAGMA user_version, поэтому прерванная миграция повторится целиком.
+    Версия перечитывается под блокировкой записи: процессы, запущенные
+    одновременно, не применят одну миграцию дважды.
+    """
+    target = SCHEMA_VERSION if target is None else target
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+
+    for number, description, steps in MIGRATIONS:
+        if number <= version or number > target:
+            continue
         cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if number <= version:
+            # Другой процесс успел применить ее, пока мы ждали блокировку
+            conn.rollback()
+            continue
+        try:
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(f'PRAGMA user_version = {number}')
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        version = number
+        print(f"🔧 Миграция схемы v{number}: {description}")
 
-        # Пользователи
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                village TEXT DEFAULT 'konoha',
-                ryo INTEGER DEFAULT 1000,
-                rank TEXT DEFAULT 'genin',
-                last_daily_reward TIMESTAMP,
-                total_earned INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+    return version
 
-        # История игр
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS game_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                game_type TEXT,
-                bet_amount INTEGER,
-                win_amount INTEGER,
-                result TEXT,
-                played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
 
-        # Ежедневные награды
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS daily_rewards (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                reward_amount INTEGER,
-                claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
 
+# Миграции схемы: (версия, описание, шаги). Шаг — SQL-строка или функция от курсора.
+# Версия хранится в PRAGMA user_version; новые миграции добавляются только в конец.
+MIGRATIONS = [
+    (1, "базовая схема", [
+        # Пользователи
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            village TEXT DEFAULT 'konoha',
+            ryo INTEGER DEFAULT 1000,
+            rank TEXT DEFAULT 'genin',
+            last_daily_reward TIMESTAMP,
+            total_earned INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # История игр
+        '''
+        CREATE TABLE IF NOT EXISTS game_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            game_type TEXT,
+            bet_amount INTEGER,
+            win_amount INTEGER,
+            result TEXT,
+            played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Ежедневные награды
+        '''
+        CREATE TABLE IF NOT EXISTS daily_rewards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            reward_amount INTEGER,
+            claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
         # Миссии
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS missions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                mission_type TEXT,
-                progress INTEGER DEFAULT 0,
-                completed BOOLEAN DEFAULT 0,
-                reward INTEGER
-            )
-        ''')
+        '''
+        CREATE TABLE IF NOT EXISTS missions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            mission_type TEXT,
+            progress INTEGER DEFAULT 0,
+            completed BOOLEAN DEFAULT 0,
+            reward INTEGER
+        )
+        ''',
+    ]),
+    (2, "индексы для статистики, миссий и таблицы лидеров", [
+        'CREATE INDEX IF NOT EXISTS idx_game_history_user_played ON game_history (user_id, played_at)',
+        'CREATE INDEX IF NOT EXISTS idx_missions_user_type ON missions (user_id, mission_type, completed)',
+        'CREATE INDEX IF NOT EXISTS idx_users_ryo ON users (ryo DESC)',
+        'ANALYZE',
+    ]),
+    (3, "агрегаты статистики игроков", [
+        '''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            games_played INTEGER NOT NULL DEFAULT 0,
+            total_bet INTEGER NOT NULL DEFAULT 0,
+            total_win INTEGER NOT NULL DEFAULT 0,
+            biggest_win INTEGER NOT NULL DEFAULT 0,
+            last_played_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_game_stats (
+            user_id INTEGER NOT NULL,
+            game_type TEXT NOT NULL,
+            games_played INTEGER NOT NULL DEFAULT 0,
+            total_bet INTEGER NOT NULL DEFAULT 0,
+            total_win INTEGER NOT NULL DEFAULT 0,
+            biggest_win INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, game_type)
+        ) WITHOUT ROWID
+        ''',
+        rebuild_user_stats,
+    ]),
+    (4, "индекс истории игр по типу игры", [
+        'CREATE INDEX IF NOT EXISTS idx_game_history_user_game_played ON game_history (user_id, game_type, played_at)',
+        'ANALYZE game_history',
+    ]),
+    (5, "настройки и отозванные токены сессии", [
+        'CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID',
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('session_secret', lower(hex(randomblob(32))))",
+        '''
+        CREATE TABLE IF NOT EXISTS revoked_sessions (
+            token_id BLOB PRIMARY KEY,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (6, "время ежедневной награды в секундах unix", [
+        # Раньше писалось datetime.now().isoformat() — локальное время
+        '''
+        UPDATE users SET last_daily_reward = CAST(strftime('%s', last_daily_reward, 'utc') AS INTEGER)
+        WHERE typeof(last_daily_reward) = 'text'
+        ''',
+    ]),
+    (7, "журнал Рё и снимки балансов", [
+        # seq — rowid: проводки только дописываются в конец
+        '''
+        CREATE TABLE IF NOT EXISTS ryo_ledger (
+            seq INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            reason INTEGER NOT NULL,
+            delta INTEGER NOT NULL
+        )
+        ''',
+        # users хранит балансы на момент последнего снимка seq
+        '''
+        CREATE TABLE IF NOT EXISTS ledger_snapshots (
+            seq INTEGER PRIMARY KEY,
+            created_at INTEGER NOT NULL,
+            accounts INTEGER NOT NULL
+        )
+        ''',
+        f'INSERT INTO ryo_ledger (user_id, reason, delta) SELECT id, {LEDGER_OPENING}, COALESCE(ryo, 0) FROM users ORDER BY id',
+        '''
+        INSERT INTO ledger_snapshots (seq, created_at, accounts)
+        SELECT COALESCE(MAX(seq), 0), CAST(strftime('%s', 'now') AS INTEGER), COUNT(*) FROM ryo_ledger
+        ''',
+        # users.ryo теперь снимок, а рейтинг строит Leaderboard в памяти:
+        # индекс по нему только удорожал бы запись снимка
+        'DROP INDEX IF EXISTS idx_users_ryo',
+    ]),
+    (8, "сводки аналитики по играм и деревням", [
+        '''
+        CREATE TABLE IF NOT EXISTS analytics_rollups (
+            resolution TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            game_type TEXT NOT NULL,
+            village TEXT NOT NULL,
+            bets INTEGER NOT NULL DEFAULT 0,
+            wagered INTEGER NOT NULL DEFAULT 0,
+            paid INTEGER NOT NULL DEFAULT 0,
+            biggest_win INTEGER NOT NULL DEFAULT 0,
+            players INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (resolution, bucket, game_type, village)
+        ) WITHOUT ROWID
+        ''',
+        # Игроки еще не закрытых интервалов — чтобы считать каждого один раз
+        '''
+        CREATE TABLE IF NOT EXISTS analytics_players (
+            resolution TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            game_type TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (resolution, bucket, game_type, user_id)
+        ) WITHOUT ROWID
+        ''',
+        # Сводки копятся с текущего конца истории; прошлое — командой rebuild-analytics
+        "INSERT OR REPLACE INTO settings (key, value) "
+        "SELECT 'analytics_history_id', COALESCE(MAX(id), 0) FROM game_history",
+    ]),
+    (9, "турниры и турнирные таблицы", [
+        # Время — секунды unix, games — игры через запятую (пусто — все), prizes — JSON-список
+        '''
+        CREATE TABLE IF NOT EXISTS tournaments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            scoring TEXT NOT NULL,
+            games TEXT NOT NULL DEFAULT '',
+            prizes TEXT NOT NULL,
+            starts_at INTEGER NOT NULL,
+            ends_at INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'active',
+            closed_at INTEGER
+        )
+        ''',
+        # reached — номер изменения очков: при равенстве выше тот, кто набрал их раньше.
+        # place и prize заполняются при закрытии турнира
+        '''
+        CREATE TABLE IF NOT EXISTS tournament_standings (
+            tournament_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            score NUMERIC NOT NULL,
+            rounds INTEGER NOT NULL,
+            reached INTEGER NOT NULL,
+            place INTEGER,
+            prize INTEGER,
+            PRIMARY KEY (tournament_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_tournament_standings_place ON tournament_standings (tournament_id, place)',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# Отложенная запись истории
+class HistoryWriter:
+    """Групповая запись game_history в фоновом потоке.
+
+    Строки истории копятся в ограниченной очереди и
+    записываются через executemany одной транзакцией каждые ``batch_rows``
+    строк или ``flush_ms`` миллисекунд. Если очередь переполнена, игровой
+    запрос ждет (backpressure), а по таймауту пишет строку сам.
+
+    Баланс этих раундов уже закоммичен, поэтому строки не выбрасываются.
+    Пачка, упавшая на блокировке или вводе-выводе (OperationalError),
+    остается в памяти и повторяется вместе со следующей. При другой ошибке
+    строки пишутся по одной, а те, что не записались и так, откладываются
+    в файл ``<база>.history-pending.jsonl``. Туда же при остановке уходит
+    все, что так и не удалось записать; при следующем запуске файл
+    дописывается в game_history.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db: "Database", batch_rows: int = HISTORY_BATCH_ROWS,
+                 flush_ms: int = HISTORY_FLUSH_MS, queue_size: int = HISTORY_QUEUE_SIZE,
+                 put_timeout: float = HISTORY_PUT_TIMEOUT):
+        self.db = db
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_ms / 1000
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._lock = threading.Lock()
+        self._failed = []  # строки упавших пачек, ждут повтора (только поток писателя)
+        self.pending_path = os.path.splitext(db.pool.path)[0] + ".history-pending.jsonl"
+        # Метрики
+        self.enqueued = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.backpressure_waits = 0
+        self.sync_fallbacks = 0
+        self.flush_errors = 0
+        self.failed_rows = 0
+        self.parked_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        if os.path.exists(self.pending_path):
+            with open(self.pending_path, encoding="utf-8") as f:
+                self._failed = [tuple(json.loads(line)) for line in f if line.strip()]
+            os.unlink(self.pending_path)
+            print(f"⚠️  История игр: {len(self._failed)} строк из {self.pending_path} будут дописаны")
+        self._thread.start()
+
+    def submit(self, user_id: int, game_type: str, bet: int, win: int, result: str):
+        row = (user_id, game_type, bet, win, result, datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.backpressure_waits += 1
+            try:
+                self._queue.put(row, timeout=self.put_timeout)
+            except queue.Full:
+                # Писатель не успевает: записываем строку синхронно, но не теряем ее
+                with self._lock:
+                    self.sync_fallbacks += 1
+                self._write([row])
+                return
+        with self._lock:
+            self.enqueued += 1
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=HISTORY_RETRY_SECONDS if self._failed else None)
+            except queue.Empty:
+                self._flush([])  # новых строк нет — повторяем упавшие
+                continue
+            if item is self._STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stop:
+                return
+
+    def _flush(self, batch: list):
+        rows = self._failed + batch
+        if not rows:
+            return
+        started = time.perf_counter()
+        try:
+            self._write(rows)
+        except sqlite3.OperationalError as e:
+            # База занята или недоступна — вся пачка ждет повтора
+            self._failed = rows
+            with self._lock:
+                self.flush_errors += 1
+                self.failed_rows = len(rows)
+            print(f"❌ Ошибка записи истории ({len(rows)} строк), повтор через {HISTORY_RETRY_SECONDS:g} с: {e}")
+            return
+        except Exception as e:
+            self._failed = []
+            with self._lock:
+                self.flush_errors += 1
+                self.failed_rows = 0
+            print(f"❌ Ошибка записи истории ({len(rows)} строк), пишем по одной: {e}")
+            self._write_rows(rows)
+            return
+        self._failed = []
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.failed_rows = 0
+            self.flushes += 1
+            self.flushed_rows += len(rows)
+            self.last_flush_ms = elapsed
+            self.total_flush_ms += elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+
+    def _write(self, rows: list):
+        with self.db.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO game_history (user_id, game_type, bet_amount, win_amount, result, played_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+    def _write_rows(self, rows: list):
+        """По одной строке: плохая строка не мешает остальным, а сама откладывается в файл"""
+        rejected = []
+        for row in rows:
+            try:
+                self._write([row])
+            except Exception:
+                rejected.append(row)
+        with self._lock:
+            self.flushed_rows += len(rows) - len(rejected)
+        if rejected:
+            self._park(rejected)
+
+    def _park(self, rows: list):
+        with open(self.pending_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        with self._lock:
+            self.parked_rows += len(rows)
+        print(f"❌ История игр: {len(rows)} строк не записаны в базу и сохранены в {self.pending_path}")
+
+    def close(self):
+        """Дописывает все, что осталось в очереди, и останавливает поток"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+            if self._failed:
+                # Последняя попытка; что не записалось — в файл, его допишет следующий запуск
+                self._flush([])
+                if self._failed:
+                    self._park(self._failed)
+                    self._failed = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "enqueued": self.enqueued,
+                "flushed_rows": self.flushed_rows,
+                "flushes": self.flushes,
+                "backpressure_waits": self.backpressure_waits,
+                "sync_fallbacks": self.sync_fallbacks,
+                "flush_errors": self.flush_errors,
+                "failed_rows": self.failed_rows,
+                "parked_rows": self.parked_rows,
+                "last_flush_ms": round(self.last_flush_ms, 3),
+                "max_flush_ms": round(self.max_flush_ms, 3),
+                "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            }
 
-        conn.commit()
-        conn.close()
-        print("✅ База данных инициализирована")
 
-    def get_connection(self):
-        return sqlite3.connect("shinobi_casino.db")
+# Архив истории игр
+class HistoryArchive:
+    """Холодная часть game_history: помесячные файлы SQLite.
+
+    Строки старше ``after_days`` дней переносятся из основной базы в файл
+    своего месяца (game_history_ГГГГ_ММ.db) пачками по ``chunk_rows`` строк.
+    Пачка — одна короткая транзакция: архив подключается через ATTACH, строки
+    копируются и удаляются из основной таблицы, между пачками — пауза, чтобы
+    блокировка записи не задерживала ставки.
+
+    Пачка берется с начала таблицы по id (дешево при любом размере), и в нее
+    попадает только один месяц. В WAL транзакция атомарна лишь в пределах
+    файла, поэтому копирование идемпотентно (INSERT OR IGNORE по id): после
+    сбоя строка может временно оказаться в обоих местах, но следующий проход
+    удалит ее из основной базы, а чтение по ключу (played_at, id) не выдаст
+    ее дважды.
+    """
+
+    def __init__(self, db: "Database", directory: str, after_days: int = ARCHIVE_AFTER_DAYS,
+                 chunk_rows: int = ARCHIVE_CHUNK_ROWS, pause_ms: int = ARCHIVE_PAUSE_MS,
+                 interval: float = ARCHIVE_INTERVAL):
+        self.db = db
+        self.directory = directory
+        self.after_days = after_days
+        self.chunk_rows = chunk_rows
+        self.pause = pause_ms / 1000
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._months = []
+        self._mtime = None  # время изменения каталога при последнем сканировании
+        # Статистика
+        self.moved_rows = 0
+        self.chunks = 0
+        self.runs = 0
+        self.errors = 0
+        self.last_run_at = None
+        self.max_chunk_ms = 0.0
+
+    def _scan(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        found = re.compile(r"^game_history_(\d{4})_(\d{2})\.db$")
+        return sorted(f"{m.group(1)}-{m.group(2)}" for m in map(found.match, os.listdir(self.directory)) if m)
+
+    def path(self, month: str) -> str:
+        return os.path.join(self.directory, f"game_history_{month.replace('-', '_')}.db")
+
+    def months(self) -> list:
+        """Месяцы с архивами, ГГГГ-ММ по возрастанию"""
+        # Архив может пополнить другой процесс (писатель, команда archive) — сверяемся с каталогом
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self._months = self._scan()
+            return list(self._months)
+
+    def paths(self) -> list:
+        return [self.path(month) for month in self.months()]
 
-    def create_user(self, username: str, password_hash: str, village: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    @staticmethod
+    def month_bounds(month: str) -> tuple:
+        year, number = map(int, month.split("-"))
+        start = f"{year:04d}-{number:02d}-01 00:00:00"
+        year, number = (year + 1, 1) if number == 12 else (year, number + 1)
+        return start, f"{year:04d}-{number:02d}-01 00:00:00"
+
+    def _ensure(self, month: str) -> str:
+        path = self.path(month)
+        self.months()
+        with self._lock:
+            if month in self._months:
+                return path
+            os.makedirs(self.directory, exist_ok=True)
+            with closing(sqlite3.connect(path, isolation_level=None)) as conn:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS game_history (
+                        id INTEGER PRIMARY KEY,
+                        user_id INTEGER,
+                        game_type TEXT,
+                        bet_amount INTEGER,
+                        win_amount INTEGER,
+                        result TEXT,
+                        played_at TIMESTAMP
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_game_history_user_played '
+                             'ON game_history (user_id, played_at)')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_game_history_user_game_played '
+                             'ON game_history (user_id, game_type, played_at)')
+            bisect.insort(self._months, month)
+        return path
+
+    def query(self, month: str, sql: str, params: list) -> list:
+        """Запрос к архиву одного месяца через отдельное соединение только для чтения"""
+        uri = "file:" + urllib.request.pathname2url(os.path.abspath(self.path(month))) + "?mode=ro"
+        with closing(sqlite3.connect(uri, uri=True, timeout=DB_POOL_TIMEOUT)) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def partitions(self, since: Optional[str], until: Optional[str], after: Optional[tuple],
+                   descending: bool) -> list:
+        """Месяцы архива, которые могут содержать строки выборки, в порядке чтения"""
+        selected = []
+        for month in self.months():
+            start, end = self.month_bounds(month)
+            if (until and until <= start) or (since and since >= end):
+                continue
+            if after and (after[0] < start if descending else after[0] >= end):
+                continue
+            selected.append(month)
+        return selected[::-1] if descending else selected
+
+    def cutoff(self) -> str:
+        return (datetime.utcnow() - timedelta(days=self.after_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def archive_chunk(self, cutoff: str) -> int:
+        """Переносит одну пачку строк одного месяца; 0 — переносить нечего"""
+        with self.db.connection() as conn:
+            rows = conn.execute('SELECT id, played_at FROM game_history ORDER BY id LIMIT ?',
+                                (self.chunk_rows,)).fetchall()
+            if not rows or rows[0][1] >= cutoff:
+                return 0
+            month = rows[0][1][:7]
+            last_id = rows[0][0]
+            for row_id, played_at in rows:
+                if played_at >= cutoff or played_at[:7] != month:
+                    break
+                last_id = row_id
+
+            started = time.perf_counter()
+            conn.execute('ATTACH DATABASE ? AS archive', (self._ensure(month),))
+            try:
+                with self.db.transaction() as cursor:
+                    cursor.execute('''
+                        INSERT OR IGNORE INTO archive.game_history
+                            (id, user_id, game_type, bet_amount, win_amount, result, played_at)
+                        SELECT id, user_id, game_type, bet_amount, win_amount, result, played_at
+                        FROM main.game_history WHERE id BETWEEN ? AND ?
+                    ''', (rows[0][0], last_id))
+                    cursor.execute('DELETE FROM main.game_history WHERE id BETWEEN ? AND ?', (rows[0][0], last_id))
+                    moved = cursor.rowcount
+            finally:
+                conn.execute('DETACH DATABASE archive')
+
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.chunks += 1
+            self.moved_rows += moved
+            self.max_chunk_ms = max(self.max_chunk_ms, elapsed)
+        return moved
+
+    def run(self, cutoff: Optional[str] = None) -> int:
+        """Один проход: переносит пачками все, что старше cutoff"""
+        cutoff = cutoff or self.cutoff()
+        moved = 0
+        with self._run_lock:
+            while not self._stop.is_set():
+                count = self.archive_chunk(cutoff)
+                if not count:
+                    break
+                moved += count
+                time.sleep(self.pause)
+        with self._lock:
+            self.runs += 1
+            self.last_run_at = datetime.utcnow().isoformat()
+        return moved
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                moved = self.run()
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"❌ Ошибка архивации истории: {e}")
+                continue
+            if moved:
+                print(f"🗄️ В архив перенесено строк истории: {moved}")
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="history-archive", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        months = self.months()
+        with self._lock:
+            return {
+                "months": len(months),
+                "oldest_month": months[0] if months else None,
+                "moved_rows": self.moved_rows,
+                "chunks": self.chunks,
+                "runs": self.runs,
+                "errors": self.errors,
+                "last_run_at": self.last_run_at,
+                "max_chunk_ms": round(self.max_chunk_ms, 3),
+            }
 
-        try:
+
+# Аналитика по играм и деревням
+# Разрешение: (длина префикса played_at, дополнение до начала интервала, длина интервала, окно по умолчанию)
+ANALYTICS_BUCKETS = {
+    "minute": (16, ":00", timedelta(minutes=1), timedelta(hours=1)),
+    "hour": (13, ":00:00", timedelta(hours=1), timedelta(days=1)),
+    "day": (10, " 00:00:00", timedelta(days=1), timedelta(days=30)),
+}
+ANALYTICS_LATE_SECONDS = 300  # сколько закончившийся интервал ждет опоздавшие строки истории
+ANALYTICS_COLUMNS = ("bucket", "game_type", "village", "bets", "wagered", "paid", "biggest_win", "players")
+ANALYTICS_HISTORY_SQL = 'SELECT user_id, game_type, bet_amount, win_amount, played_at FROM game_history'
+
+
+class AnalyticsRollup:
+    """Сводки ставок по играм и деревням за минуту, час и день.
+
+    Источник — game_history. Фоновый проход раз в ``interval`` секунд
+    дочитывает строки после водяного знака (id последней учтенной строки
+    в settings) пачками по ``chunk_rows`` и прибавляет их к
+    analytics_rollups. Знак сдвигается в той же транзакции, поэтому каждая
+    строка учитывается ровно один раз — и после сбоя, и когда проходов
+    несколько. Разные игроки считаются через analytics_players, где
+    держатся только еще не закрытые интервалы.
+
+    Минутные и часовые сводки старше срока хранения удаляются — за тот же
+    период остаются более крупные.
+    """
+
+    def __init__(self, db: "Database", interval: float = ANALYTICS_INTERVAL,
+                 chunk_rows: int = ANALYTICS_CHUNK_ROWS, retention_days: Optional[dict] = None):
+        self.db = db
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.retention_days = ANALYTICS_RETENTION_DAYS if retention_days is None else retention_days
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # Статистика
+        self.folded_rows = 0
+        self.chunks = 0
+        self.runs = 0
+        self.errors = 0
+        self.pruned_rows = 0
+        self.last_run_at = None
+        self.max_chunk_ms = 0.0
+
+    @staticmethod
+    def bucket(played_at: str, resolution: str) -> str:
+        """Начало интервала, в который попадает played_at"""
+        length, suffix = ANALYTICS_BUCKETS[resolution][:2]
+        return played_at[:length] + suffix
+
+    def cutoffs(self) -> dict:
+        """Самый ранний хранимый интервал каждого разрешения (None — без ограничения)"""
+        now = datetime.utcnow()
+        return {resolution: (now - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S") if days > 0 else None
+                for resolution, days in self.retention_days.items()}
+
+    def fold(self, cursor, rows: list, cutoffs: dict, rollups: str = 'analytics_rollups',
+             players: str = 'analytics_players') -> Optional[str]:
+        """Прибавляет строки истории (user_id, игра, деревня, ставка, выигрыш, played_at) к сводкам.
+
+        Пачка сначала суммируется в памяти и пишется по одной строке на
+        интервал, игру и деревню. Возвращает самое позднее played_at пачки.
+        """
+        totals = {}
+        members = set()
+        latest = None
+        for user_id, game_type, village, bet, win, played_at in rows:
+            if latest is None or played_at > latest:
+                latest = played_at
+            for resolution in ANALYTICS_BUCKETS:
+                bucket = self.bucket(played_at, resolution)
+                if cutoffs[resolution] and bucket < cutoffs[resolution]:
+                    continue
+                key = (resolution, bucket, game_type, village)
+                total = totals.get(key)
+                if total is None:
+                    total = totals[key] = [0, 0, 0, 0, 0]
+                total[0] += 1
+                total[1] += bet
+                total[2] += win
+                total[3] = max(total[3], win)
+                members.add((key, user_id))
+
+        # Игрок добавляется к интервалу, только если его там еще не было
+        for key, user_id in members:
+            cursor.execute(f'INSERT OR IGNORE INTO {players} (resolution, bucket, game_type, user_id) '
+                           'VALUES (?, ?, ?, ?)', key[:3] + (user_id,))
+            totals[key][4] += cursor.rowcount
+        cursor.executemany(f'''
+            INSERT INTO {rollups} (resolution, bucket, game_type, village, bets, wagered, paid, biggest_win, players)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (resolution, bucket, game_type, village) DO UPDATE SET
+                bets = bets + excluded.bets,
+                wagered = wagered + excluded.wagered,
+                paid = paid + excluded.paid,
+                biggest_win = MAX(biggest_win, excluded.biggest_win),
+                players = players + excluded.players
+        ''', [key + tuple(total) for key, total in totals.items()])
+        return latest
+
+    @staticmethod
+    def _close_intervals(cursor, horizon: str, players: str = 'analytics_players'):
+        """Забывает игроков интервалов, закончившихся до horizon (с запасом на опоздавшие строки)"""
+        moment = datetime.strptime(horizon[:19], "%Y-%m-%d %H:%M:%S") - timedelta(seconds=ANALYTICS_LATE_SECONDS)
+        for resolution, (_, _, span, _) in ANALYTICS_BUCKETS.items():
+            cursor.execute(f'DELETE FROM {players} WHERE resolution = ? AND bucket < ?',
+                           (resolution, (moment - span).strftime("%Y-%m-%d %H:%M:%S")))
+
+    @staticmethod
+    def _watermark(cursor) -> int:
+        cursor.execute("SELECT value FROM settings WHERE key = 'analytics_history_id'")
+        row = cursor.fetchone()
+        return int(row[0]) if row else 0
+
+    def refresh_chunk(self, cutoffs: dict) -> int:
+        """Учитывает одну пачку истории после водяного знака; 0 — учтено все"""
+        started = time.perf_counter()
+        with self.db.transaction() as cursor:
             cursor.execute('''
-                INSERT INTO users (username, password_hash, village, ryo)
-                VALUES (?, ?, ?, 1000)
-            ''', (username, password_hash, village))
-            user_id = cursor.lastrowid
-
-            # Создаем начальные миссии
-            missions = [
-                (user_id, 'play_10_games', 0, 0, 500),
-                (user_id, 'earn_5000_ryo', 0, 0, 1000),
-                (user_id, 'reach_chunin', 0, 0, 2000)
-            ]
-            cursor.executemany('''
-                INSERT INTO missions (user_id, mission_type, progress, completed, reward)
-                VALUES (?, ?, ?, ?, ?)
-            ''', missions)
+                SELECT h.id, h.user_id, COALESCE(h.game_type, ''), COALESCE(u.village, ''),
+                       COALESCE(h.bet_amount, 0), COALESCE(h.win_amount, 0), h.played_at
+                FROM game_history AS h
+                LEFT JOIN users AS u ON u.id = h.user_id
+                WHERE h.id > ?
+                ORDER BY h.id
+                LIMIT ?
+            ''', (self._watermark(cursor), self.chunk_rows))
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+            latest = self.fold(cursor, [row[1:] for row in rows], cutoffs)
+            self._close_intervals(cursor, latest)
+            cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('analytics_history_id', ?)",
+                           (rows[-1][0],))
+
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.chunks += 1
+            self.folded_rows += len(rows)
+            self.max_chunk_ms = max(self.max_chunk_ms, elapsed)
+        return len(rows)
+
+    def prune(self, cutoffs: dict) -> int:
+        """Удаляет сводки старше срока хранения их разрешения"""
+        pruned = 0
+        with self.db.transaction() as cursor:
+            for resolution, cutoff in cutoffs.items():
+                if cutoff:
+                    cursor.execute('DELETE FROM analytics_rollups WHERE resolution = ? AND bucket < ?',
+                                   (resolution, cutoff))
+                    pruned += cursor.rowcount
+        with self._lock:
+            self.pruned_rows += pruned
+        return pruned
+
+    def run(self) -> int:
+        """Один проход: дочитывает историю до конца и чистит сводки по срокам хранения"""
+        folded = 0
+        with self._run_lock:
+            cutoffs = self.cutoffs()
+            while True:
+                count = self.refresh_chunk(cutoffs)
+                folded += count
+                if count < self.chunk_rows:
+                    break
+            self.prune(cutoffs)
+        with self._lock:
+            self.runs += 1
+            self.last_run_at = datetime.utcnow().isoformat()
+        return folded
+
+    def _fold_source(self, cursor, rows, villages: dict, cutoffs: dict) -> int:
+        """Учитывает во временных таблицах поток строк истории пачками по chunk_rows"""
+        folded = 0
+        while True:
+            chunk = rows.fetchmany(self.chunk_rows)
+            if not chunk:
+                return folded
+            latest = self.fold(cursor, [
+                (user_id, game_type or '', villages.get(user_id) or '', bet or 0, win or 0, played_at)
+                for user_id, game_type, bet, win, played_at in chunk
+            ], cutoffs, 'temp.analytics_rebuild', 'temp.analytics_rebuild_players')
+            self._close_intervals(cursor, latest, 'temp.analytics_rebuild_players')
+            folded += len(chunk)
+
+    def rebuild(self) -> int:
+        """Пересчитывает сводки с нуля по всей истории вместе с архивом; возвращает число строк.
+
+        Подсчет идет во временные таблицы внутри транзакции чтения, ставки
+        его не ждут. Затем короткая транзакция записи подменяет сводки и
+        ставит водяной знак на последнюю прочитанную строку: то, что фоновый
+        проход успел учесть после нее, будет учтено заново.
+        """
+        with self._run_lock, self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS analytics_rebuild (
+                    resolution TEXT, bucket TEXT, game_type TEXT, village TEXT, bets INTEGER, wagered INTEGER,
+                    paid INTEGER, biggest_win INTEGER, players INTEGER,
+                    PRIMARY KEY (resolution, bucket, game_type, village)
+                )
+            ''')
+            cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS analytics_rebuild_players (
+                    resolution TEXT, bucket TEXT, game_type TEXT, user_id INTEGER,
+                    PRIMARY KEY (resolution, bucket, game_type, user_id)
+                )
+            ''')
+            try:
+                cursor.execute('BEGIN')
+                cursor.execute('SELECT id, village FROM users')
+                villages = dict(cursor.fetchall())
+                cursor.execute('SELECT MIN(id), COALESCE(MAX(id), 0) FROM game_history')
+                first_id, last_id = cursor.fetchone()
+                cutoffs = self.cutoffs()
+
+                # Из архива — только строки до первой в основной таблице: перенесенные
+                # после начала чтения в ней еще видны и не должны попасть дважды
+                folded = 0
+                for path in self.db.archive.paths():
+                    with closing(sqlite3.connect(path)) as archive:
+                        folded += self._fold_source(cursor, archive.execute(
+                            f'{ANALYTICS_HISTORY_SQL} WHERE id < ? ORDER BY id',
+                            (sys.maxsize if first_id is None else first_id,)
+                        ), villages, cutoffs)
+                folded += self._fold_source(cursor, conn.execute(
+                    f'{ANALYTICS_HISTORY_SQL} WHERE id <= ? ORDER BY id', (last_id,)
+                ), villages, cutoffs)
+                conn.commit()
+
+                with self.db.transaction() as write:
+                    write.execute('DELETE FROM analytics_rollups')
+                    write.execute('DELETE FROM analytics_players')
+                    write.execute('INSERT INTO analytics_rollups SELECT * FROM temp.analytics_rebuild')
+                    write.execute('INSERT INTO analytics_players SELECT * FROM temp.analytics_rebuild_players')
+                    self._close_intervals(write, datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+                    write.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('analytics_history_id', ?)",
+                                  (last_id,))
+            finally:
+                conn.rollback()
+                cursor.execute('DROP TABLE IF EXISTS temp.analytics_rebuild')
+                cursor.execute('DROP TABLE IF EXISTS temp.analytics_rebuild_players')
+        return folded
+
+    def series(self, resolution: str, since: str, until: Optional[str] = None, game_type: Optional[str] = None,
+               village: Optional[str] = None, limit: int = ANALYTICS_MAX_ROWS) -> list:
+        """Сводки интервалов [since, until) по возрастанию времени"""
+        conditions = ['resolution = ?', 'bucket >= ?']
+        params = [resolution, since]
+        for column, value in (('bucket <', until), ('game_type =', game_type), ('village =', village)):
+            if value:
+                conditions.append(f'{column} ?')
+                params.append(value)
+        with self.db.connection() as conn:
+            return conn.execute(f'''
+                SELECT {", ".join(ANALYTICS_COLUMNS)}
+                FROM analytics_rollups
+                WHERE {" AND ".join(conditions)}
+                ORDER BY bucket, game_type, village
+                LIMIT ?
+            ''', params + [limit]).fetchall()
+
+    def summary(self, resolution: str, column: str, since: str, until: Optional[str] = None) -> list:
+        """Итоги периода по играм (column='game_type') или деревням (column='village').
+
+        Разных игроков из интервалов не сложить, поэтому их здесь нет.
+        """
+        until_condition = 'AND bucket < ?' if until else ''
+        with self.db.connection() as conn:
+            return conn.execute(f'''
+                SELECT {column}, SUM(bets), SUM(wagered), SUM(paid), MAX(biggest_win)
+                FROM analytics_rollups
+                WHERE resolution = ? AND bucket >= ? {until_condition}
+                GROUP BY {column}
+                ORDER BY SUM(wagered) - SUM(paid) DESC
+            ''', [resolution, since] + ([until] if until else [])).fetchall()
+
+    def pending(self) -> int:
+        """Сколько строк истории еще не учтено в сводках"""
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM game_history')
+            last_id = cursor.fetchone()[0]
+            return max(last_id - self._watermark(cursor), 0)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"❌ Ошибка обновления сводок аналитики: {e}")
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="analytics-rollup", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Останавливает фоновый проход и учитывает остаток истории"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+            try:
+                self.run()
+            except Exception as e:
+                print(f"❌ Ошибка обновления сводок аналитики: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "folded_rows": self.folded_rows,
+                "chunks": self.chunks,
+                "runs": self.runs,
+                "errors": self.errors,
+                "pruned_rows": self.pruned_rows,
+                "last_run_at": self.last_run_at,
+                "max_chunk_ms": round(self.max_chunk_ms, 3),
+            }
+
+
+# Пользователь
+@dataclass
+class UserRecord:
+    """Строка таблицы users"""
+    __slots__ = ("id", "username", "password_hash", "village", "ryo", "rank",
+                 "last_daily_reward", "total_earned", "created_at")
+    id: int
+    username: str
+    password_hash: str
+    village: str
+    ryo: int
+    rank: str
+    last_daily_reward: Optional[int]  # unix-время последней ежедневной награды
+    total_earned: int
+    created_at: Optional[str]
+
+
+USER_COLUMNS = ", ".join(UserRecord.__slots__)
+
+
+class UserCache:
+    """LRU-кэш пользователей с TTL, ключи — id и username.
+
+    Записи не изменяются на месте: мутаторы Database кладут новую копию
+    (write-through), поэтому уже выданный вызывающему объект остается
+    согласованным снимком. TTL ограничивает расхождение, если базу меняет
+    кто-то еще. Окончательная проверка баланса при ставке все равно
+    делается в SQL.
+
+    Промах кэша гоняется с записью: читатель прочитал строку, запись
+    закоммитилась, ее событие не нашло id в кэше, и читатель кладет уже
+    старый снимок. Поэтому каждое событие и сброс записи получают номер
+    поколения (помнятся последние ``capacity`` id), а читатель берет
+    ``generation()`` до чтения и передает его в ``put``: если id трогали
+    после этого, запись не кладется.
+    """
+
+    def __init__(self, capacity: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> [record, expires_at, seq]
+        self._ids = {}  # username -> id
+        self._generation = 0
+        self._touched = OrderedDict()  # id -> поколение последнего события или сброса
+        self._touched_floor = 0  # поколение, до которого забытые id считаются тронутыми
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_puts = 0
+
+    def generation(self) -> int:
+        """Отметка перед чтением пользователя из базы — для put(..., since=...)"""
+        with self._lock:
+            return self._generation
+
+    def _touch(self, user_id: int):
+        self._generation += 1
+        self._touched[user_id] = self._generation
+        self._touched.move_to_end(user_id)
+        while len(self._touched) > self.capacity:
+            _, generation = self._touched.popitem(last=False)
+            self._touched_floor = generation
+
+    def _lookup(self, user_id: Optional[int]) -> Optional[UserRecord]:
+        entry = self._entries.get(user_id) if user_id is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[1] <= time.monotonic():
+            self._drop(user_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[0]
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        with self._lock:
+            return self._lookup(user_id)
+
+    def get_by_username(self, username: str) -> Optional[UserRecord]:
+        with self._lock:
+            return self._lookup(self._ids.get(username))
+
+    def put(self, record: UserRecord, seq: int = 0, since: Optional[int] = None):
+        """Кладет запись; since — generation() до чтения record из базы"""
+        with self._lock:
+            if since is not None:
+                touched = self._touched.get(record.id)
+                if (touched if touched is not None else self._touched_floor) > since:
+                    self.stale_puts += 1
+                    return
+            entry = self._entries.get(record.id)
+            if entry is not None and entry[2] > seq:
+                return
+            self._entries[record.id] = [record, time.monotonic() + self.ttl, seq]
+            self._entries.move_to_end(record.id)
+            self._ids[record.username] = record.id
+            while len(self._entries) > self.capacity:
+                old_id, (old_record, _, _) = self._entries.popitem(last=False)
+                self._ids.pop(old_record.username, None)
+                self.evictions += 1
+
+    def apply(self, event: dict):
+        """Write-through из события баланса: обновляет запись, если она в кэше"""
+        with self._lock:
+            self._touch(event["user_id"])
+            entry = self._entries.get(event["user_id"])
+            if entry is None or entry[2] >= event["seq"]:
+                return
+            entry[0] = replace(entry[0], ryo=event["ryo"], rank=event["rank"],
+                               total_earned=event["total_earned"],
+                               last_daily_reward=event["last_daily_reward"])
+            entry[1] = time.monotonic() + self.ttl
+            entry[2] = event["seq"]
+
+    def _drop(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._ids.pop(entry[0].username, None)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._touch(user_id)
+            self._drop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._ids.clear()
+            # Чтения, начатые до сброса, могли не увидеть то, из-за чего он сделан
+            self._generation += 1
+            self._touched.clear()
+            self._touched_floor = self._generation
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "stale_puts": self.stale_puts,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# События
+class EventBus:
+    """Простая синхронная шина событий внутри процесса.
+
+    Database публикует события после коммита; подписчики (таблица лидеров
+    и т.п.) вызываются в потоке, который провел запись. Ошибка подписчика
+    не ломает запрос.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, kind: str, callback):
+        self._subscribers.setdefault(kind, []).append(callback)
+
+    def publish(self, kind: str, event: dict):
+        for callback in self._subscribers.get(kind, ()):
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"❌ Ошибка обработчика события {kind}: {e}")
+
+
+# Упорядоченное множество с доступом по номеру
+class _Infinity:
+    """Ключ сторожевого узла: больше любого другого ключа"""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+    def __eq__(self, other):
+        return other is self
+
+    __hash__ = object.__hash__
+
+
+class _SkipNode:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next = [None] * level
+        self.width = [0] * level
+
+
+class RankedSet:
+    """Индексируемый skip list: вставка, удаление, позиция ключа и срез за O(log n)"""
+
+    MAX_LEVEL = 32
+
+    def __init__(self):
+        self._nil = _SkipNode(_Infinity(), 0)
+        self._head = _SkipNode(None, self.MAX_LEVEL)
+        self._head.next = [self._nil] * self.MAX_LEVEL
+        self._head.width = [1] * self.MAX_LEVEL
+        self._random = random.Random()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and self._random.random() < 0.5:
+            level += 1
+        return level
+
+    def add(self, key):
+        chain = [None] * self.MAX_LEVEL
+        steps_at_level = [0] * self.MAX_LEVEL
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = self._random_level()
+        new_node = _SkipNode(key, height)
+        steps = 0
+        for level in range(height):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, self.MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain = [None] * self.MAX_LEVEL
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._nil or target.key != key:
+            raise KeyError(key)
+
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index(self, key) -> Optional[int]:
+        """Позиция ключа с нуля или None, если ключа нет"""
+        node = self._head
+        position = 0
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is self._nil or target.key != key:
+            return None
+        return position
+
+    def slice(self, start: int, count: int) -> list:
+        """Ключи с позиции start (с нуля), не больше count штук"""
+        if start < 0:
+            start = 0
+        if start >= self._size or count <= 0:
+            return []
+
+        node = self._head
+        remaining = start + 1
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
 
+        keys = []
+        while node is not self._nil and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+# База данных
+class Database:
+    def __init__(self, path: str = DB_PATH, pool_size: int = DB_POOL_SIZE,
+                 buffer_history: bool = HISTORY_BUFFER_ENABLED, archive_dir: str = ARCHIVE_DIR,
+                 background: bool = True):
+        self.pool = ConnectionPool(path, pool_size)
+        self.users = UserCache()
+        self.events = EventBus()
+        self._event_seq = itertools.count(1)
+        self._local = threading.local()
+        # Журнал Рё: балансы, измененные после снимка, — id -> (ryo, total_earned)
+        self.ledger_owner = background
+        self._book = {}
+        self._book_lock = threading.Lock()
+        self._ledger_seq = None  # последняя проводка, которую учитывает книга
+        self._snapshot_seq = 0
+        self._snapshot_at = time.monotonic()
+        self.snapshots = 0
+        self.snapshot_entries = 0
+        self.last_snapshot_ms = 0.0
+        self.max_snapshot_ms = 0.0
+        self.init_database()
+        if background:
+            # Восстановление: хвост журнала после прошлого снимка сворачивается в users
+            recovered = self.snapshot()
+            if recovered:
+                print(f"📒 Журнал Рё: восстановлено проводок после снимка: {recovered}")
+
+        # background=False — без фоновой записи (архивация, буфер истории):
+        # у воркеров режима "remote" ее ведет процесс-писатель
+        self.archive = HistoryArchive(self, archive_dir or os.path.splitext(path)[0] + "_archive")
+        if background:
+            self.archive.start()
+
+        self.analytics = AnalyticsRollup(self)
+        if background:
+            self.analytics.start()
+
+        self.history_writer = None
+        if buffer_history and background:
+            self.history_writer = HistoryWriter(self)
+            self.history_writer.start()
+
+    def close(self):
+        self.archive.close()
+        if self.history_writer:
+            self.history_writer.close()
+        self.analytics.close()
+        if self.ledger_owner:
+            self.snapshot()
+        self.pool.close()
+
+    def connection(self):
+        return self.pool.connection()
+
+    def _balance_event(self, cursor, user_id: int) -> dict:
+        """Снимок баланса для события; вызывается внутри транзакции записи.
+
+        Номер seq выдается под блокировкой записи, поэтому подписчики могут
+        отбросить событие, пришедшее позже более нового.
+        """
+        cursor.execute('SELECT username, village, last_daily_reward FROM users WHERE id = ?', (user_id,))
+        username, village, last_daily_reward = cursor.fetchone()
+        ryo, total_earned = self._account(cursor, user_id)
+        return {
+            "seq": next(self._event_seq),
+            "user_id": user_id,
+            "username": username,
+            "village": village,
+            "ryo": ryo,
+            "rank": calculate_rank(ryo),
+            "total_earned": total_earned,
+            "last_daily_reward": last_daily_reward
+        }
+
+    def _publish_balance(self, event: dict):
+        """После коммита: write-through в кэш пользователей, затем подписчики"""
+        self._after_commit(self.users.apply, event)
+        self._after_commit(self.events.publish, 'balance', event)
+
+    def _publish_bet(self, balance_event: dict, game_type: str, rounds: list):
+        """Событие 'bet_settled': раунды (ставка, выигрыш, исход) одной проводки"""
+        self._after_commit(self.events.publish, 'bet_settled',
+                           dict(balance_event, game_type=game_type, rounds=rounds))
+
+    def _after_commit(self, callback, *args):
+        """Вызывает callback сразу, а внутри group_commit — после общего коммита"""
+        pending = getattr(self._local, "pending", None)
+        if pending is None:
+            callback(*args)
+        else:
+            pending.append((contextvars.copy_context(), callback, args))
+
+    @contextmanager
+    def group_commit(self):
+        """Несколько записей текущего потока — одной транзакцией и одним коммитом.
+
+        Внутри блока transaction() открывает точку сохранения, так что ошибка
+        откатывает только свою операцию. Публикация событий и прочие действия
+        после коммита откладываются до общего COMMIT и выполняются в контексте
+        запланировавшей их операции; если коммит не удался, они отбрасываются.
+        """
+        with self.connection() as conn:
+            if getattr(self._local, "pending", None) is not None:
+                yield
+                return
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            self._local.pending = pending = []
+            try:
+                self._ledger_begin(cursor)
+                yield
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                self._commit(conn)
+            finally:
+                self._local.pending = None
+                self._local.ledger = None
+
+        for context, callback, args in pending:
+            try:
+                context.run(callback, *args)
+            except Exception as e:
+                print(f"❌ Ошибка после коммита ({callback.__qualname__}): {e}")
+        self._maybe_snapshot()
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция BEGIN IMMEDIATE: блокировка записи берется сразу.
+
+        Внутри group_commit — точка сохранения в общей транзакции.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if getattr(self._local, "pending", None) is not None:
+                layers = self._local.ledger
+                layers.append({"accounts": {}, "seq": layers[-1]["seq"]})
+                cursor.execute('SAVEPOINT operation')
+                try:
+                    yield cursor
+                except BaseException:
+                    cursor.execute('ROLLBACK TO operation')
+                    cursor.execute('RELEASE operation')
+                    layers.pop()
+                    raise
+                cursor.execute('RELEASE operation')
+                layer = layers.pop()
+                layers[-1]["accounts"].update(layer["accounts"])
+                layers[-1]["seq"] = layer["seq"]
+                return
+
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                self._ledger_begin(cursor)
+                yield cursor
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                self._commit(conn)
+            finally:
+                self._local.ledger = None
+        self._maybe_snapshot()
+
+    # Журнал Рё
+    def _ledger_begin(self, cursor):
+        """Слой журнала для новой транзакции записи (блокировка уже взята).
+
+        Если журнал дописал кто-то, кроме этого процесса (или это первая
+        транзакция), книга в памяти недостоверна: хвост сворачивается в users
+        прямо здесь, и до коммита балансы читаются из users.
+        """
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM ryo_ledger')
+        seq = cursor.fetchone()[0]
+        self._local.ledger = [{"accounts": {}, "seq": seq, "snapshot": None}]
+        with self._book_lock:
+            known = self._ledger_seq
+        if seq != known:
+            self._fold(cursor)
+
+    def _commit(self, conn):
+        """COMMIT и перенос балансов транзакции в книгу — под одной блокировкой книги"""
+        root = self._local.ledger[0]
+        with self._book_lock:
             conn.commit()
-            return user_id
+            if root["snapshot"] is not None:
+                self._book.clear()
+            self._book.update(root["accounts"])
+            self._ledger_seq = root["seq"]
+        if root["snapshot"] is not None:
+            seq, entries, started = root["snapshot"]
+            elapsed = (time.perf_counter() - started) * 1000
+            self._snapshot_seq = seq
+            self._snapshot_at = time.monotonic()
+            if entries:
+                self.snapshots += 1
+                self.snapshot_entries += entries
+                self.last_snapshot_ms = elapsed
+                self.max_snapshot_ms = max(self.max_snapshot_ms, elapsed)
+
+    def _fold(self, cursor) -> int:
+        """Сворачивает хвост журнала в users и записывает снимок; возвращает число проводок"""
+        started = time.perf_counter()
+        root = self._local.ledger[0]
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM ledger_snapshots')
+        entries = root["seq"] - cursor.fetchone()[0]
+        tail = ledger_tail(cursor)
+        if tail:
+            cursor.executemany(f'''
+                UPDATE users
+                SET ryo = ryo + :delta,
+                    total_earned = COALESCE(total_earned, 0) + :earned,
+                    rank = {rank_sql('(ryo + :delta)')}
+                WHERE id = :user_id
+            ''', [{"user_id": user_id, "delta": delta, "earned": earned}
+                  for user_id, (delta, earned) in sorted(tail.items())])
+        if entries > 0:
+            cursor.execute('INSERT INTO ledger_snapshots (seq, created_at, accounts) VALUES (?, ?, ?)',
+                           (root["seq"], int(time.time()), len(tail)))
+        root["snapshot"] = (root["seq"], max(entries, 0), started)
+        return max(entries, 0)
+
+    def _account(self, cursor, user_id: int) -> Optional[tuple]:
+        """(ryo, total_earned) игрока внутри транзакции записи: слои транзакции, книга, строка users"""
+        layers = self._local.ledger
+        for layer in reversed(layers):
+            account = layer["accounts"].get(user_id)
+            if account is not None:
+                return account
+        if layers[0]["snapshot"] is None:
+            with self._book_lock:
+                account = self._book.get(user_id)
+            if account is not None:
+                return account
+        cursor.execute('SELECT ryo, total_earned FROM users WHERE id = ?', (user_id,))
+        row = cursor.fetchone()
+        return (row[0], row[1] or 0) if row else None
+
+    def _post(self, cursor, user_id: int, account: tuple, entries: list) -> tuple:
+        """Дописывает проводки (причина, сумма) в журнал; возвращает новый (ryo, total_earned)"""
+        layer = self._local.ledger[-1]
+        ryo, earned = account
+        seq = layer["seq"]
+        rows = []
+        for reason, delta in entries:
+            seq += 1
+            ryo += delta
+            earned += ledger_earned(reason, delta)
+            rows.append((seq, user_id, reason, delta))
+        cursor.executemany('INSERT INTO ryo_ledger (seq, user_id, reason, delta) VALUES (?, ?, ?, ?)', rows)
+        layer["seq"] = seq
+        layer["accounts"][user_id] = (ryo, earned)
+        return ryo, earned
+
+    def snapshot(self) -> int:
+        """Снимок балансов: хвост журнала — в users; при старте это восстановление"""
+        with self.transaction() as cursor:
+            root = self._local.ledger[0]
+            if root["snapshot"] is not None:
+                return root["snapshot"][1]  # хвост уже свернут в _ledger_begin
+            return self._fold(cursor)
+
+    def _maybe_snapshot(self):
+        if not self.ledger_owner or self._ledger_seq is None:
+            return
+        tail = self._ledger_seq - self._snapshot_seq
+        if tail >= LEDGER_SNAPSHOT_ENTRIES or (
+                tail > 0 and time.monotonic() - self._snapshot_at >= LEDGER_SNAPSHOT_SECONDS):
+            try:
+                self.snapshot()
+            except sqlite3.Error as e:
+                print(f"❌ Ошибка снимка балансов: {e}")
+
+    def ledger_stats(self) -> dict:
+        with self._book_lock:
+            book = len(self._book)
+        return {
+            "seq": self._ledger_seq,
+            "snapshot_seq": self._snapshot_seq,
+            "tail": (self._ledger_seq or 0) - self._snapshot_seq,
+            "book_accounts": book,
+            "snapshots": self.snapshots,
+            "snapshot_entries": self.snapshot_entries,
+            "last_snapshot_ms": round(self.last_snapshot_ms, 3),
+            "max_snapshot_ms": round(self.max_snapshot_ms, 3),
+        }
+
+    def init_database(self):
+        with self.connection() as conn:
+            version = migrate(conn)
+        print(f"✅ База данных инициализирована (схема v{version})")
+
+    def create_user(self, username: str, password_hash: str, village: str):
+        try:
+            with self.transaction() as cursor:
+                # Стартовый баланс — проводкой журнала, в users он попадет со снимком
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, village, ryo)
+                    VALUES (?, ?, ?, 0)
+                ''', (username, password_hash, village))
+                user_id = cursor.lastrowid
+                self._post(cursor, user_id, (0, 0), [(LEDGER_SIGNUP, SIGNUP_RYO)])
+
+                # Создаем начальные миссии
+                missions = [(user_id, mission_type, 0, 0, spec.reward)
+                            for mission_type, spec in MISSION_SPECS.items()]
+                cursor.executemany('''
+                    INSERT INTO missions (user_id, mission_type, progress, completed, reward)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', missions)
+
+                event = self._balance_event(cursor, user_id)
         except sqlite3.IntegrityError:
             return None
-        finally:
-            conn.close()
 
-    def get_user(self, username: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
-        conn.close()
+        self._publish_balance(event)
+        return user_id
+
+    def get_user(self, username: str) -> Optional[UserRecord]:
+        user = self.users.get_by_username(username)
+        if user is None:
+            user = self._load_user('username = ?', username)
+        return user
+
+    def get_user_by_id(self, user_id: int) -> Optional[UserRecord]:
+        user = self.users.get(user_id)
+        if user is None:
+            user = self._load_user('id = ?', user_id)
+        return user
+
+    def _load_user(self, condition: str, value) -> Optional[UserRecord]:
+        """Строка users плюс хвост журнала после снимка — в одной читающей транзакции"""
+        since = self.users.generation()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            began = not conn.in_transaction
+            if began:
+                cursor.execute('BEGIN')
+            try:
+                cursor.execute(f'SELECT {USER_COLUMNS} FROM users WHERE {condition}', (value,))
+                row = cursor.fetchone()
+                tail = ledger_tail(cursor, row[0]) if row else {}
+            finally:
+                if began:
+                    conn.rollback()
+        if row is None:
+            return None
+        user = UserRecord(*row)
+        if user.id in tail:
+            delta, earned = tail[user.id]
+            user = replace(user, ryo=user.ryo + delta, rank=calculate_rank(user.ryo + delta),
+                           total_earned=(user.total_earned or 0) + earned)
+        self.users.put(user, since=since)
         return user
 
+    def get_setting(self, key: str) -> Optional[str]:
+        with self.connection() as conn:
+            row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def is_session_revoked(self, token_id: bytes) -> bool:
+        with self.connection() as conn:
+            return conn.execute('SELECT 1 FROM revoked_sessions WHERE token_id = ?', (token_id,)).fetchone() is not None
+
+    def revoke_session(self, token_id: bytes, expires_at: int):
+        """Отзыв токена; заодно удаляются записи, чей токен и так истек"""
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM revoked_sessions WHERE expires_at < ?', (int(time.time()),))
+            cursor.execute('INSERT OR IGNORE INTO revoked_sessions (token_id, expires_at) VALUES (?, ?)',
+                           (token_id, expires_at))
+        self._after_commit(self.events.publish, 'session_revoked', {"token_id": token_id})
+
+    def update_password_hash(self, user_id: int, old_hash: str, new_hash: str) -> bool:
+        """Меняет хеш, только если он все еще old_hash (повторный вход мог успеть раньше)"""
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                           (new_hash, user_id, old_hash))
+            updated = cursor.rowcount == 1
+        if updated:
+            self._after_commit(self.users.invalidate, user_id)
+        return updated
+
     def update_balance(self, user_id: int, amount: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET ryo = ryo + ? WHERE id = ?', (amount, user_id))
-        cursor.execute('UPDATE users SET total_earned = total_earned + ? WHERE id = ? AND ? > 0',
-                       (amount, user_id, amount))
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            account = self._account(cursor, user_id)
+            if account is None:
+                return
+            self._post(cursor, user_id, account, [(LEDGER_ADJUSTMENT, amount)])
+            event = self._balance_event(cursor, user_id)
+
+        self._publish_balance(event)
 
     def add_game_record(self, user_id: int, game_type: str, bet: int, win: int, result: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            self._update_user_stats(cursor, user_id, game_type, bet, win)
+            if not self.history_writer:
+                self._insert_history(cursor, user_id, game_type, bet, win, result)
+
+        if self.history_writer:
+            self._after_commit(self.history_writer.submit, user_id, game_type, bet, win, result)
+
+    def _insert_history(self, cursor, user_id: int, game_type: str, bet: int, win: int, result: str):
         cursor.execute('''
             INSERT INTO game_history (user_id, game_type, bet_amount, win_amount, result)
             VALUES (?, ?, ?, ?, ?)
         ''', (user_id, game_type, bet, win, result))
 
-        # Обновляем миссии
+    def _update_user_stats(self, cursor, user_id: int, game_type: str, bet: int, win: int,
+                           games: int = 1, biggest_win: Optional[int] = None):
+        """Инкрементально обновляет агрегаты user_stats и user_game_stats.
+
+        bet и win — суммы по ``games`` сыгранным раундам.
+        """
+        biggest_win = win if biggest_win is None else biggest_win
         cursor.execute('''
-            UPDATE missions 
-            SET progress = progress + 1 
-            WHERE user_id = ? AND mission_type = 'play_10_games' AND completed = 0
-        ''', (user_id,))
+            INSERT INTO user_stats (user_id, games_played, total_bet, total_win, biggest_win, last_played_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                games_played = games_played + excluded.games_played,
+                total_bet = total_bet + excluded.total_bet,
+                total_win = total_win + excluded.total_win,
+                biggest_win = MAX(biggest_win, excluded.biggest_win),
+                last_played_at = excluded.last_played_at
+        ''', (user_id, games, bet, win, biggest_win))
+        cursor.execute('''
+            INSERT INTO user_game_stats (user_id, game_type, games_played, total_bet, total_win, biggest_win)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, game_type) DO UPDATE SET
+                games_played = games_played + excluded.games_played,
+                total_bet = total_bet + excluded.total_bet,
+                total_win = total_win + excluded.total_win,
+                biggest_win = MAX(biggest_win, excluded.biggest_win)
+        ''', (user_id, game_type, games, bet, win, biggest_win))
+
+    def settle_bet(self, user_id: int, game_type: str, bet: int, win: int, result: str):
+        """Проводит ставку одной транзакцией.
+
+        Списание ставки, зачисление выигрыша, пересчет ранга, статистика
+        и запись в историю выполняются под одной блокировкой
+        записи. Под ней же проверяется баланс, поэтому
+        параллельные ставки не могут увести баланс в минус. Возвращает (новый баланс, новый ранг)
+        или None, если Рё не хватает.
+
+        При включенном буфере истории синхронно проводятся баланс и статистика,
+        а история уходит в HistoryWriter после коммита. Миссии двигает
+        MissionEngine по событию 'bet_settled'. Баланс меняется проводкой
+        журнала, строку users обновит снимок.
+        """
+        with self.transaction() as cursor:
+            account = self._account(cursor, user_id)
+            if account is None or account[0] < bet:
+                # Баланс в кэше мог отстать от базы — перечитаем при следующем запросе
+                self.users.invalidate(user_id)
+                return None
+
+            self._post(cursor, user_id, account, [(LEDGER_BET, win - bet)])
+            event = self._balance_event(cursor, user_id)
+            new_balance, new_rank = event["ryo"], event["rank"]
+
+            self._update_user_stats(cursor, user_id, game_type, bet, win)
+            if not self.history_writer:
+                self._insert_history(cursor, user_id, game_type, bet, win, result)
+
+        self._publish_balance(event)
+        self._publish_bet(event, game_type, [(bet, win, result)])
+        if self.history_writer:
+            self._after_commit(self.history_writer.submit, user_id, game_type, bet, win, result)
+
+        return new_balance, new_rank
+
+    def settle_batch(self, user_id: int, game_type: str, bets: list, results: list):
+        """Проводит серию раундов одной транзакцией.
+
+        ``results`` — заранее сыгранные результаты раундов (как Game.play)
+        в порядке ставок: разыграть их может воркер, а провести — процесс-
+        писатель. Раунды проводятся по очереди, пока хватает баланса, лишние
+        результаты отбрасываются; проводки журнала, статистика и история
+        (executemany) записываются одним коммитом. Возвращает (результаты
+        раундов, баланс, ранг) или None, если пользователя нет.
+        """
+        with self.transaction() as cursor:
+            account = self._account(cursor, user_id)
+            if account is None:
+                return None
+
+            balance = account[0]
+            rounds = []
+            history = []
+            total_bet = total_win = biggest_win = 0
+            for bet, result in zip(bets, results):
+                if balance < bet:
+                    break
+                win = result['win_amount']
+                balance += win - bet
+                total_bet += bet
+                total_win += win
+                biggest_win = max(biggest_win, win)
+                rounds.append(dict(result, bet=bet, balance=balance))
+                history.append((user_id, game_type, bet, win, result['result']))
+
+            if not rounds:
+                return [], balance, None
+
+            # Проводка на каждый раунд — одним executemany
+            self._post(cursor, user_id, account, [(LEDGER_BET, row[3] - row[2]) for row in history])
+            event = self._balance_event(cursor, user_id)
+
+            self._update_user_stats(cursor, user_id, game_type, total_bet, total_win,
+                                    games=len(rounds), biggest_win=biggest_win)
+            if not self.history_writer:
+                cursor.executemany('''
+                    INSERT INTO game_history (user_id, game_type, bet_amount, win_amount, result)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', history)
+
+        self._publish_balance(event)
+        self._publish_bet(event, game_type, [row[2:] for row in history])
+        if self.history_writer:
+            for row in history:
+                self._after_commit(self.history_writer.submit, *row)
+
+        return rounds, event["ryo"], event["rank"]
+
+    def check_daily_reward(self, user_id: int) -> bool:
+        """Доступна ли награда — по записи из кэша пользователей"""
+        user = self.get_user_by_id(user_id)
+        return user is not None and daily_reward_due(user.last_daily_reward)
+
+    def claim_daily_reward(self, user_id: int, amount: int = DAILY_REWARD_AMOUNT) -> Optional[tuple]:
+        """Ежедневная награда: условный UPDATE срока и проводка в одной транзакции.
+
+        Две одновременные попытки не получат награду дважды: вторая не
+        найдет строку под условием и ничего не проведет. Возвращает (новый баланс, новый ранг)
+        или None, если награда еще не доступна.
+        """
+        now = int(time.time())
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE users
+                SET last_daily_reward = :now
+                WHERE id = :user_id AND (last_daily_reward IS NULL OR last_daily_reward <= :due)
+            ''', {"now": now, "due": now - DAILY_REWARD_INTERVAL, "user_id": user_id})
+            if cursor.rowcount == 0:
+                # Кэш мог считать награду доступной — перечитаем при следующем запросе
+                self.users.invalidate(user_id)
+                return None
+
+            self._post(cursor, user_id, self._account(cursor, user_id), [(LEDGER_DAILY_REWARD, amount)])
+            cursor.execute('INSERT INTO daily_rewards (user_id, reward_amount) VALUES (?, ?)', (user_id, amount))
+            event = self._balance_event(cursor, user_id)
+
+        self._publish_balance(event)
+        return event["ryo"], event["rank"]
 
-        conn.commit()
-        conn.close()
+    def get_missions(self, user_id: int):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM missions WHERE user_id = ? ORDER BY id', (user_id,))
+            return cursor.fetchall()
 
-    def check_daily_reward(self, user_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT last_daily_reward FROM users WHERE id = ?', (user_id,))
-        result = cursor.fetchone()
+    def update_mission(self, mission_id: int, progress: int):
+        """Ставит прогресс миссии; выполнение — по цели из MISSION_SPECS, одним UPDATE.
+
+        Награду не начисляет: это делает MissionEngine.
+        """
+        with self.transaction() as cursor:
+            cursor.execute(f'''
+                UPDATE missions
+                SET progress = :progress,
+                    completed = completed OR :progress >= {mission_target_sql()}
+                WHERE id = :mission_id
+            ''', {"progress": progress, "mission_id": mission_id})
+
+    def get_active_missions(self, user_id: int) -> list:
+        with self.connection() as conn:
+            return conn.execute('SELECT id, mission_type, progress FROM missions WHERE user_id = ? AND completed = 0',
+                                (user_id,)).fetchall()
+
+    def save_mission_progress(self, rows: list):
+        """Контрольные точки: rows — пары (прогресс, id миссии); прогресс только растет"""
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                UPDATE missions SET progress = MAX(progress, ?)
+                WHERE id = ? AND completed = 0
+            ''', rows)
 
-        if not result or not result[0]:
-            return True
+    def complete_mission(self, user_id: int, mission_id: int, progress: int, reward: int) -> bool:
+        """Отмечает миссию выполненной и начисляет награду одной транзакцией.
 
-        last_reward = datetime.fromisoformat(result[0])
-        now = datetime.now()
+        False — миссия уже была выполнена (награда не начисляется повторно).
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE missions SET progress = ?, completed = 1
+                WHERE id = ? AND completed = 0
+            ''', (progress, mission_id))
+            if cursor.rowcount == 0:
+                return False
+            self._post(cursor, user_id, self._account(cursor, user_id), [(LEDGER_MISSION, reward)])
+            event = self._balance_event(cursor, user_id)
+
+        self._publish_balance(event)
+        return True
+
+    # Турниры
+    def set_setting(self, key: str, value: str):
+        with self.transaction() as cursor:
+            cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+
+    def create_tournament(self, name: str, scoring: str, games: list, prizes: list,
+                          starts_at: int, ends_at: int) -> int:
+        """Новый турнир; TournamentEngine узнает о нем по событию 'tournament_created'"""
+        if any(not 0 <= prize <= TOURNAMENT_MAX_PRIZE for prize in prizes):
+            raise ValueError(f"Приз за место должен быть от 0 до {TOURNAMENT_MAX_PRIZE}")
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO tournaments (name, scoring, games, prizes, starts_at, ends_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (name, scoring, ",".join(games), json.dumps(prizes), starts_at, ends_at))
+            cursor.execute(f'SELECT {", ".join(TOURNAMENT_COLUMNS)} FROM tournaments WHERE id = ?',
+                           (cursor.lastrowid,))
+            tournament = dict(zip(TOURNAMENT_COLUMNS, cursor.fetchone()))
+
+        self._after_commit(self.events.publish, 'tournament_created', tournament)
+        return tournament["id"]
+
+    def get_tournaments(self, status: Optional[str] = None, limit: int = 50) -> list:
+        """Турниры, новые первыми"""
+        condition = 'WHERE status = ?' if status else ''
+        with self.connection() as conn:
+            return conn.execute(f'''
+                SELECT {", ".join(TOURNAMENT_COLUMNS)} FROM tournaments {condition} ORDER BY id DESC LIMIT ?
+            ''', ([status] if status else []) + [limit]).fetchall()
+
+    def get_tournament(self, tournament_id: int) -> Optional[tuple]:
+        with self.connection() as conn:
+            return conn.execute(f'SELECT {", ".join(TOURNAMENT_COLUMNS)} FROM tournaments WHERE id = ?',
+                                (tournament_id,)).fetchone()
+
+    def save_standings(self, rows: list):
+        """Измененные строки турнирных таблиц (турнир, игрок, очки, раунды, reached) — одной транзакцией"""
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO tournament_standings (tournament_id, user_id, score, rounds, reached)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (tournament_id, user_id) DO UPDATE SET
+                    score = excluded.score,
+                    rounds = excluded.rounds,
+                    reached = excluded.reached
+            ''', rows)
+
+    def load_standings(self, tournament_id: int) -> list:
+        """Сохраненная таблица турнира: (user_id, username, очки, раунды, reached)"""
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT s.user_id, u.username, s.score, s.rounds, s.reached
+                FROM tournament_standings AS s
+                JOIN users AS u ON u.id = s.user_id
+                WHERE s.tournament_id = ?
+            ''', (tournament_id,)).fetchall()
+
+    def rebuild_standings(self, tournament: dict) -> list:
+        """Таблица турнира заново по game_history за его окно — в том же виде, что load_standings.
+
+        reached здесь — id строки истории: последней для суммы очков, лучшей для максимума.
+        """
+        rule = TOURNAMENT_SCORING[tournament["scoring"]]
+        games = [game for game in tournament["games"].split(",") if game]
+        window = [datetime.utcfromtimestamp(tournament[key]).strftime("%Y-%m-%d %H:%M:%S")
+                  for key in ("starts_at", "ends_at")]
+        games_condition = f'AND h.game_type IN ({", ".join("?" * len(games))})' if games else ''
+        # При единственном MAX() SQLite берет h.id из строки с максимумом
+        reached = 'h.id' if rule.aggregate == 'max' else 'MAX(h.id)'
+        with self.connection() as conn:
+            return conn.execute(f'''
+                SELECT h.user_id, u.username, {rule.aggregate.upper()}({rule.sql}), COUNT(*), {reached}
+                FROM game_history AS h
+                JOIN users AS u ON u.id = h.user_id
+                WHERE h.played_at >= ? AND h.played_at < ? {games_condition}
+                GROUP BY h.user_id
+            ''', window + games).fetchall()
+
+    def close_tournament(self, tournament_id: int, ranking: list, prizes: list) -> Optional[list]:
+        """Закрывает турнир одной транзакцией: итоговые места всех участников и призы проводками журнала.
+
+        ranking — (user_id, очки, раунды, reached) по местам. Возвращает
+        [(место, user_id, приз)] или None, если турнир уже закрыт.
+        """
+        events = []
+        paid = []
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE tournaments SET status = 'closed', closed_at = ?
+                WHERE id = ? AND status = 'active'
+            ''', (int(time.time()), tournament_id))
+            if cursor.rowcount == 0:
+                return None
 
-        # Можно получить награду если прошло больше 24 часов
-        can_claim = (now - last_reward) >= timedelta(hours=24)
-        conn.close()
-        return can_claim
+            cursor.executemany('''
+                INSERT INTO tournament_standings (tournament_id, user_id, score, rounds, reached, place, prize)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (tournament_id, user_id) DO UPDATE SET
+                    score = excluded.score,
+                    rounds = excluded.rounds,
+                    reached = excluded.reached,
+                    place = excluded.place,
+                    prize = excluded.prize
+            ''', [(tournament_id, user_id, score, rounds, reached, place,
+                   prizes[place - 1] if place <= len(prizes) else None)
+                  for place, (user_id, score, rounds, reached) in enumerate(ranking, 1)])
+
+            for place, (user_id, *_) in enumerate(ranking[:len(prizes)], 1):
+                prize = prizes[place - 1]
+                account = self._account(cursor, user_id)
+                if prize <= 0 or account is None:
+                    continue
+                self._post(cursor, user_id, account, [(LEDGER_TOURNAMENT, prize)])
+                events.append(self._balance_event(cursor, user_id))
+                paid.append((place, user_id, prize))
+
+        for event in events:
+            self._publish_balance(event)
+        return paid
+
+    def get_final_standings(self, tournament_id: int, first_place: int, count: int) -> list:
+        """Итоговая таблица закрытого турнира с места first_place: (место, ник, очки, раунды, приз)"""
+        with self.connection() as conn:
+            return conn.execute('''
+                SELECT s.place, u.username, s.score, s.rounds, s.prize
+                FROM tournament_standings AS s
+                JOIN users AS u ON u.id = s.user_id
+                WHERE s.tournament_id = ? AND s.place >= ?
+                ORDER BY s.place
+                LIMIT ?
+            ''', (tournament_id, first_place, count)).fetchall()
+
+    def get_final_place(self, tournament_id: int, user_id: int) -> Optional[tuple]:
+        """Итоговое место игрока и число участников закрытого турнира"""
+        with self.connection() as conn:
+            row = conn.execute('SELECT place FROM tournament_standings WHERE tournament_id = ? AND user_id = ?',
+                               (tournament_id, user_id)).fetchone()
+            if row is None or row[0] is None:
+                return None
+        return row[0], self.count_final_places(tournament_id)
+
+    def count_final_places(self, tournament_id: int) -> int:
+        """Число участников закрытого турнира — последнее место, по индексу (турнир, место)"""
+        with self.connection() as conn:
+            return conn.execute('SELECT MAX(place) FROM tournament_standings WHERE tournament_id = ?',
+                                (tournament_id,)).fetchone()[0] or 0
+
+    def get_stats(self, user_id: int):
+        """Агрегаты игрока из user_stats: одно чтение по первичному ключу"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT games_played, total_bet, total_win, biggest_win, last_played_at
+                FROM user_stats WHERE user_id = ?
+            ''', (user_id,))
+            return cursor.fetchone()
+
+    def get_game_stats(self, user_id: int):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT game_type, games_played, total_bet, total_win, biggest_win
+                FROM user_game_stats WHERE user_id = ?
+            ''', (user_id,))
+            return cursor.fetchall()
+
+    def rebuild_user_stats(self) -> int:
+        """Пересчитывает user_stats и user_game_stats с нуля по game_history"""
+        with self.transaction() as cursor:
+            rebuild_user_stats(cursor, self.archive.paths())
+            cursor.execute('SELECT COUNT(*) FROM user_stats')
+            return cursor.fetchone()[0]
+
+    def check_user_stats(self) -> list:
+        """Сравнивает агрегаты с сырой историей (вместе с архивом), возвращает список расхождений"""
+        mismatches = []
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # Эталон считаем тем же кодом, что и rebuild-stats, но во временные таблицы
+            cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS history_stats (
+                    user_id INTEGER PRIMARY KEY, games_played INTEGER, total_bet INTEGER,
+                    total_win INTEGER, biggest_win INTEGER, last_played_at TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS history_game_stats (
+                    user_id INTEGER, game_type TEXT, games_played INTEGER, total_bet INTEGER,
+                    total_win INTEGER, biggest_win INTEGER, PRIMARY KEY (user_id, game_type)
+                )
+            ''')
+            try:
+                rebuild_user_stats(cursor, self.archive.paths(), 'temp.history_stats', 'temp.history_game_stats')
+
+                # Общие агрегаты: сравниваем в обе стороны
+                cursor.execute('''
+                    SELECT h.user_id, h.games_played, h.total_bet, h.total_win, h.biggest_win,
+                           s.games_played, s.total_bet, s.total_win, s.biggest_win
+                    FROM temp.history_stats AS h
+                    LEFT JOIN user_stats AS s ON s.user_id = h.user_id
+                    UNION ALL
+                    SELECT s.user_id, 0, 0, 0, 0, s.games_played, s.total_bet, s.total_win, s.biggest_win
+                    FROM user_stats AS s
+                    WHERE NOT EXISTS (SELECT 1 FROM temp.history_stats AS h WHERE h.user_id = s.user_id)
+                ''')
+                for row in cursor:
+                    if tuple(row[1:5]) != tuple(row[5:9]):
+                        mismatches.append({
+                            "user_id": row[0],
+                            "game_type": None,
+                            "history": row[1:5],
+                            "stats": row[5:9]
+                        })
+
+                # Разбивка по играм
+                cursor.execute('''
+                    SELECT h.user_id, h.game_type, h.games_played, h.total_bet, h.total_win, h.biggest_win,
+                           s.games_played, s.total_bet, s.total_win, s.biggest_win
+                    FROM temp.history_game_stats AS h
+                    LEFT JOIN user_game_stats AS s ON s.user_id = h.user_id AND s.game_type = h.game_type
+                    UNION ALL
+                    SELECT s.user_id, s.game_type, 0, 0, 0, 0, s.games_played, s.total_bet, s.total_win, s.biggest_win
+                    FROM user_game_stats AS s
+                    WHERE NOT EXISTS (SELECT 1 FROM temp.history_game_stats AS h
+                                      WHERE h.user_id = s.user_id AND h.game_type = s.game_type)
+                ''')
+                for row in cursor:
+                    if tuple(row[2:6]) != tuple(row[6:10]):
+                        mismatches.append({
+                            "user_id": row[0],
+                            "game_type": row[1],
+                            "history": row[2:6],
+                            "stats": row[6:10]
+                        })
+            finally:
+                conn.rollback()
+                cursor.execute('DROP TABLE IF EXISTS temp.history_stats')
+                cursor.execute('DROP TABLE IF EXISTS temp.history_game_stats')
+        return mismatches
+
+    def verify_ledger(self, limit: int = 20) -> dict:
+        """Офлайн-сверка журнала: все балансы заново одним потоковым проходом по ryo_ledger.
+
+        Сравнивает итог с балансами users плюс хвост после снимка; заодно
+        считает пропуски в seq, ставки, ушедшие в минус, и проводки
+        несуществующих игроков. Примеров каждой проблемы — не больше ``limit``.
+        """
+        balances = {}
+        report = {"entries": 0, "users": 0, "gaps": 0, "overdrafts": 0, "mismatches": 0, "orphans": 0,
+                  "examples": []}
+
+        def problem(kind: str, **details):
+            report[kind] += 1
+            if len(report["examples"]) < limit:
+                report["examples"].append(dict(details, problem=kind))
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            try:
+                previous = 0
+                for seq, user_id, reason, delta in conn.execute(
+                        'SELECT seq, user_id, reason, delta FROM ryo_ledger ORDER BY seq'):
+                    report["entries"] += 1
+                    if seq != previous + 1:
+                        problem("gaps", seq=seq, after=previous)
+                    previous = seq
+                    balance = balances[user_id] = balances.get(user_id, 0) + delta
+                    if balance < 0 and reason == LEDGER_BET:
+                        problem("overdrafts", seq=seq, user_id=user_id, balance=balance)
+
+                tail = ledger_tail(cursor)
+                for user_id, ryo in conn.execute('SELECT id, ryo FROM users'):
+                    report["users"] += 1
+                    expected = balances.pop(user_id, 0)
+                    actual = (ryo or 0) + tail.get(user_id, (0, 0))[0]
+                    if expected != actual:
+                        problem("mismatches", user_id=user_id, ledger=expected, balance=actual)
+                for user_id in sorted(balances):
+                    problem("orphans", user_id=user_id, ledger=balances[user_id])
+            finally:
+                conn.rollback()
+        return report
+
+    def get_history(self, user_id: int, limit: int, after: Optional[tuple] = None, game_type: str = None,
+                    since: str = None, until: str = None, descending: bool = True) -> list:
+        """Страница истории по ключу (played_at, id), без OFFSET.
+
+        after — ключ последней строки предыдущей страницы. Индексы
+        (user_id, played_at) и (user_id, game_type, played_at) неявно содержат
+        rowid, так что порядок (played_at, id) читается прямо из индекса.
+        Архив старше основной таблицы, поэтому страница дочитывается из
+        помесячных файлов по порядку: новые строки — из основной базы,
+        затем месяцы архива от новых к старым (при asc — наоборот).
+        """
+        conditions = ['user_id = ?']
+        params = [user_id]
+        if game_type:
+            conditions.append('game_type = ?')
+            params.append(game_type)
+        if since:
+            conditions.append('played_at >= ?')
+            params.append(since)
+        if until:
+            conditions.append('played_at < ?')
+            params.append(until)
+        if after:
+            conditions.append('(played_at, id) < (?, ?)' if descending else '(played_at, id) > (?, ?)')
+            params.extend(after)
+        direction = 'DESC' if descending else 'ASC'
+        sql = f'''
+            SELECT id, game_type, bet_amount, win_amount, result, played_at
+            FROM game_history
+            WHERE {' AND '.join(conditions)}
+            ORDER BY played_at {direction}, id {direction}
+            LIMIT ?
+        '''
+
+        partitions = [functools.partial(self.archive.query, month)
+                      for month in self.archive.partitions(since, until, after, descending)]
+        partitions.insert(0 if descending else len(partitions), self._query_all)
+        # После сбоя переноса строка бывает и в основной базе, и в архиве:
+        # каждый источник читается на полный limit, повторные id отбрасываются
+        rows, seen = [], set()
+        for read in partitions:
+            for row in read(sql, params + [limit]):
+                if row[0] not in seen:
+                    seen.add(row[0])
+                    rows.append(row)
+            if len(rows) >= limit:
+                break
+        return rows[:limit]
+
+    def _query_all(self, sql: str, params: list) -> list:
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+# Таблица лидеров
+class Leaderboard:
+    """Рейтинг игроков в памяти: общий и по деревням.
+
+    Игроки лежат в RankedSet по ключу (-ryo, user_id), поэтому топ-K,
+    место игрока и окно вокруг него считаются за O(log n). Рейтинг
+    прогревается из SQLite при старте и дальше обновляется событиями
+    'balance' из Database. Поверх топа — кэш готовых JSON-ответов с TTL;
+    просроченные ответы вычищаются, когда кэш дорастает до cache_size.
+    """
+
+    def __init__(self, db: Database, cache_ttl: float = LEADERBOARD_CACHE_TTL,
+                 cache_size: int = LEADERBOARD_CACHE_SIZE):
+        self.db = db
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._players = {}  # user_id -> [seq, username, village, ryo, rank, total_earned]
+        self._boards = {None: RankedSet()}
+        self._cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        db.events.subscribe('balance', self.on_balance)
+        self.warm()
+
+    def warm(self):
+        """Балансы из users плюс хвост журнала после снимка (одна читающая транзакция)"""
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            try:
+                rows = cursor.execute('SELECT id, username, village, ryo, rank, total_earned FROM users').fetchall()
+                tail = ledger_tail(cursor)
+            finally:
+                conn.rollback()
+
+        with self._lock:
+            self._players = {}
+            self._boards = {None: RankedSet()}
+            self._cache = {}
+            for user_id, username, village, ryo, rank, total_earned in rows:
+                if user_id in tail:
+                    delta, earned = tail[user_id]
+                    ryo, rank, total_earned = ryo + delta, calculate_rank(ryo + delta), (total_earned or 0) + earned
+                self._insert(user_id, [0, username, village, ryo, rank, total_earned])
+
+    def _board(self, village: Optional[str]) -> RankedSet:
+        board = self._boards.get(village)
+        if board is None:
+            board = self._boards[village] = RankedSet()
+        return board
+
+    def _insert(self, user_id: int, player: list):
+        self._players[user_id] = player
+        key = (-player[3], user_id)
+        self._boards[None].add(key)
+        self._board(player[2]).add(key)
+
+    def on_balance(self, event: dict):
+        user_id = event["user_id"]
+        with self._lock:
+            player = self._players.get(user_id)
+            if player is not None:
+                if event["seq"] <= player[0]:
+                    return  # устаревшее событие
+                old_key = (-player[3], user_id)
+                self._boards[None].remove(old_key)
+                self._boards[player[2]].remove(old_key)
+            self._insert(user_id, [event["seq"], event["username"], event["village"],
+                                   event["ryo"], event["rank"], event["total_earned"]])
+
+    def _entries(self, keys: list, first_position: int) -> list:
+        entries = []
+        for position, (_, user_id) in enumerate(keys, first_position):
+            _, username, village, ryo, rank, total_earned = self._players[user_id]
+            entries.append({
+                "rank": position,
+                "username": username,
+                "village": village,
+                "ryo": ryo,
+                "rank_title": rank,
+                "total_earned": total_earned
+            })
+        return entries
+
+    def top(self, limit: int = 10, village: Optional[str] = None) -> list:
+        with self._lock:
+            board = self._boards.get(village)
+            if board is None:
+                return []
+            return self._entries(board.slice(0, limit), 1)
+
+    def position(self, user_id: int, village: Optional[str] = None) -> Optional[tuple]:
+        """Место игрока (с единицы) и размер рейтинга"""
+        with self._lock:
+            player = self._players.get(user_id)
+            board = self._boards.get(village)
+            if player is None or board is None:
+                return None
+            index = board.index((-player[3], user_id))
+            if index is None:
+                return None
+            return index + 1, len(board)
+
+    def around(self, user_id: int, window: int = 5, village: Optional[str] = None) -> list:
+        """Игроки выше и ниже указанного, по window с каждой стороны"""
+        with self._lock:
+            player = self._players.get(user_id)
+            board = self._boards.get(village)
+            if player is None or board is None:
+                return []
+            index = board.index((-player[3], user_id))
+            if index is None:
+                return []
+            start = max(0, index - window)
+            return self._entries(board.slice(start, 2 * window + 1), start + 1)
+
+    def top_response(self, limit: int = 10, village: Optional[str] = None) -> bytes:
+        """Сериализованный ответ /api/leaderboard с кэшированием на cache_ttl секунд"""
+        cache_key = (limit, village)
+        now = time.monotonic()
+        cached = self._cache.get(cache_key)
+        if cached and cached[0] > now:
+            self.cache_hits += 1
+            return cached[1]
+
+        self.cache_misses += 1
+        body = json.dumps({
+            "success": True,
+            "leaderboard": self.top(limit, village)
+        }, ensure_ascii=False).encode()
+        if len(self._cache) >= self.cache_size:
+            self._cache = {key: entry for key, entry in self._cache.items() if entry[0] > now}
+            if len(self._cache) >= self.cache_size:
+                self._cache = {}
+        self._cache[cache_key] = (now + self.cache_ttl, body)
+        return body
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "players": len(self._players),
+                "boards": {village or "all": len(board) for village, board in self._boards.items()},
+                "cache_entries": len(self._cache),
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+            }
 
-    def give_daily_reward(self, user_id: int, amount: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
 
-        # Даем награду
-        cursor.execute('UPDATE users SET ryo = ryo + ? WHERE id = ?', (amount, user_id))
-        cursor.execute('UPDATE users SET last_daily_reward = ? WHERE id = ?',
-                       (datetime.now().isoformat(), user_id))
+# Миссии
+class MissionEngine:
+    """Прогресс миссий в памяти по событиям Database.
+
+    Активные миссии игрока загружаются при его первом событии и лежат по
+    типу триггера: 'bet_settled' двигает 'bets', событие 'balance' —
+    'earned' (по total_earned) и 'rank'. В базу пишется только пересечение
+    контрольной точки (MissionSpec.checkpoint) или выполнение, поэтому
+    обычная ставка не трогает таблицу missions. Выполнение засчитывает
+    награду в одной транзакции с отметкой completed. Прогресс между
+    точками дописывается при вытеснении игрока из памяти и в flush().
+    О выполнении сообщает событие 'mission_completed'.
+    """
+
+    def __init__(self, db: Database, capacity: int = USER_CACHE_SIZE):
+        self.db = db
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        # user_id -> {триггер: [[id миссии, тип, прогресс, сохраненный прогресс], ...]}
+        self._users = OrderedDict()
+        self.events = 0
+        self.loads = 0
+        self.checkpoints = 0
+        self.completions = 0
+        self.rewards_paid = 0
+        self._rank_order = {rank: position for position, (_, rank) in enumerate(RANKS)}
+        db.events.subscribe('bet_settled', self.on_bet)
+        db.events.subscribe('balance', self.on_balance)
+
+    def on_bet(self, event: dict):
+        self._advance(event["user_id"], {'bets': (len(event["rounds"]), False)})
+
+    def on_balance(self, event: dict):
+        reached = self._rank_order.get(event["rank"], len(RANKS)) <= self._rank_order[MISSION_RANK]
+        self._advance(event["user_id"], {'earned': (event["total_earned"] or 0, True),
+                                         'rank': (int(reached), True)})
+
+    def _advance(self, user_id: int, updates: dict):
+        with self._lock:
+            self.events += 1
+            missions = self._users.get(user_id)
+            if missions is not None:
+                self._users.move_to_end(user_id)
+        if missions is None:
+            missions = self._load(user_id)
+
+        checkpoints, completed = [], []
+        with self._lock:
+            for trigger, (value, absolute) in updates.items():
+                active = missions.get(trigger)
+                if not active:
+                    continue
+                for mission in active:
+                    spec = MISSION_SPECS[mission[1]]
+                    progress = min(value if absolute else mission[2] + value, spec.target)
+                    if progress <= mission[2]:
+                        continue
+                    mission[2] = progress
+                    if progress >= spec.target:
+                        completed.append((mission[0], mission[1], progress, spec.reward))
+                    elif progress // spec.checkpoint > mission[3] // spec.checkpoint:
+                        mission[3] = progress
+                        checkpoints.append((progress, mission[0]))
+                missions[trigger] = [mission for mission in active
+                                     if mission[2] < MISSION_SPECS[mission[1]].target]
+
+        if checkpoints:
+            self.db.save_mission_progress(checkpoints)
+            with self._lock:
+                self.checkpoints += len(checkpoints)
+        for mission_id, mission_type, progress, reward in completed:
+            if self.db.complete_mission(user_id, mission_id, progress, reward):
+                with self._lock:
+                    self.completions += 1
+                    self.rewards_paid += reward
+                self.db._after_commit(self.db.events.publish, 'mission_completed', {
+                    "user_id": user_id, "mission_id": mission_id, "mission_type": mission_type, "reward": reward})
+
+    def _load(self, user_id: int) -> dict:
+        missions = {}
+        for mission_id, mission_type, progress in self.db.get_active_missions(user_id):
+            spec = MISSION_SPECS.get(mission_type)
+            if spec is not None:
+                missions.setdefault(spec.trigger, []).append([mission_id, mission_type, progress, progress])
+
+        with self._lock:
+            self.loads += 1
+            missions = self._users.setdefault(user_id, missions)
+            evicted = []
+            while len(self._users) > self.capacity:
+                _, old = self._users.popitem(last=False)
+                evicted.extend(self._unsaved(old))
+        if evicted:
+            self.db.save_mission_progress(evicted)
+        return missions
 
-        # Записываем в историю
-        cursor.execute('''
-            INSERT INTO daily_rewards (user_id, reward_amount)
-            VALUES (?, ?)
-        ''', (user_id, amount))
+    @staticmethod
+    def _unsaved(missions: dict) -> list:
+        rows = []
+        for active in missions.values():
+            for mission in active:
+                if mission[2] > mission[3]:
+                    mission[3] = mission[2]
+                    rows.append((mission[2], mission[0]))
+        return rows
+
+    def progress(self, user_id: int) -> dict:
+        """Актуальный прогресс активных миссий игрока из памяти: id миссии -> прогресс"""
+        with self._lock:
+            missions = self._users.get(user_id) or {}
+            return {mission[0]: mission[2] for active in missions.values() for mission in active}
+
+    def flush(self):
+        """Дописывает в базу прогресс между контрольными точками"""
+        with self._lock:
+            rows = [row for missions in self._users.values() for row in self._unsaved(missions)]
+        if rows:
+            self.db.save_mission_progress(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "events": self.events,
+                "loads": self.loads,
+                "checkpoints": self.checkpoints,
+                "completions": self.completions,
+                "rewards_paid": self.rewards_paid,
+            }
 
-        conn.commit()
-        conn.close()
 
-    def get_missions(self, user_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM missions WHERE user_id = ?', (user_id,))
-        missions = cursor.fetchall()
-        conn.close()
-        return missions
+# Турниры
+class TournamentEngine:
+    """Турнирные таблицы активных турниров в памяти по событиям 'bet_settled'.
+
+    Участники лежат в RankedSet по ключу (-очки, reached, user_id), где
+    reached — номер изменения очков: при равенстве выше тот, кто набрал
+    их раньше. Ставка обновляет таблицу за O(log n), топ и место игрока
+    читаются оттуда же. Измененные строки раз в ``persist_interval``
+    секунд пишутся в tournament_standings одной транзакцией. При старте
+    таблицы поднимаются из нее, а после аварийной остановки — пересчетом
+    по истории игр. Закончившийся турнир закрывается одной транзакцией:
+    итоговые места и призы через журнал Рё.
+    """
+
+    def __init__(self, db: Database, persist_interval: float = TOURNAMENT_PERSIST_SECONDS):
+        self.db = db
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        # id -> {"info": строка tournaments, "rule", "games", "board", "players": {user_id: [очки, раунды, reached, ник]},
+        #        "dirty": измененные после записи}
+        self._tournaments = {}
+        self._reached = itertools.count(1)
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = False
+        self.events = 0
+        self.updates = 0
+        self.persists = 0
+        self.persisted_rows = 0
+        self.closed = 0
+        self.prizes_paid = 0
+        self.errors = 0
+        self.max_persist_ms = 0.0
+        db.events.subscribe('bet_settled', self.on_bet)
+        db.events.subscribe('tournament_created', self.on_created)
+
+    def _add(self, info: dict, rows: list = ()):
+        tournament = {
+            "info": info,
+            "rule": TOURNAMENT_SCORING[info["scoring"]],
+            "games": frozenset(game for game in info["games"].split(",") if game),
+            "board": RankedSet(),
+            "players": {},
+            "dirty": set(),
+        }
+        for user_id, username, score, rounds, reached in rows:
+            tournament["players"][user_id] = [score, rounds, reached, username]
+            tournament["board"].add((-score, reached, user_id))
+        with self._lock:
+            if rows:
+                self._reached = itertools.count(max(next(self._reached), max(row[4] for row in rows) + 1))
+            self._tournaments[info["id"]] = tournament
+
+    def start(self):
+        """Поднимает таблицы активных турниров и запускает фоновую запись и закрытие"""
+        clean = self.db.get_setting('tournaments_clean') == '1'
+        self.db.set_setting('tournaments_clean', '0')
+        for row in self.db.get_tournaments('active', limit=-1):
+            info = dict(zip(TOURNAMENT_COLUMNS, row))
+            if clean:
+                rows = self.db.load_standings(info["id"])
+            else:
+                # Прошлый запуск не дописал таблицы — считаем заново по истории
+                rows = self.db.rebuild_standings(info)
+                print(f"🏆 Турнир «{info['name']}»: таблица пересчитана по истории игр, участников {len(rows)}")
+            self._add(info, rows)
+            if not clean:
+                with self._lock:
+                    self._tournaments[info["id"]]["dirty"].update(row[0] for row in rows)
+        self._started = True
+        if self.persist_interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="tournaments", daemon=True)
+            self._thread.start()
+
+    def on_created(self, event: dict):
+        self._add(dict(event))
+
+    def on_bet(self, event: dict):
+        now = time.time()
+        user_id = event["user_id"]
+        with self._lock:
+            self.events += 1
+            for tournament in self._tournaments.values():
+                info = tournament["info"]
+                if not info["starts_at"] <= now < info["ends_at"]:
+                    continue
+                if tournament["games"] and event["game_type"] not in tournament["games"]:
+                    continue
+                rule = tournament["rule"]
+                points = [rule.points(bet, win) for bet, win, _ in event["rounds"]]
+                gained = sum(points) if rule.aggregate == 'sum' else max(points)
+                board = tournament["board"]
+                player = tournament["players"].get(user_id)
+                if player is None:
+                    player = tournament["players"][user_id] = [gained, 0, next(self._reached), event["username"]]
+                    board.add((-gained, player[2], user_id))
+                else:
+                    score = player[0] + gained if rule.aggregate == 'sum' else max(player[0], gained)
+                    if score != player[0]:
+                        board.remove((-player[0], player[2], user_id))
+                        player[0], player[2] = score, next(self._reached)
+                        board.add((-score, player[2], user_id))
+                player[1] += len(points)
+                tournament["dirty"].add(user_id)
+                self.updates += 1
 
-    def update_mission(self, mission_id: int, progress: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE missions SET progress = ? WHERE id = ?', (progress, mission_id))
+    @staticmethod
+    def _entries(tournament: dict, keys: list, first_place: int) -> list:
+        entries = []
+        for place, (_, _, user_id) in enumerate(keys, first_place):
+            score, rounds, _, username = tournament["players"][user_id]
+            entries.append({"place": place, "username": username, "score": score, "rounds": rounds})
+        return entries
+
+    def top(self, tournament_id: int, limit: int = 10) -> Optional[dict]:
+        """Топ турнира или None, если его таблицы нет в памяти (закрыт или не существует)"""
+        with self._lock:
+            tournament = self._tournaments.get(tournament_id)
+            if tournament is None:
+                return None
+            return {"participants": len(tournament["board"]),
+                    "standings": self._entries(tournament, tournament["board"].slice(0, limit), 1)}
+
+    def position(self, tournament_id: int, user_id: int, window: int = 5) -> Optional[dict]:
+        """Место игрока и соседи по window с каждой стороны; None — таблицы нет в памяти"""
+        with self._lock:
+            tournament = self._tournaments.get(tournament_id)
+            if tournament is None:
+                return None
+            board = tournament["board"]
+            player = tournament["players"].get(user_id)
+            if player is None:
+                return {"participants": len(board), "place": None, "standings": []}
+            index = board.index((-player[0], player[2], user_id))
+            start = max(0, index - window)
+            return {"participants": len(board), "place": index + 1,
+                    "standings": self._entries(tournament, board.slice(start, 2 * window + 1), start + 1)}
+
+    def persist(self):
+        """Дописывает измененные строки всех таблиц одной транзакцией"""
+        with self._lock:
+            taken = {}
+            rows = []
+            for tournament_id, tournament in self._tournaments.items():
+                dirty, tournament["dirty"] = tournament["dirty"], set()
+                taken[tournament_id] = dirty
+                players = tournament["players"]
+                rows.extend((tournament_id, user_id) + tuple(players[user_id][:3]) for user_id in dirty)
+        if not rows:
+            return
+
+        started = time.perf_counter()
+        try:
+            self.db.save_standings(rows)
+        except Exception:
+            with self._lock:
+                for tournament_id, dirty in taken.items():
+                    if tournament_id in self._tournaments:
+                        self._tournaments[tournament_id]["dirty"] |= dirty
+            raise
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.persists += 1
+            self.persisted_rows += len(rows)
+            self.max_persist_ms = max(self.max_persist_ms, elapsed)
+
+    def close_finished(self, now: Optional[float] = None):
+        """Закрывает турниры, окно которых закончилось, и выплачивает призы"""
+        now = time.time() if now is None else now
+        with self._lock:
+            finished = [tournament_id for tournament_id, tournament in self._tournaments.items()
+                        if tournament["info"]["ends_at"] <= now]
+        for tournament_id in finished:
+            with self._lock:
+                tournament = self._tournaments[tournament_id]
+                players = tournament["players"]
+                ranking = [(user_id,) + tuple(players[user_id][:3])
+                           for _, _, user_id in tournament["board"].slice(0, len(tournament["board"]))]
+            info = tournament["info"]
+            paid = self.db.close_tournament(tournament_id, ranking, json.loads(info["prizes"]))
+            with self._lock:
+                del self._tournaments[tournament_id]
+                if paid is not None:
+                    self.closed += 1
+                    self.prizes_paid += sum(prize for _, _, prize in paid)
+            if paid is not None:
+                print(f"🏆 Турнир «{info['name']}» закрыт: участников {len(ranking)}, "
+                      f"призов {len(paid)} на {sum(prize for _, _, prize in paid)} Рё")
+
+    def _loop(self):
+        while not self._stop.wait(self.persist_interval):
+            try:
+                self.persist()
+                self.close_finished()
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"❌ Ошибка записи турнирных таблиц: {e}")
+
+    def close(self):
+        """Останавливает фоновый поток, дописывает таблицы и отмечает чистую остановку"""
+        if not self._started:
+            return
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.persist()
+        self.db.set_setting('tournaments_clean', '1')
+        self._started = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tournaments": len(self._tournaments),
+                "participants": sum(len(tournament["board"]) for tournament in self._tournaments.values()),
+                "events": self.events,
+                "updates": self.updates,
+                "persists": self.persists,
+                "persisted_rows": self.persisted_rows,
+                "closed": self.closed,
+                "prizes_paid": self.prizes_paid,
+                "errors": self.errors,
+                "max_persist_ms": round(self.max_persist_ms, 3),
+            }
 
-        # Проверяем выполнение
-        cursor.execute('SELECT * FROM missions WHERE id = ?', (mission_id,))
-        mission = cursor.fetchone()
 
-        if mission and mission[3] >= mission[5]:  # progress >= reward
-            cursor.execute('UPDATE missions SET completed = 1 WHERE id = ?', (mission_id,))
+# Допуск запросов
+class RateLimiter:
+    """Token bucket на игрока: ``rate`` запросов в секунду с запасом ``burst``.
+
+    Корзина — [жетоны, время пополнения] в OrderedDict. Проверка доливает
+    жетоны за прошедшее время и переносит корзину в конец, поэтому в начале
+    словаря лежат самые давние. Корзина, которую не трогали burst / rate
+    секунд, уже полна и не отличается от отсутствующей: раз в
+    ``sweep_interval`` такие снимаются с начала до первой свежей. Лимит
+    действует внутри процесса — в многопроцессном режиме у каждого воркера свой.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT_PER_SECOND, burst: int = RATE_LIMIT_BURST,
+                 sweep_interval: float = RATE_LIMIT_SWEEP_SECONDS):
+        self.rate = rate
+        self.burst = burst
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # ключ игрока -> [жетоны, time.monotonic() пополнения]
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.allowed = 0
+        self.limited = 0
+        self.swept = 0
+
+    def acquire(self, key) -> float:
+        """0 — запрос пропущен и жетон списан, иначе через сколько секунд появится жетон"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            if now >= self._next_sweep:
+                self._sweep(now)
+
+            if bucket[0] < 1:
+                self.limited += 1
+                return (1 - bucket[0]) / self.rate
+            bucket[0] -= 1
+            self.allowed += 1
+            return 0.0
+
+    def _sweep(self, now: float):
+        idle_since = now - self.burst / self.rate
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket[1] > idle_since:
+                break
+            del self._buckets[key]
+            self.swept += 1
+        self._next_sweep = now + self.sweep_interval
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": len(self._buckets),
+                "allowed": self.allowed,
+                "limited": self.limited,
+                "swept": self.swept,
+            }
 
-        conn.commit()
-        conn.close()
 
-    def get_leaderboard(self, limit: int = 10):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT username, village, ryo, rank, total_earned 
-            FROM users 
-            ORDER BY ryo DESC 
-            LIMIT ?
-        ''', (limit,))
-        leaderboard = cursor.fetchall()
-        conn.close()
-        return leaderboard
+class IdempotencyCache:
+    """Ответы ставок и наград по Idempotency-Key: повтор запроса получает сохраненный ответ.
+
+    Перед выполнением ключ резервируется (begin), и одновременный дубль
+    получает 'busy' вместо второго прохода по базе. Успешный ответ
+    сохраняется на ``ttl`` секунд (finish); ошибка снимает резерв (abort):
+    такой запрос ничего не провел, и повтор выполнится заново. С ответом
+    хранится отпечаток запроса — тот же ключ с другим телом дает 'mismatch'.
+    Резерв живет ``pending_ttl`` секунд, чтобы ключ воркера, упавшего
+    посреди запроса, не висел до конца ttl. Записи идут в OrderedDict
+    примерно по сроку; сверх ``size`` вытесняются самые старые. В
+    многопроцессном режиме кэш один — у процесса-писателя, ведь повтор
+    попадает в другой воркер так же часто, как в тот же.
+    """
+
+    def __init__(self, size: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL,
+                 pending_ttl: float = WRITER_TIMEOUT):
+        self.size = size
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ключ -> [истекает, отпечаток, ответ или None, пока выполняется]
+        self.started = 0
+        self.stored = 0
+        self.replays = 0
+        self.conflicts = 0
+        self.mismatches = 0
+        self.evicted = 0
+
+    def begin(self, key: str, fingerprint: str) -> tuple:
+        """('new', None) — ключ зарезервирован, ('replay', ответ), ('busy', None) или ('mismatch', None)"""
+        now = time.monotonic()
+        with self._lock:
+            while self._entries:
+                oldest = next(iter(self._entries.values()))
+                if oldest[0] > now:
+                    break
+                self._entries.popitem(last=False)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]  # просроченный резерв в середине словаря
+                entry = None
+
+            if entry is None:
+                self._entries[key] = [now + self.pending_ttl, fingerprint, None]
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+                    self.evicted += 1
+                self.started += 1
+                return 'new', None
+            if entry[1] != fingerprint:
+                self.mismatches += 1
+                return 'mismatch', None
+            if entry[2] is None:
+                self.conflicts += 1
+                return 'busy', None
+            self.replays += 1
+            return 'replay', entry[2]
+
+    def finish(self, key: str, response: bytes):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return  # вытеснен или просрочен — повтор выполнится заново
+            entry[0] = time.monotonic() + self.ttl
+            entry[2] = response
+            self._entries[key] = entry
+            self.stored += 1
+
+    def abort(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is None:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "started": self.started,
+                "stored": self.stored,
+                "replays": self.replays,
+                "conflicts": self.conflicts,
+                "mismatches": self.mismatches,
+                "evicted": self.evicted,
+            }
 
-# Инициализация
-db = Database()
 
+# Асинхронный слой базы
+class AsyncDatabase:
+    """Неблокирующая обертка над Database для async-эндпоинтов.
+
+    В режиме "async" чтения идут в отдельный пул потоков размера
+    read_workers, а все записи — через одну задачу-писателя: она забирает
+    операции из asyncio.Queue пачками и выполняет их по очереди в своем
+    единственном потоке одной транзакцией (Database.group_commit), так что
+    писатели не дерутся за блокировку SQLite, а коммит один на пачку.
+    В режиме "sync" все вызовы уходят в общий пул потоков Starlette —
+    ровно как у прежних синхронных эндпоинтов (удобно для сравнения).
+    В режиме "remote" чтения те же, что в "async", а записи уходят
+    процессу-писателю через WriterClient.
+    """
+
+    def __init__(self, db: Database, mode: str = DB_MODE, read_workers: int = DB_READ_WORKERS,
+                 write_batch: int = DB_WRITE_BATCH, socket_path: str = WRITER_SOCKET):
+        if mode not in ("async", "sync", "remote"):
+            raise ValueError(f"Неизвестный режим базы: {mode}")
+        self.db = db
+        self.mode = mode
+        self.write_batch = write_batch
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-read")
+        self._writer_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+        self._writers = {}  # цикл событий -> (очередь, задача-писатель)
+        self.remote = WriterClient(db, socket_path) if mode == "remote" else None
+        self.reads = 0
+        self.writes = 0
+        self.write_batches = 0
+        self.max_write_queue = 0
+
+    def start(self) -> Optional[asyncio.Queue]:
+        """Очередь записи текущего цикла событий; писатель создается при первом обращении.
+
+        Очередь и задача привязаны к своему циклу. Обычно цикл один, но,
+        например, TestClient из нескольких потоков гоняет несколько циклов
+        сразу — у каждого свой писатель, а поток записи общий.
+        """
+        if self.mode != "async":
+            return None
+        loop = asyncio.get_running_loop()
+        entry = self._writers.get(loop)
+        if entry is None or entry[1].done():
+            for other in [other for other in self._writers if other.is_closed()]:
+                del self._writers[other]
+            write_queue = asyncio.Queue()
+            entry = self._writers[loop] = (write_queue, loop.create_task(self._writer(write_queue)))
+        return entry[0]
+
+    async def close(self):
+        if self.remote:
+            await self.remote.close()
+        entry = self._writers.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            write_queue, task = entry
+            await write_queue.join()
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._readers.shutdown(wait=True)
+        self._writer_thread.shutdown(wait=True)
+
+    async def read(self, fn, *args):
+        self.reads += 1
+        if self.mode == "sync":
+            return await run_in_threadpool(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._readers, functools.partial(fn, *args))
+
+    async def write(self, fn, *args):
+        self.writes += 1
+        if self.mode == "sync":
+            return await run_in_threadpool(fn, *args)
+        if self.remote:
+            return await self.remote.call(fn.__name__, *args)
+
+        write_queue = self.start()
+        future = asyncio.get_running_loop().create_future()
+        write_queue.put_nowait((functools.partial(fn, *args), future))
+        self.max_write_queue = max(self.max_write_queue, write_queue.qsize())
+        return await future
+
+    async def _writer(self, write_queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await write_queue.get()]
+            while len(batch) < self.write_batch and not write_queue.empty():
+                batch.append(write_queue.get_nowait())
+            self.write_batches += 1
+            # Один переход в поток писателя и один коммит на всю пачку; каждая
+            # операция — своя точка сохранения, и ее ошибка достается только ее вызывающему
+            outcomes = await loop.run_in_executor(self._writer_thread, self._run_batch, batch)
+            for (_, future), (ok, value) in zip(batch, outcomes):
+                if not future.done():
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+                write_queue.task_done()
+
+    def _run_batch(self, batch: list) -> list:
+        outcomes = []
+        try:
+            with self.db.group_commit():
+                for call, _ in batch:
+                    try:
+                        outcomes.append((True, call()))
+                    except Exception as e:
+                        outcomes.append((False, e))
+        except Exception as e:
+            # Общий коммит не удался — не записалась ни одна операция пачки
+            return [(False, e)] * len(batch)
+        return outcomes
+
+    async def get_user(self, username: str) -> Optional[UserRecord]:
+        """Пользователь из кэша без перехода в поток; при промахе — чтение из базы"""
+        user = self.db.users.get_by_username(username)
+        if user is None:
+            user = await self.read(self.db._load_user, 'username = ?', username)
+        return user
 
-# Вспомогательные функции
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    async def get_user_by_id(self, user_id: int) -> Optional[UserRecord]:
+        """То же по первичному ключу — для запросов с токеном сессии"""
+        user = self.db.users.get(user_id)
+        if user is None:
+            user = await self.read(self.db._load_user, 'id = ?', user_id)
+        return user
 
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "reads": self.reads,
+            "writes": self.writes,
+            "write_batches": self.write_batches,
+            "write_queue": sum(write_queue.qsize() for write_queue, _ in list(self._writers.values())),
+            "max_write_queue": self.max_write_queue,
+        }
 
-def calculate_rank(ryo: int) -> str:
-    if ryo >= 1000000:
-        return 'kage'
-    elif ryo >= 100000:
-        return 'jonin'
-    elif ryo >= 10000:
-        return 'chunin'
-    else:
-        return 'genin'
 
+# Многопроцессный режим: воркеры и процесс-писатель
+WRITER_OPERATIONS = ("create_user", "update_balance", "add_game_record", "settle_bet", "settle_batch",
+                     "claim_daily_reward", "update_password_hash", "revoke_session", "create_tournament")
+# События, которые писатель рассылает всем воркерам
+BROADCAST_EVENTS = ("balance", "mission_completed", "session_revoked")
+_FRAME_HEADER = struct.Struct("!I")
 
-# Система игр
-class GameSystem:
-    @staticmethod
-    def play_roulette(bet_element: str, bet_amount: int, village: str) -> dict:
-        """Улучшенная рулетка - всегда есть шанс выиграть"""
-        elements = ['fire', 'water', 'wind', 'earth', 'lightning']
-        winning_element = random.choice(elements)
-
-        # Базовый шанс выигрыша 60%
-        if random.random() < 0.6:
-            multiplier = 1.5
-
-            # Бонус за свою стихию
-            village_elements = {
-                'konoha': 'fire',
-                'suna': 'wind',
-                'kiri': 'water',
-                'iwa': 'earth'
-            }
 
-            if village in village_elements and winning_element == village_elements[village]:
-                multiplier = 2.0
+def encode_frame(message) -> bytes:
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return _FRAME_HEADER.pack(len(data)) + data
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Следующее сообщение из сокета или None, если соединение закрыто"""
+    try:
+        header = await reader.readexactly(_FRAME_HEADER.size)
+        return pickle.loads(await reader.readexactly(_FRAME_HEADER.unpack(header)[0]))
+    except asyncio.IncompleteReadError:
+        return None
+
 
-            win_amount = int(bet_amount * multiplier)
-            result = 'win'
+def writer_alive(path: str) -> bool:
+    """Слушает ли кто-нибудь сокет процесса-писателя"""
+    with closing(socket.socket(socket.AF_UNIX)) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+class WriterClient:
+    """Связь воркера (режим "remote") с процессом-писателем через Unix-сокет.
+
+    Вызов — кадр pickle (номер, операция, аргументы); ответы сопоставляются
+    по номеру, поэтому одно соединение держит любое число одновременных
+    вызовов. Писатель присылает воркеру события: из BROADCAST_EVENTS — все
+    (кэш пользователей, таблица лидеров, потоки SSE и отзыв токенов
+    согласованы между процессами), 'bet_settled' — только по своим ставкам. После разрыва соединение
+    восстанавливается, а кэши строятся заново: пропущенные события не
+    догнать. Соединение свое у каждого цикла событий.
+    """
+
+    def __init__(self, db: Database, path: str = WRITER_SOCKET, timeout: float = WRITER_TIMEOUT):
+        self.db = db
+        self.path = path
+        self.timeout = timeout
+        self.on_connect = []  # функции без аргументов, вызываются в пуле потоков после подключения
+        self._links = {}  # цикл событий -> задача подключения
+        self._ids = itertools.count(1)
+        self._closed = False
+        self.calls = 0
+        self.errors = 0
+        self.events = 0
+        self.connects = 0
+
+    async def connect(self) -> dict:
+        loop = asyncio.get_running_loop()
+        task = self._links.get(loop)
+        if task is None or (task.done() and (task.cancelled() or task.exception() or task.result()["closed"])):
+            for other in [other for other in self._links if other.is_closed()]:
+                del self._links[other]
+            task = self._links[loop] = loop.create_task(self._open())
+        return await asyncio.shield(task)
+
+    async def _open(self) -> dict:
+        loop = asyncio.get_running_loop()
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        link = {"writer": writer, "futures": {}, "closed": False}
+        self.connects += 1
+        # События уже идут в сокет и дождутся чтения — применятся поверх свежих данных
+        self.db.users.clear()
+        for callback in self.on_connect:
+            await loop.run_in_executor(None, callback)
+        link["task"] = loop.create_task(self._receive(reader, link))
+        return link
+
+    async def _receive(self, reader: asyncio.StreamReader, link: dict):
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                request_id, ok, value = message
+                if request_id is None:
+                    self._apply(ok, value)
+                    continue
+                future = link["futures"].pop(request_id, None)
+                if future is not None and not future.done():
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+        except Exception as e:
+            print(f"❌ Ошибка связи с процессом-писателем: {e}")
+        finally:
+            link["closed"] = True
+            link["writer"].close()
+            for future in link["futures"].values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Связь с процессом-писателем потеряна"))
+            link["futures"].clear()
+            if not self._closed:
+                asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._closed:
+            await asyncio.sleep(1.0)
+            try:
+                await self.connect()
+                return
+            except OSError:
+                continue
+
+    def _apply(self, kind: str, event: dict):
+        self.events += 1
+        if kind == 'balance':
+            self.db._publish_balance(event)
         else:
-            win_amount = 0
-            result = 'lose'
+            self.db.events.publish(kind, event)
+
+    async def call(self, method: str, *args):
+        link = await self.connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        link["futures"][request_id] = future
+        self.calls += 1
+        try:
+            link["writer"].write(encode_frame((request_id, method, args)))
+            return await asyncio.wait_for(future, self.timeout)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            link["futures"].pop(request_id, None)
+
+    async def close(self):
+        self._closed = True
+        task = self._links.pop(asyncio.get_running_loop(), None)
+        if task is not None and task.done() and not task.cancelled() and task.exception() is None:
+            receiver = task.result()["task"]
+            receiver.cancel()
+            try:
+                await receiver
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        in_flight = 0
+        for task in list(self._links.values()):
+            if task.done() and not task.cancelled() and task.exception() is None:
+                in_flight += len(task.result()["futures"])
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "events": self.events,
+            "connects": self.connects,
+            "in_flight": in_flight,
+        }
 
+
+class WriterService:
+    """Процесс-писатель многопроцессного режима — единственный, кто пишет в базу.
+
+    Принимает вызовы воркеров на Unix-сокете и ставит их в очередь своего
+    AsyncDatabase: записи всех процессов идут пачками через один поток и
+    один коммит на пачку, без "database is locked". Здесь же работают
+    движок миссий, буфер истории и архивация. События после коммита уходят
+    воркерам: общие (BROADCAST_EVENTS) — всем, 'bet_settled' — автору
+    ставки. Сокет создается с правами 0600: кадры — pickle, чужим
+    пользователям доступа нет.
+    """
+
+    _origin = contextvars.ContextVar("writer_origin", default=None)  # клиент текущей операции
+
+    def __init__(self, adb: AsyncDatabase, path: str = WRITER_SOCKET, missions: Optional[MissionEngine] = None,
+                 tournaments: Optional[TournamentEngine] = None, idempotency: Optional[IdempotencyCache] = None):
+        if adb.mode != "async":
+            raise ValueError("Процесс-писатель работает только в режиме async")
+        self.adb = adb
+        self.db = adb.db
+        self.path = path
+        self.missions = missions
+        self.tournaments = tournaments
+        self.idempotency = idempotency
+        self._writes = {name: getattr(self.db, name) for name in WRITER_OPERATIONS}
+        self._reads = {"stats": self.stats}
+        if missions is not None:
+            self._reads["mission_progress"] = missions.progress
+        if tournaments is not None:
+            self._reads["tournament_top"] = tournaments.top
+            self._reads["tournament_position"] = tournaments.position
+        if idempotency is not None:
+            self._reads["idempotency_begin"] = idempotency.begin
+            self._reads["idempotency_finish"] = idempotency.finish
+            self._reads["idempotency_abort"] = idempotency.abort
+        self._clients = {}  # номер клиента -> StreamWriter
+        self._client_ids = itertools.count(1)
+        self._loop = None
+        self.requests = 0
+        self.events_sent = 0
+        for kind in BROADCAST_EVENTS:
+            self.db.events.subscribe(kind, functools.partial(self._on_event, kind))
+        self.db.events.subscribe('bet_settled', self._on_bet)
+
+    def _run_as(self, client_id: int, operation, *args):
+        token = self._origin.set(client_id)
+        try:
+            return operation(*args)
+        finally:
+            self._origin.reset(token)
+
+    # Подписчики вызываются в потоке записи — отправку передаем циклу событий
+    def _on_event(self, kind: str, event: dict):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._send, None, (kind, event))
+
+    def _on_bet(self, event: dict):
+        client_id = self._origin.get()
+        if self._loop is not None and client_id is not None:
+            self._loop.call_soon_threadsafe(self._send, client_id, ('bet_settled', event))
+
+    def _send(self, client_id: Optional[int], event: tuple):
+        data = encode_frame((None,) + event)
+        writers = self._clients.values() if client_id is None else [self._clients.get(client_id)]
+        for writer in writers:
+            if writer is not None and not writer.is_closing():
+                writer.write(data)
+                self.events_sent += 1
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client_id = next(self._client_ids)
+        self._clients[client_id] = writer
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                request_id, method, args = message
+                self._loop.create_task(self._handle(client_id, writer, request_id, method, args))
+        except Exception as e:
+            print(f"❌ Ошибка связи с воркером {client_id}: {e}")
+        finally:
+            self._clients.pop(client_id, None)
+            writer.close()
+
+    async def _handle(self, client_id: int, writer: asyncio.StreamWriter, request_id: int, method: str,
+                      args: tuple):
+        self.requests += 1
+        try:
+            if method in self._writes:
+                reply = (request_id, True, await self.adb.write(self._run_as, client_id, self._writes[method], *args))
+            elif method in self._reads:
+                reply = (request_id, True, self._reads[method](*args))
+            else:
+                raise ValueError(f"Неизвестная операция процесса-писателя: {method}")
+        except Exception as e:
+            reply = (request_id, False, e)
+        if writer.is_closing():
+            return
+        try:
+            data = encode_frame(reply)
+        except Exception:
+            data = encode_frame((request_id, False, RuntimeError(repr(reply[2]))))
+        writer.write(data)
+
+    async def serve(self):
+        """Слушает сокет до SIGINT/SIGTERM, затем дописывает очередь записи"""
+        if writer_alive(self.path):
+            raise RuntimeError(f"Процесс-писатель уже слушает {self.path}")
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # сокет от прошлого запуска
+
+        self._loop = asyncio.get_running_loop()
+        self.adb.start()
+        if self.tournaments:
+            self.tournaments.start()
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._serve_client, path=self.path)
+        finally:
+            os.umask(umask)
+
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self._loop.add_signal_handler(signum, stop.set)
+        print(f"✍️  Процесс-писатель слушает {self.path}")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            for writer in list(self._clients.values()):
+                writer.close()
+            await server.wait_closed()
+            await self.adb.close()
+            if self.missions:
+                self.missions.flush()
+            if self.tournaments:
+                self.tournaments.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def stats(self) -> dict:
         return {
-            'winning_element': winning_element,
-            'win_amount': win_amount,
-            'result': result,
-            'details': f"Выпал: {winning_element}"
+            "clients": len(self._clients),
+            "requests": self.requests,
+            "events_sent": self.events_sent,
+            "async": self.adb.stats(),
+            "pool": self.db.pool.stats(),
+            "history_writer": self.db.history_writer.stats() if self.db.history_writer else None,
+            "archive": self.db.archive.stats(),
+            "ledger": self.db.ledger_stats(),
+            "analytics": self.db.analytics.stats(),
+            "missions": self.missions.stats() if self.missions else None,
+            "tournaments": self.tournaments.stats() if self.tournaments else None,
+            "idempotency": self.idempotency.stats() if self.idempotency else None,
         }
 
-    @staticmethod
-    def play_slots(bet_amount: int, village: str) -> dict:
-        """Слоты с гарантированным мини-выигрышем"""
-        symbols = ['🍥', '🍃', '🌀', '💧', '🌍', '⚡', '🎯', '💰']
 
-        # Генерируем результаты
-        results = [random.choice(symbols) for _ in range(3)]
+# Поток событий для фронтенда
+class StreamSubscriber:
+    """Одно SSE-соединение: ограниченная очередь и последние значения сливаемых событий.
+
+    Сливаемое событие ('balance', 'leaderboard') занимает в очереди одно
+    место, пока его не прочитали: новые данные дописываются поверх. Поэтому
+    серия ставок доходит до клиента одним сообщением с последним балансом.
+    """
+
+    __slots__ = ("user_id", "loop", "queue", "latest", "dropped")
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop, maxsize: int = STREAM_QUEUE_SIZE):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.latest = {}  # вид события -> данные, еще не отданные клиенту
+        self.dropped = False
+
+    def offer(self, kind: str, data: dict, coalesce: bool) -> bool:
+        """Вызывается в цикле событий подписчика; False — очередь переполнена"""
+        if coalesce:
+            pending = self.latest.get(kind)
+            if pending is not None:
+                self.latest[kind] = {**pending, **data}
+                return True
+            self.latest[kind] = data
+            item = kind
+        else:
+            item = (kind, data)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def get(self) -> tuple:
+        item = await self.queue.get()
+        if isinstance(item, str):
+            return item, self.latest.pop(item)
+        return item
+
+
+class StreamHub:
+    """Рассылка изменений SSE-подписчикам (/api/stream/{username}) без опроса базы.
+
+    Источник — шина событий Database: 'balance' уходит подписчикам этого
+    игрока, 'mission_completed' — тоже. Таблицу лидеров хаб не пересчитывает
+    на каждую ставку: событие, способное задеть топ, только помечает его
+    грязным, а фоновая задача раз в interval секунд сравнивает топ с
+    разосланным и отправляет всем разницу по местам. Подписчики живут в
+    своих циклах событий; запись идет в их очереди через call_soon_threadsafe.
+    Кто не успевает читать и переполнил очередь, отключается — браузер
+    переподключится и получит свежий снимок.
+    """
+
+    def __init__(self, db: Database, leaderboard: Leaderboard, queue_size: int = STREAM_QUEUE_SIZE,
+                 interval: float = STREAM_LEADERBOARD_INTERVAL, size: int = STREAM_LEADERBOARD_SIZE):
+        self.db = db
+        self.leaderboard = leaderboard
+        self.queue_size = queue_size
+        self.interval = interval
+        self.size = size
+        self._lock = threading.Lock()
+        self._users = {}  # user_id -> множество подписчиков
+        self._top = {}  # место -> строка последнего разосланного топа
+        self._top_names = frozenset()
+        self._floor = 0  # ryo последнего места в топе
+        self._dirty = True
+        self._encoded = (None, b"")  # последние данные и их кодировка
+        self._task = None
+        self.subscribers = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.leaderboard_updates = 0
+        db.events.subscribe('balance', self.on_balance)
+        db.events.subscribe('mission_completed', self.on_mission)
+
+    def subscribe(self, user_id: int) -> StreamSubscriber:
+        subscriber = StreamSubscriber(user_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._users.setdefault(user_id, set()).add(subscriber)
+            self.subscribers += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber):
+        with self._lock:
+            group = self._users.get(subscriber.user_id)
+            if group is None or subscriber not in group:
+                return
+            group.discard(subscriber)
+            if not group:
+                del self._users[subscriber.user_id]
+            self.subscribers -= 1
+
+    # Подписчики шины вызываются в потоке записи
+    def on_balance(self, event: dict):
+        if not self._users:
+            return
+        if (event["username"] in self._top_names or event["ryo"] >= self._floor
+                or len(self._top) < self.size):
+            self._dirty = True
+        with self._lock:
+            group = list(self._users.get(event["user_id"], ()))
+        if group:
+            self._fanout(group, 'balance', {
+                "ryo": event["ryo"],
+                "rank": event["rank"],
+                "total_earned": event["total_earned"]
+            }, True)
+
+    def on_mission(self, event: dict):
+        with self._lock:
+            group = list(self._users.get(event["user_id"], ()))
+        if group:
+            self._fanout(group, 'mission', {
+                "id": event["mission_id"],
+                "type": event["mission_type"],
+                "reward": event["reward"]
+            }, False)
+
+    def _fanout(self, subscribers: list, kind: str, data: dict, coalesce: bool):
+        by_loop = {}
+        for subscriber in subscribers:
+            by_loop.setdefault(subscriber.loop, []).append(subscriber)
+        for loop, group in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self._deliver, group, kind, data, coalesce)
+            except RuntimeError:
+                pass  # цикл уже закрыт — его подписчики отписываются сами
+
+    def _deliver(self, group: list, kind: str, data: dict, coalesce: bool):
+        for subscriber in group:
+            if subscriber.dropped:
+                continue
+            if subscriber.offer(kind, data, coalesce):
+                self.delivered += 1
+            else:
+                # Медленный клиент: поток закроется, когда он дочитает очередь
+                subscriber.dropped = True
+                self.dropped += 1
+                self.unsubscribe(subscriber)
+
+    def invalidate(self):
+        """Топ надо сверить заново (например, таблица лидеров перестроена)"""
+        self._dirty = True
+
+    def snapshot(self) -> dict:
+        """Текущий топ целиком: место -> строка"""
+        return {str(entry["rank"]): entry for entry in self.leaderboard.top(self.size)}
+
+    def refresh(self):
+        top = self.snapshot()
+        delta = {position: entry for position, entry in top.items() if self._top.get(position) != entry}
+        self._top = top
+        self._top_names = frozenset(entry["username"] for entry in top.values())
+        self._floor = min((entry["ryo"] for entry in top.values()), default=0) if len(top) >= self.size else 0
+        if not delta:
+            return
+        self.leaderboard_updates += 1
+        with self._lock:
+            everyone = [subscriber for group in self._users.values() for subscriber in group]
+        self._fanout(everyone, 'leaderboard', delta, True)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._dirty and self._users:
+                self._dirty = False
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"❌ Ошибка рассылки таблицы лидеров: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def message(self, kind: str, data: dict) -> bytes:
+        """Кадр SSE; одна дельта топа кодируется один раз на всех подписчиков"""
+        encoded = self._encoded
+        if encoded[0] is data:
+            return encoded[1]
+        body = f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+        self._encoded = (data, body)
+        return body
+
+    def stats(self) -> dict:
+        with self._lock:
+            users = len(self._users)
+        return {
+            "subscribers": self.subscribers,
+            "users": users,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "leaderboard_updates": self.leaderboard_updates,
+        }
 
-        # Гарантированный минимальный выигрыш 20%
-        base_win = int(bet_amount * 0.2)
 
-        # Проверяем комбинации
-        win_amount = base_win
+# Хеширование паролей
+class PasswordHasher:
+    """Пул процессов для scrypt с ограничением очереди.
+
+    scrypt нарочно дорогой — десятки миллисекунд процессора и 16 МБ памяти
+    на вызов — и в цикле событий останавливал бы игры на время каждого
+    входа. Вызовы уходят в отдельные процессы. fork в процессе с потоками
+    (писатель истории, uvicorn) может унести в дочерний чужую захваченную
+    блокировку, поэтому процессы запускаются через forkserver, а где его
+    нет — через spawn. В пул уходит только hashlib.scrypt с аргументами:
+    дочерним не нужно импортировать приложение. Очередь ограничена
+    max_pending: во время волны входов лишние сразу получают 503, а не ждут
+    в очереди, которую все равно не дождутся. workers=0 — считать прямо в
+    цикле событий, для сравнения в бенчмарке.
+    """
+
+    def __init__(self, workers: int = KDF_WORKERS, max_pending: int = KDF_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+        return self._executor
+
+    def admit(self) -> bool:
+        """Есть ли место в очереди; вызывается в цикле событий перед run()"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            metrics.inc("shinobi_kdf_rejected_total")
+            return False
+        return True
+
+    async def scrypt(self, operation: str, password: str, salt: bytes, n: int, r: int, p: int, dklen: int) -> bytes:
+        """hashlib.scrypt в пуле; operation — метка в метриках"""
+        self.pending += 1
+        started = time.perf_counter()
+        kwargs = {"salt": salt, "n": n, "r": r, "p": p, "maxmem": 256 * n * r, "dklen": dklen}
+        try:
+            if self.workers <= 0:
+                return hashlib.scrypt(password.encode(), **kwargs)
+            try:
+                return await asyncio.wrap_future(self._pool().submit(hashlib.scrypt, password.encode(), **kwargs))
+            except BrokenProcessPool:
+                self._executor = None  # процесс пула убит — следующий вызов создаст новый пул
+                raise
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            metrics.observe("shinobi_kdf_duration_seconds", (("operation", operation),),
+                            time.perf_counter() - started)
 
-        if results[0] == results[1] == results[2]:
-            # Джекпот - три одинаковых
-            win_amount = bet_amount * 10
-        elif results[0] == results[1] or results[1] == results[2]:
-            # Два одинаковых
-            win_amount = bet_amount * 3
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
 
-        # Бонус деревни Суна
-        if village == 'suna':
-            win_amount = int(win_amount * 1.3)
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
 
+
+# Токены сессии
+class SessionTokens:
+    """Подписанные токены сессии: игрок определяется без обращения к базе.
+
+    Токен — base64url от упакованных полей (версия, id игрока, срок действия,
+    случайный номер токена) и HMAC-SHA256 от них, обрезанного до 16 байт:
+    50 символов. Подпись и срок проверяются в памяти. База нужна только для
+    ответа "не отозван ли токен" (выход), и этот ответ запоминается в
+    LRU-кэше по номеру токена. Отзыв сразу попадает в кэш событием
+    'session_revoked', в многопроцессном режиме — от писателя, так что
+    закэшированное "не отозван" не устаревает.
+    """
+
+    VERSION = 1
+    _PAYLOAD = struct.Struct("!BQI8s")
+    _SIGNATURE_SIZE = 16
+
+    def __init__(self, adb: AsyncDatabase, secret: str = SESSION_SECRET, ttl: int = SESSION_TTL,
+                 cache_size: int = SESSION_CACHE_SIZE):
+        self.adb = adb
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._key = (secret or adb.db.get_setting('session_secret')).encode()
+        self._lock = threading.Lock()
+        self._revoked = OrderedDict()  # номер токена -> отозван ли
+        self.issued = 0
+        self.rejected = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        adb.db.events.subscribe('session_revoked', self.on_revoked)
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._key, payload, hashlib.sha256).digest()[:self._SIGNATURE_SIZE]
+
+    def issue(self, user_id: int) -> tuple:
+        """Новый токен и его срок действия (unix-время)"""
+        expires_at = int(time.time()) + self.ttl
+        payload = self._PAYLOAD.pack(self.VERSION, user_id, expires_at, os.urandom(8))
+        self.issued += 1
+        return base64.urlsafe_b64encode(payload + self._sign(payload)).rstrip(b"=").decode(), expires_at
+
+    def decode(self, token: str) -> Optional[tuple]:
+        """(id игрока, срок, номер токена) для подлинного непросроченного токена"""
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except ValueError:
+            return None
+        if len(raw) != self._PAYLOAD.size + self._SIGNATURE_SIZE:
+            return None
+        payload, signature = raw[:self._PAYLOAD.size], raw[self._PAYLOAD.size:]
+        if not hmac.compare_digest(self._sign(payload), signature):
+            return None
+        version, user_id, expires_at, token_id = self._PAYLOAD.unpack(payload)
+        if version != self.VERSION or expires_at <= time.time():
+            return None
+        return user_id, expires_at, token_id
+
+    def _cached(self, token_id: bytes) -> Optional[bool]:
+        with self._lock:
+            revoked = self._revoked.get(token_id)
+            if revoked is None:
+                self.cache_misses += 1
+            else:
+                self._revoked.move_to_end(token_id)
+                self.cache_hits += 1
+            return revoked
+
+    def _remember(self, token_id: bytes, revoked: bool):
+        with self._lock:
+            if revoked:
+                self._revoked[token_id] = True
+            else:
+                # Отзыв мог прийти, пока шло чтение из базы, — его не затираем
+                self._revoked.setdefault(token_id, False)
+            self._revoked.move_to_end(token_id)
+            while len(self._revoked) > self.cache_size:
+                self._revoked.popitem(last=False)
+
+    async def authenticate(self, token: str) -> Optional[int]:
+        """id игрока по токену или None"""
+        decoded = self.decode(token)
+        if decoded is not None:
+            user_id, _, token_id = decoded
+            revoked = self._cached(token_id)
+            if revoked is None:
+                revoked = await self.adb.read(self.adb.db.is_session_revoked, token_id)
+                self._remember(token_id, revoked)
+            if not revoked:
+                return user_id
+        self.rejected += 1
+        return None
+
+    async def revoke(self, token: str) -> bool:
+        decoded = self.decode(token)
+        if decoded is None:
+            return False
+        _, expires_at, token_id = decoded
+        await self.adb.write(self.adb.db.revoke_session, token_id, expires_at)
+        self._remember(token_id, True)
+        return True
+
+    def on_revoked(self, event: dict):
+        self._remember(event["token_id"], True)
+
+    def clear(self):
+        with self._lock:
+            self._revoked.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._revoked)
         return {
-            'results': results,
-            'win_amount': win_amount,
-            'result': 'win' if win_amount > 0 else 'lose'
+            "issued": self.issued,
+            "rejected": self.rejected,
+            "cache_size": size,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
         }
 
-    @staticmethod
-    def play_dice(bet_amount: int, village: str) -> dict:
-        """Улучшенные кости - понятная логика"""
-        dice_faces = ['⚀', '⚁', '⚂', '⚃', '⚄', '⚅']
 
-        # Бросаем два кубика
-        dice1 = random.randint(1, 6)
-        dice2 = random.randint(1, 6)
+# Сбор метрик приложения
+def record_bet_metrics(event: dict):
+    game_type, village = event["game_type"], event["village"]
+    for bet, win, result in event["rounds"]:
+        labels = (("game", game_type), ("village", village))
+        metrics.inc("shinobi_bets_total", labels + (("result", result),))
+        metrics.inc("shinobi_wagered_ryo_total", labels, bet)
+        metrics.inc("shinobi_payout_ryo_total", labels, win)
+
+
+def runtime_gauges() -> list:
+    gauges = []
+    for key, value in db.pool.stats().items():
+        if key != "size":
+            gauges.append((f"shinobi_db_pool_{key}", "gauge", f"Пул соединений: {key}", (), value))
+    for key, value in db.users.stats().items():
+        gauges.append((f"shinobi_user_cache_{key}", "gauge", f"Кэш пользователей: {key}", (), value))
+    if db.history_writer:
+        for key, value in db.history_writer.stats().items():
+            gauges.append((f"shinobi_history_writer_{key}", "gauge", f"Буфер истории: {key}", (), value))
+    for key in ("months", "moved_rows", "chunks", "errors"):
+        gauges.append((f"shinobi_archive_{key}", "gauge", f"Архив истории: {key}", (), db.archive.stats()[key]))
+    for key in ("folded_rows", "chunks", "errors", "pruned_rows"):
+        gauges.append((f"shinobi_analytics_{key}", "gauge", f"Сводки аналитики: {key}", (),
+                       db.analytics.stats()[key]))
+    if db.ledger_owner:
+        for key, value in db.ledger_stats().items():
+            gauges.append((f"shinobi_ledger_{key}", "gauge", f"Журнал Рё: {key}", (), value or 0))
+    for key, value in adb.stats().items():
+        if key != "mode":
+            gauges.append((f"shinobi_async_db_{key}", "gauge", f"Асинхронный слой базы: {key}", (), value))
+    if adb.remote:
+        for key, value in adb.remote.stats().items():
+            gauges.append((f"shinobi_writer_client_{key}", "gauge", f"Связь с процессом-писателем: {key}", (), value))
+    if missions:
+        for key, value in missions.stats().items():
+            gauges.append((f"shinobi_missions_{key}", "gauge", f"Движок миссий: {key}", (), value))
+    if tournaments:
+        for key, value in tournaments.stats().items():
+            gauges.append((f"shinobi_tournaments_{key}", "gauge", f"Турниры: {key}", (), value))
+    for key, value in rate_limiter.stats().items():
+        gauges.append((f"shinobi_rate_limiter_{key}", "gauge", f"Лимит частоты запросов: {key}", (), value))
+    if not adb.remote:
+        for key, value in idempotency.stats().items():
+            gauges.append((f"shinobi_idempotency_{key}", "gauge", f"Кэш Idempotency-Key: {key}", (), value))
+    gauges.append(("shinobi_leaderboard_players", "gauge", "Игроков в таблице лидеров", (),
+                   leaderboard.stats()["players"]))
+    for key, value in stream_hub.stats().items():
+        gauges.append((f"shinobi_stream_{key}", "gauge", f"Потоки SSE: {key}", (), value))
+    for key, value in session_tokens.stats().items():
+        gauges.append((f"shinobi_session_{key}", "gauge", f"Токены сессии: {key}", (), value))
+    for key in ("workers", "pending", "max_pending"):
+        gauges.append((f"shinobi_kdf_{key}", "gauge", f"Пул хеширования паролей: {key}", (),
+                       password_hasher.stats()[key]))
+    return gauges
+
+
+class SlowRequestProfiler:
+    """Выборочное профилирование: cProfile для доли запросов, медленные сохраняются.
+
+    Включается SHINOBI_PROFILE_SAMPLE_RATE > 0. Одновременно профилируется не
+    больше одного запроса; профиль охватывает поток цикла событий, так что в
+    него попадают и соседние корутины, зато не нужен отдельный поток.
+    """
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, slow_ms: float = PROFILE_SLOW_MS,
+                 keep: int = PROFILE_KEEP):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.profiles = deque(maxlen=keep)
+        self._active = False
+
+    def start(self) -> Optional[cProfile.Profile]:
+        if self.sample_rate <= 0 or self._active or random.random() >= self.sample_rate:
+            return None
+        self._active = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish(self, profiler: cProfile.Profile, route: str, elapsed: float):
+        profiler.disable()
+        self._active = False
+        if elapsed * 1000 < self.slow_ms:
+            return
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+        self.profiles.append({
+            "route": route,
+            "duration_ms": round(elapsed * 1000, 3),
+            "at": datetime.utcnow().isoformat(),
+            "profile": out.getvalue()
+        })
+
 
-        total = dice1 + dice2
+profiler = SlowRequestProfiler()
 
-        # Понятная система выигрыша:
-        if total == 7:  # Самый частый результат
-            win_amount = bet_amount * 2
-        elif total in [6, 8]:
-            win_amount = bet_amount * 1.5
-        elif total in [2, 12]:  # Реже всего
-            win_amount = bet_amount * 5
-        else:
-            win_amount = 0
 
-        # Бонус деревни Ива
-        if village == 'iwa' and win_amount > 0:
-            win_amount = int(win_amount * 1.5)
+class MetricsMiddleware:
+    """ASGI-middleware: гистограмма задержек по шаблону маршрута, методу и статусу.
 
-        return {
-            'dice1': dice_faces[dice1 - 1],
-            'dice2': dice_faces[dice2 - 1],
-            'total': total,
-            'win_amount': int(win_amount),
-            'result': 'win' if win_amount > 0 else 'lose'
+    Поток событий (text/event-stream) открыт часами, поэтому для него
+    меряется время до начала ответа.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        state = {"status": 500, "done": False}
+        started = time.perf_counter()
+        sampled = profiler.start()
+
+        def finish():
+            if state["done"]:
+                return
+            state["done"] = True
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            metrics.observe("shinobi_http_request_duration_seconds",
+                            (("method", scope["method"]), ("route", path), ("status", state["status"])), elapsed)
+            if sampled is not None:
+                profiler.finish(sampled, f"{scope['method']} {path}", elapsed)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                if any(name == b"content-type" and value.startswith(b"text/event-stream")
+                       for name, value in message.get("headers", ())):
+                    finish()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+
+
+# Инициализация
+# При запуске "python main.py" процессы пула хеширования (forkserver/spawn)
+# импортируют этот файл как __mp_main__: базе и потокам там делать нечего
+if __name__ != "__mp_main__":
+    db = Database(background=DB_MODE != "remote")
+    leaderboard = Leaderboard(db)
+    # Миссии двигает тот, кто пишет в базу: в режиме "remote" — процесс-писатель
+    missions = MissionEngine(db) if DB_MODE != "remote" else None
+    tournaments = TournamentEngine(db) if DB_MODE != "remote" else None
+    adb = AsyncDatabase(db)
+    stream_hub = StreamHub(db, leaderboard)
+    password_hasher = PasswordHasher()
+    session_tokens = SessionTokens(adb)
+    rate_limiter = RateLimiter()
+    # В режиме "remote" ответы по Idempotency-Key хранит процесс-писатель
+    idempotency = IdempotencyCache()
+    if adb.remote:
+        adb.remote.on_connect.append(leaderboard.warm)
+        adb.remote.on_connect.append(stream_hub.invalidate)
+        adb.remote.on_connect.append(session_tokens.clear)
+    db.events.subscribe('bet_settled', record_bet_metrics)
+    metrics.add_collector(runtime_gauges)
+    app.add_middleware(MetricsMiddleware)
+
+
+# Вспомогательные функции
+def format_scrypt_hash(n: int, r: int, p: int, salt: bytes, digest: bytes) -> str:
+    """'scrypt$N$r$p$соль$хеш', соль и хеш в base64"""
+    return "$".join(("scrypt", str(n), str(r), str(p),
+                     base64.b64encode(salt).decode(), base64.b64encode(digest).decode()))
+
+
+def parse_scrypt_hash(stored: str) -> tuple:
+    """(N, r, p, соль, хеш) из строки format_scrypt_hash"""
+    _, n, r, p, salt, digest = stored.split("$")
+    return int(n), int(r), int(p), base64.b64decode(salt), base64.b64decode(digest)
+
+
+def hash_password(password: str, salt: Optional[bytes] = None, n: int = PASSWORD_SCRYPT_N) -> str:
+    """scrypt с солью прямо в текущем потоке (для сида баз и тестов)"""
+    salt = salt or os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P,
+                            maxmem=256 * n * PASSWORD_SCRYPT_R, dklen=32)
+    return format_scrypt_hash(n, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P, salt, digest)
+
+
+def is_scrypt_hash(stored: str) -> bool:
+    return stored.startswith("scrypt$")
+
+
+def verify_password(password: str, stored: str) -> bool:
+    if not is_scrypt_hash(stored):
+        # Старый формат: SHA-256 без соли, заменяется при следующем входе
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    n, r, p, salt, expected = parse_scrypt_hash(stored)
+    actual = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=len(expected))
+    return hmac.compare_digest(actual, expected)
+
+
+def password_needs_rehash(stored: str) -> bool:
+    """Старый SHA-256 или scrypt с другими параметрами"""
+    return not stored.startswith(f"scrypt${PASSWORD_SCRYPT_N}${PASSWORD_SCRYPT_R}${PASSWORD_SCRYPT_P}$")
+
+
+async def run_kdf(operation: str, password: str, salt: bytes, n: int, r: int, p: int, dklen: int,
+                  admit: bool = True) -> bytes:
+    """scrypt в пуле процессов; очередь переполнена — 503, игры важнее входов"""
+    if admit and not password_hasher.admit():
+        raise HTTPException(status_code=503, detail="Сервер занят, повторите попытку позже",
+                            headers={"Retry-After": "1"})
+    return await password_hasher.scrypt(operation, password, salt, n, r, p, dklen)
+
+
+async def hash_password_async(password: str, admit: bool = True) -> str:
+    """hash_password, но scrypt считается в пуле процессов"""
+    salt = os.urandom(16)
+    digest = await run_kdf("hash_password", password, salt, PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R,
+                           PASSWORD_SCRYPT_P, 32, admit)
+    return format_scrypt_hash(PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P, salt, digest)
+
+
+async def verify_password_async(password: str, stored: str) -> bool:
+    """verify_password для scrypt-хеша с вычислением в пуле процессов"""
+    n, r, p, salt, expected = parse_scrypt_hash(stored)
+    actual = await run_kdf("verify_password", password, salt, n, r, p, len(expected))
+    return hmac.compare_digest(actual, expected)
+
+
+def require_admin(authorization: Optional[str]):
+    """Служебные маршруты: Authorization: Bearer <SHINOBI_ADMIN_TOKEN>"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Служебный доступ выключен: не задан SHINOBI_ADMIN_TOKEN")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Нужен служебный токен", headers={"WWW-Authenticate": "Bearer"})
+
+
+def next_daily_reward_at(last_daily_reward: Optional[int]) -> Optional[int]:
+    """Когда станет доступна следующая ежедневная награда (unix-время).
+
+    None — награду еще ни разу не получали, она доступна сразу.
+    """
+    if not last_daily_reward:
+        return None
+    return last_daily_reward + DAILY_REWARD_INTERVAL
+
+
+def daily_reward_due(last_daily_reward: Optional[int]) -> bool:
+    next_claim_at = next_daily_reward_at(last_daily_reward)
+    return next_claim_at is None or time.time() >= next_claim_at
+
+
+def calculate_rank(ryo: int) -> str:
+    for threshold, rank in RANKS:
+        if ryo >= threshold:
+            return rank
+    return RANKS[-1][1]
+
+
+async def current_user(authorization: Optional[str], username: Optional[str],
+                       token_required: bool = False) -> UserRecord:
+    """Игрок запроса: по токену (Authorization: Bearer) — по первичному ключу, иначе по имени.
+
+    Без токена запрос по имени принимается, пока не включен SHINOBI_SESSION_REQUIRED
+    и маршрут не требует токена сам (token_required: история и поток событий).
+    """
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        user_id = await session_tokens.authenticate(token.strip()) if scheme.lower() == "bearer" else None
+        user = await adb.get_user_by_id(user_id) if user_id is not None else None
+        if not user:
+            raise HTTPException(status_code=401, detail="Сессия недействительна, войдите снова",
+                                headers={"WWW-Authenticate": "Bearer"})
+        if username and username != user.username:
+            raise HTTPException(status_code=403, detail="Токен выдан другому игроку")
+        return user
+
+    if SESSION_REQUIRED or token_required or not username:
+        raise HTTPException(status_code=401, detail="Нужен токен сессии", headers={"WWW-Authenticate": "Bearer"})
+    user = await adb.get_user(username)
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return user
+
+
+async def load_player(username: Optional[str], bet: int, authorization: Optional[str] = None):
+    """Находит игрока и делает быструю предварительную проверку ставки"""
+    if bet <= 0:
+        raise HTTPException(status_code=400, detail="Ставка должна быть больше нуля")
+
+    user = await current_user(authorization, username)
+
+    if user.ryo < bet:
+        raise HTTPException(status_code=400, detail="Недостаточно Рё")
+
+    return user
+
+
+async def settle_game(game_type: str, user, bet: int, result: dict) -> dict:
+    """Проводит ставку в базе и собирает ответ игрового эндпоинта"""
+    settled = await adb.write(db.settle_bet, user.id, game_type, bet, result['win_amount'], result['result'])
+    if settled is None:
+        # Баланс успел измениться параллельной ставкой
+        raise HTTPException(status_code=400, detail="Недостаточно Рё")
+
+    new_balance, new_rank = settled
+    return {
+        "success": True,
+        "game": game_type,
+        "result": result,
+        "user": {
+            "username": user.username,
+            "new_balance": new_balance,
+            "new_rank": new_rank
         }
+    }
 
-    @staticmethod
-    def play_blackjack(bet_amount: int, village: str) -> dict:
-        """Упрощенный блэкджек"""
-        player_score = random.randint(15, 21)
-        dealer_score = random.randint(15, 21)
-
-        if player_score > 21:
-            player_score = random.randint(15, 20)
-
-        if dealer_score > 21:
-            dealer_score = random.randint(15, 20)
-
-        # Определяем победителя
-        if player_score > dealer_score:
-            win_amount = bet_amount * 2
-            result = 'win'
-        elif player_score == dealer_score:
-            win_amount = bet_amount  # Возврат ставки
-            result = 'draw'
+
+def admission_key(authorization: Optional[str], username: Optional[str]) -> tuple:
+    """Чей запрос — до обращения к базе: id из подписи токена, иначе имя из тела"""
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        decoded = session_tokens.decode(token.strip()) if scheme.lower() == "bearer" else None
+        if decoded is not None:
+            return "id", decoded[0]
+    return "name", username
+
+
+def admit(player: tuple):
+    """Лимит частоты на игрока: сверх него — 429 без чтения пользователя и записи"""
+    wait = rate_limiter.acquire(player)
+    if wait:
+        raise HTTPException(status_code=429, detail="Слишком много запросов, повторите попытку позже",
+                            headers={"Retry-After": str(math.ceil(wait))})
+
+
+async def idempotency_call(method: str, *args):
+    """Кэш Idempotency-Key: здесь или у процесса-писателя"""
+    if not adb.remote:
+        return getattr(idempotency, method)(*args)
+    return await adb.remote.call(f"idempotency_{method}", *args)
+
+
+async def run_idempotent(request: Request, idempotency_key: Optional[str], player: tuple, handler):
+    """Выполняет handler() один раз на Idempotency-Key игрока, повтор получает сохраненный ответ.
+
+    Лимит частоты (admit) проверяется только для запросов, которые действительно
+    выполнятся: повтор с сохраненным ответом получает его, а не 429.
+    """
+    if idempotency_key is None:
+        admit(player)
+        return await handler()
+    if not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400,
+                            detail=f"Idempotency-Key — от 1 до {IDEMPOTENCY_KEY_MAX_LENGTH} символов")
+
+    key = f"{player[0]}:{player[1]}:{idempotency_key}"
+    fingerprint = hashlib.sha256(f"{request.method} {request.url.path}\n".encode() + await request.body()).hexdigest()
+    state, stored = await idempotency_call("begin", key, fingerprint)
+    if state == 'replay':
+        return Response(content=stored, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+    if state == 'busy':
+        raise HTTPException(status_code=409, detail="Запрос с этим Idempotency-Key еще выполняется")
+    if state == 'mismatch':
+        raise HTTPException(status_code=422, detail="Idempotency-Key уже использован для другого запроса")
+
+    try:
+        admit(player)
+        body = json.dumps(await handler(), ensure_ascii=False).encode()
+    except Exception:
+        await idempotency_call("abort", key)
+        raise
+    await idempotency_call("finish", key, body)
+    return Response(content=body, media_type="application/json")
+
+
+# История игр
+HISTORY_COLUMNS = ("id", "game_type", "bet_amount", "win_amount", "result", "played_at")
+
+
+def encode_history_cursor(row) -> str:
+    return base64.urlsafe_b64encode(f"{row[5]}|{row[0]}".encode()).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    try:
+        played_at, row_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().rsplit("|", 1)
+        return played_at, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Неверный курсор")
+
+
+def parse_history_time(value: Optional[str], name: str) -> Optional[str]:
+    """ISO-дата или дата-время (UTC) -> формат played_at в базе"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "")).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Неверная дата в параметре {name}")
+
+
+async def iter_history(user_id: int, after: Optional[tuple], descending: bool, filters: dict):
+    """Вся история игрока пачками по ключу: память не растет с объемом выгрузки"""
+    while True:
+        rows = await adb.read(db.get_history, user_id, HISTORY_EXPORT_CHUNK, after,
+                              filters["game_type"], filters["since"], filters["until"], descending)
+        for row in rows:
+            yield row
+        if len(rows) < HISTORY_EXPORT_CHUNK:
+            return
+        after = (rows[-1][5], rows[-1][0])
+
+
+async def history_ndjson(rows):
+    async for row in rows:
+        yield json.dumps(dict(zip(HISTORY_COLUMNS, row)), ensure_ascii=False) + "\n"
+
+
+async def history_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HISTORY_COLUMNS)
+    async for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def stream_events(user_id: int, username: str):
+    """Тело /api/stream: снимок состояния, затем события хаба и пинги"""
+    subscriber = stream_hub.subscribe(user_id)
+    getter = None
+    try:
+        yield b"retry: 3000\n\n"
+        # Подписка раньше снимка: изменение между ними придет еще раз, но не потеряется
+        user = await adb.get_user(username)
+        if user:
+            yield stream_hub.message('balance', {"ryo": user.ryo, "rank": user.rank,
+                                                 "total_earned": user.total_earned})
+        yield stream_hub.message('leaderboard', stream_hub.snapshot())
+        while not subscriber.dropped:
+            if getter is None:
+                getter = asyncio.ensure_future(subscriber.get())
+            done, _ = await asyncio.wait({getter}, timeout=STREAM_PING_SECONDS)
+            if not done:
+                yield b": ping\n\n"
+                continue
+            kind, data = getter.result()
+            getter = None
+            yield stream_hub.message(kind, data)
+    finally:
+        if getter is not None:
+            getter.cancel()
+        stream_hub.unsubscribe(subscriber)
+
+
+# Генератор случайных чисел
+class BufferedRandom:
+    """Криптостойкий источник случайности с буфером.
+
+    Байты берутся у источника блоками по ``buffer_size`` и сразу
+    раскладываются в 32-битные числа, так что os.urandom вызывается раз на
+    тысячу раундов. Число из [0, n) выдается без смещения (отбраковкой
+    хвоста). С seed источник — поток BLAKE2b(ключ = seed, счетчик): для
+    аудита честности раунды воспроизводимы, а без seed непредсказуемы.
+    """
+
+    def __init__(self, seed: Optional[str] = None, buffer_size: int = RNG_BUFFER_BYTES):
+        self._key = hashlib.sha256(seed.encode()).digest() if seed else None
+        self._words = max(buffer_size // 4, 16)
+        self._counter = 0
+        self._iterator = iter(())
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        size = self._words * 4
+        if self._key is None:
+            data = os.urandom(size)
         else:
-            win_amount = 0
-            result = 'lose'
+            blocks = []
+            for _ in range(-(-size // 64)):
+                blocks.append(hashlib.blake2b(self._counter.to_bytes(16, "little"), key=self._key).digest())
+                self._counter += 1
+            data = b"".join(blocks)[:size]
+        self._iterator = iter(struct.unpack(f"<{self._words}I", data))
+
+    def below(self, n: int) -> int:
+        """Равномерное целое из [0, n), n ≤ 2**32"""
+        limit = 0x100000000 - 0x100000000 % n
+        while True:
+            # next() по итератору кортежа атомарен под GIL; блокировка нужна только для пополнения
+            iterator = self._iterator
+            value = next(iterator, None)
+            if value is None:
+                with self._lock:
+                    if self._iterator is iterator:
+                        self._refill()
+                continue
+            if value < limit:
+                return value % n
+
+
+game_rng = BufferedRandom(RNG_SEED or None)
 
-        # Бонус деревни Кири
-        if village == 'kiri' and win_amount > 0:
-            win_amount = int(win_amount * 1.3)
 
-        return {
-            'player_score': player_score,
-            'dealer_score': dealer_score,
-            'win_amount': int(win_amount),
-            'result': result
-        }
+# Система игр
+VILLAGES = ('konoha', 'suna', 'kiri', 'iwa')
+VILLAGE_ELEMENTS = {'konoha': 'fire', 'suna': 'wind', 'kiri': 'water', 'iwa': 'earth'}
+
+
+@dataclass(frozen=True)
+class Outcome:
+    """Исход раунда в таблице выплат.
+
+    steps — цепочка множителей (числитель, знаменатель): выигрыш = ставка,
+    затем x * числитель // знаменатель на каждом шаге. Округление вниз на
+    каждом шаге повторяет прежние int(...) без чисел с плавающей точкой.
+    result None — 'win' при ненулевом выигрыше, иначе 'lose'.
+    """
+    steps: tuple
+    result: Optional[str]
+    fields: dict
+
+    def payout(self, bet: int) -> int:
+        for numerator, denominator in self.steps:
+            bet = bet * numerator // denominator
+        return bet
+
+
+LOSE = ((0, 1),)
+
+
+class Game:
+    """Игра: ``outcomes`` равновероятных исходов и их таблицы выплат по деревням.
+
+    Таблицы строятся один раз при регистрации; раунд — одно число из
+    game_rng и поиск в кортеже. Подкласс задает name, outcomes и outcome().
+    """
+
+    name = ""
+    outcomes = 0
+
+    def __init__(self):
+        self.tables = {village: tuple(self.outcome(index, village) for index in range(self.outcomes))
+                       for village in VILLAGES + (None,)}
+
+    def outcome(self, index: int, village: Optional[str]) -> Outcome:
+        raise NotImplementedError
+
+    def play(self, bet: int, village: str, element: Optional[str] = None, rng: BufferedRandom = None) -> dict:
+        table = self.tables.get(village) or self.tables[None]
+        outcome = table[(rng or game_rng).below(self.outcomes)]
+        win_amount = outcome.payout(bet)
+        return dict(outcome.fields, win_amount=win_amount,
+                    result=outcome.result or ('win' if win_amount > 0 else 'lose'))
+
+
+# Реестр игр: тип игры -> экземпляр Game
+GAMES = {}
+
+
+def register_game(cls):
+    game = cls()
+    GAMES[game.name] = game
+    return cls
+
+
+@register_game
+class Roulette(Game):
+    """Рулетка стихий: 60% выигрыш x1.5, x2 если выпала стихия деревни"""
+    name = 'roulette'
+    elements = ('fire', 'water', 'wind', 'earth', 'lightning')
+    outcomes = 25  # стихия x 5 равных долей, из них 3 — выигрыш
+
+    def outcome(self, index: int, village: Optional[str]) -> Outcome:
+        winning_element = self.elements[index // 5]
+        fields = {'winning_element': winning_element, 'details': f"Выпал: {winning_element}"}
+        if index % 5 >= 3:
+            return Outcome(LOSE, 'lose', fields)
+        bonus = VILLAGE_ELEMENTS.get(village) == winning_element
+        return Outcome(((2, 1),) if bonus else ((3, 2),), 'win', fields)
+
+
+@register_game
+class Slots(Game):
+    """Слоты: три одинаковых x10, два подряд x3, иначе 20% ставки; Суна +30%"""
+    name = 'slots'
+    symbols = ('🍥', '🍃', '🌀', '💧', '🌍', '⚡', '🎯', '💰')
+    outcomes = 512  # 8 символов на трех барабанах
+
+    def outcome(self, index: int, village: Optional[str]) -> Outcome:
+        results = (self.symbols[index // 64], self.symbols[index // 8 % 8], self.symbols[index % 8])
+        if results[0] == results[1] == results[2]:
+            steps = ((10, 1),)
+        elif results[0] == results[1] or results[1] == results[2]:
+            steps = ((3, 1),)
+        else:
+            steps = ((1, 5),)
+        if village == 'suna':
+            steps += ((13, 10),)
+        return Outcome(steps, None, {'results': results})
+
+
+@register_game
+class Dice(Game):
+    """Две кости: 7 — x2, 6 и 8 — x1.5, 2 и 12 — x5; Ива +50%"""
+    name = 'dice'
+    faces = ('⚀', '⚁', '⚂', '⚃', '⚄', '⚅')
+    outcomes = 36
+    multipliers = {7: (2, 1), 6: (3, 2), 8: (3, 2), 2: (5, 1), 12: (5, 1)}
+
+    def outcome(self, index: int, village: Optional[str]) -> Outcome:
+        dice1, dice2 = index // 6 + 1, index % 6 + 1
+        total = dice1 + dice2
+        fields = {'dice1': self.faces[dice1 - 1], 'dice2': self.faces[dice2 - 1], 'total': total}
+        if total not in self.multipliers:
+            return Outcome(LOSE, 'lose', fields)
+        numerator, denominator = self.multipliers[total]
+        if village == 'iwa':
+            numerator, denominator = numerator * 3, denominator * 2
+        return Outcome(((numerator, denominator),), 'win', fields)
+
+
+@register_game
+class Blackjack(Game):
+    """Упрощенный блэкджек: очки 15..21 у игрока и дилера; Кири +30% к выплате"""
+    name = 'blackjack'
+    outcomes = 49
+
+    def outcome(self, index: int, village: Optional[str]) -> Outcome:
+        player_score, dealer_score = 15 + index // 7, 15 + index % 7
+        fields = {'player_score': player_score, 'dealer_score': dealer_score}
+        if player_score < dealer_score:
+            return Outcome(LOSE, 'lose', fields)
+        numerator, result = (2, 'win') if player_score > dealer_score else (1, 'draw')
+        return Outcome(((numerator * 13, 10) if village == 'kiri' else (numerator, 1),), result, fields)
+
+
+class GameSystem:
+    """Прежний интерфейс игр поверх реестра GAMES"""
+
+    @staticmethod
+    def play_roulette(bet_element: str, bet_amount: int, village: str) -> dict:
+        return GAMES['roulette'].play(bet_amount, village, bet_element)
+
+    @staticmethod
+    def play_slots(bet_amount: int, village: str) -> dict:
+        return GAMES['slots'].play(bet_amount, village)
+
+    @staticmethod
+    def play_dice(bet_amount: int, village: str) -> dict:
+        return GAMES['dice'].play(bet_amount, village)
+
+    @staticmethod
+    def play_blackjack(bet_amount: int, village: str) -> dict:
+        return GAMES['blackjack'].play(bet_amount, village)
 
 
 # Инициализация системы игр
@@ -414,284 +5114,717 @@ def home():
 
 
 @app.post("/api/register")
-def register(user: UserCreate):
-    user_id = db.create_user(user.username, hash_password(user.password), user.village)
+async def register(user: UserCreate):
+    password_hash = await hash_password_async(user.password)
+    user_id = await adb.write(db.create_user, user.username, password_hash, user.village)
 
     if not user_id:
         raise HTTPException(status_code=400, detail="Пользователь уже существует")
 
     return {
         "success": True,
-        "message": "Регистрация успешна! Получено 1000 Рё",
+        "message": f"Регистрация успешна! Получено {SIGNUP_RYO} Рё",
         "user": {
             "username": user.username,
             "village": user.village,
-            "ryo": 1000,
+            "ryo": SIGNUP_RYO,
             "rank": "genin"
         }
     }
 
 
 @app.post("/api/login")
-def login(username: str, password: str):
-    user = db.get_user(username)
+async def login(credentials: Optional[LoginRequest] = None, username: Optional[str] = None,
+                password: Optional[str] = None):
+    """Вход: логин и пароль в теле JSON (в строке запроса — по-старому) и токен сессии в ответ"""
+    if credentials is not None:
+        username, password = credentials.username, credentials.password
+    if not username or password is None:
+        raise HTTPException(status_code=400, detail="Укажите имя и пароль")
+
+    user = await adb.get_user(username)
 
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    if user[2] != hash_password(password):
+    stored = user.password_hash
+    if is_scrypt_hash(stored):
+        valid = await verify_password_async(password, stored)
+    else:
+        valid = verify_password(password, stored)  # старый SHA-256 дешев, пул не нужен
+    if not valid:
         raise HTTPException(status_code=401, detail="Неверный пароль")
 
+    # Перехеширование при входе: пароль в открытом виде есть только сейчас.
+    # Очередь занята — не страшно, обновим при следующем входе
+    if password_needs_rehash(stored) and password_hasher.pending < password_hasher.max_pending:
+        new_hash = await hash_password_async(password, admit=False)
+        if await adb.write(db.update_password_hash, user.id, stored, new_hash) and adb.remote:
+            db.users.invalidate(user.id)
+
+    token, expires_at = session_tokens.issue(user.id)
     return {
         "success": True,
+        "token": token,
+        "token_type": "bearer",
+        "expires_at": expires_at,
         "user": {
-            "id": user[0],
-            "username": user[1],
-            "village": user[3],
-            "ryo": user[4],
-            "rank": user[5],
-            "total_earned": user[7]
+            "id": user.id,
+            "username": user.username,
+            "village": user.village,
+            "ryo": user.ryo,
+            "rank": user.rank,
+            "total_earned": user.total_earned
         }
     }
 
 
+@app.post("/api/logout")
+async def logout(authorization: Optional[str] = Header(None)):
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not await session_tokens.revoke(token.strip()):
+        raise HTTPException(status_code=401, detail="Сессия недействительна", headers={"WWW-Authenticate": "Bearer"})
+    return {"success": True}
+
+
 @app.get("/api/daily-reward/{username}")
-def check_daily_reward(username: str):
-    user = db.get_user(username)
+async def check_daily_reward(username: str):
+    # Срок следующей награды есть в записи кэша пользователей — база не нужна
+    user = await adb.get_user(username)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    can_claim = db.check_daily_reward(user[0])
     return {
         "success": True,
-        "can_claim": can_claim,
-        "reward_amount": 500  # Ежедневная награда 500 Рё
+        "can_claim": daily_reward_due(user.last_daily_reward),
+        "next_claim_at": next_daily_reward_at(user.last_daily_reward),
+        "reward_amount": DAILY_REWARD_AMOUNT
     }
 
 
 @app.post("/api/claim-daily-reward")
-def claim_daily_reward(reward: DailyReward):
-    user = db.get_user(reward.username)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
+async def claim_daily_reward(reward: DailyReward, request: Request, authorization: Optional[str] = Header(None),
+                             idempotency_key: Optional[str] = Header(None)):
+    player = admission_key(authorization, reward.username)
 
-    can_claim = db.check_daily_reward(user[0])
-    if not can_claim:
-        raise HTTPException(status_code=400, detail="Награду можно получать раз в 24 часа")
+    async def claim():
+        user = await current_user(authorization, reward.username)
 
-    reward_amount = 500
-    db.give_daily_reward(user[0], reward_amount)
+        # Быстрый отказ по кэшу; окончательная проверка — в условии UPDATE
+        if not daily_reward_due(user.last_daily_reward):
+            raise HTTPException(status_code=400, detail="Награду можно получать раз в 24 часа")
 
-    # Обновляем баланс пользователя
-    db.update_balance(user[0], reward_amount)
+        claimed = await adb.write(db.claim_daily_reward, user.id, DAILY_REWARD_AMOUNT)
+        if claimed is None:
+            raise HTTPException(status_code=400, detail="Награду можно получать раз в 24 часа")
 
-    return {
-        "success": True,
-        "message": f"Получена ежедневная награда: {reward_amount} Рё!",
-        "new_balance": user[4] + reward_amount
-    }
+        new_balance, new_rank = claimed
+        return {
+            "success": True,
+            "message": f"Получена ежедневная награда: {DAILY_REWARD_AMOUNT} Рё!",
+            "new_balance": new_balance,
+            "new_rank": new_rank
+        }
 
+    return await run_idempotent(request, idempotency_key, player, claim)
 
-@app.post("/api/game/roulette")
-def play_roulette(game: GameRequest):
-    user = db.get_user(game.username)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    if user[4] < game.bet:
-        raise HTTPException(status_code=400, detail="Недостаточно Рё")
+@app.post("/api/game/{game_type}")
+async def play_game(game_type: str, game: GameRequest, request: Request, authorization: Optional[str] = Header(None),
+                    idempotency_key: Optional[str] = Header(None)):
+    engine = GAMES.get(game_type)
+    if engine is None:
+        raise HTTPException(status_code=404, detail="Неизвестная игра")
 
-    # Играем
-    result = game_system.play_roulette(game.element or "fire", game.bet, user[3])
+    player = admission_key(authorization, game.username)
 
-    # Обновляем баланс
-    new_balance = user[4] - game.bet + result['win_amount']
-    db.update_balance(user[0], result['win_amount'] - game.bet)
+    async def play():
+        user = await load_player(game.username, game.bet, authorization)
 
-    # Обновляем ранг
-    new_rank = calculate_rank(new_balance)
-    if new_rank != user[5]:
-        # Обновляем в базе
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET rank = ? WHERE id = ?', (new_rank, user[0]))
-        conn.commit()
-        conn.close()
+        # Играем
+        result = engine.play(game.bet, user.village, game.element)
+
+        # Списываем ставку, начисляем выигрыш, обновляем ранг и историю
+        return await settle_game(game_type, user, game.bet, result)
+
+    return await run_idempotent(request, idempotency_key, player, play)
+
+
+@app.post("/api/game/{game_type}/batch")
+async def play_batch(game_type: str, batch: BatchGameRequest, request: Request,
+                     authorization: Optional[str] = Header(None), idempotency_key: Optional[str] = Header(None)):
+    """Серия раундов одной игры за один запрос и одну транзакцию"""
+    engine = GAMES.get(game_type)
+    if engine is None:
+        raise HTTPException(status_code=404, detail="Неизвестная игра")
+
+    # Число раундов и длину списка уже ограничила модель запроса
+    if batch.bets is None and batch.bet is None:
+        raise HTTPException(status_code=400, detail="Укажите ставку (bet) или список ставок (bets)")
+    bets = batch.bets if batch.bets is not None else [batch.bet] * batch.rounds
+    if any(bet <= 0 for bet in bets):
+        raise HTTPException(status_code=400, detail="Ставка должна быть больше нуля")
+
+    player = admission_key(authorization, batch.username)
+
+    async def play():
+        user = await load_player(batch.username, bets[0], authorization)
+        results = [engine.play(bet, user.village, batch.element) for bet in bets]
+        settled = await adb.write(db.settle_batch, user.id, game_type, bets, results)
+        if settled is None:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+        rounds, new_balance, new_rank = settled
+        if not rounds:
+            raise HTTPException(status_code=400, detail="Недостаточно Рё")
+
+        return {
+            "success": True,
+            "game": game_type,
+            "rounds_requested": len(bets),
+            "rounds_played": len(rounds),
+            "stopped_early": len(rounds) < len(bets),
+            "total_bet": sum(r["bet"] for r in rounds),
+            "total_win": sum(r["win_amount"] for r in rounds),
+            "results": rounds,
+            "user": {
+                "username": user.username,
+                "new_balance": new_balance,
+                "new_rank": new_rank
+            }
+        }
 
-    # Записываем игру
-    db.add_game_record(user[0], "roulette", game.bet, result['win_amount'], result['result'])
+    return await run_idempotent(request, idempotency_key, player, play)
+
+
+@app.get("/api/missions/{username}")
+async def get_missions(username: str, authorization: Optional[str] = Header(None)):
+    user = await current_user(authorization, username)
+
+    rows = await adb.read(db.get_missions, user.id)
+    # Между контрольными точками прогресс в базе отстает — берем его из памяти
+    if missions:
+        progress = missions.progress(user.id)
+    else:
+        progress = await adb.remote.call("mission_progress", user.id)
+
+    mission_list = []
+    for mission in rows:
+        spec = MISSION_SPECS.get(mission[2])
+        mission_list.append({
+            "id": mission[0],
+            "type": mission[2],
+            "trigger": spec.trigger if spec else None,
+            "progress": progress.get(mission[0], mission[3]),
+            "target": spec.target if spec else None,
+            "completed": bool(mission[4]),
+            "reward": mission[5]
+        })
 
     return {
         "success": True,
-        "game": "roulette",
-        "result": result,
-        "user": {
-            "username": user[1],
-            "new_balance": new_balance,
-            "new_rank": new_rank
-        }
+        "missions": mission_list
     }
 
 
-@app.post("/api/game/slots")
-def play_slots(game: GameRequest):
-    user = db.get_user(game.username)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
+def check_village(village: Optional[str]) -> Optional[str]:
+    """Деревня из запроса: None (общий рейтинг) или одна из VILLAGES"""
+    if village is not None and village not in VILLAGES:
+        raise HTTPException(status_code=400, detail="Неизвестная деревня")
+    return village
 
-    if user[4] < game.bet:
-        raise HTTPException(status_code=400, detail="Недостаточно Рё")
 
-    result = game_system.play_slots(game.bet, user[3])
+@app.get("/api/leaderboard")
+async def get_leaderboard(limit: int = Query(10, ge=1, le=LEADERBOARD_MAX_LIMIT), village: Optional[str] = None):
+    village = check_village(village)
+    return Response(content=leaderboard.top_response(limit, village), media_type="application/json")
+
 
-    new_balance = user[4] - game.bet + result['win_amount']
-    db.update_balance(user[0], result['win_amount'] - game.bet)
-    db.add_game_record(user[0], "slots", game.bet, result['win_amount'], result['result'])
+@app.get("/api/leaderboard/rank/{username}")
+async def get_leaderboard_rank(username: str, village: Optional[str] = None):
+    village = check_village(village)
+    user = await adb.get_user(username)
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    position = leaderboard.position(user.id, village)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Игрок не участвует в этом рейтинге")
 
     return {
         "success": True,
-        "game": "slots",
-        "result": result,
-        "user": {
-            "username": user[1],
-            "new_balance": new_balance,
-            "new_rank": calculate_rank(new_balance)
-        }
+        "username": user.username,
+        "village": village,
+        "position": position[0],
+        "total_players": position[1]
     }
 
 
-@app.post("/api/game/dice")
-def play_dice(game: GameRequest):
-    user = db.get_user(game.username)
+@app.get("/api/leaderboard/around/{username}")
+async def get_leaderboard_around(username: str, window: int = Query(5, ge=1, le=50), village: Optional[str] = None):
+    village = check_village(village)
+    user = await adb.get_user(username)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    if user[4] < game.bet:
-        raise HTTPException(status_code=400, detail="Недостаточно Рё")
-
-    result = game_system.play_dice(game.bet, user[3])
+    return {
+        "success": True,
+        "username": user.username,
+        "village": village,
+        "leaderboard": leaderboard.around(user.id, window, village)
+    }
 
-    new_balance = user[4] - game.bet + result['win_amount']
-    db.update_balance(user[0], result['win_amount'] - game.bet)
-    db.add_game_record(user[0], "dice", game.bet, result['win_amount'], result['result'])
 
+# Турниры
+async def tournament_call(method: str, *args):
+    """Чтение из движка турниров: здесь или у процесса-писателя"""
+    if tournaments:
+        return getattr(tournaments, method)(*args)
+    return await adb.remote.call(f"tournament_{method}", *args)
+
+
+async def load_tournament(tournament_id: int) -> dict:
+    row = await adb.read(db.get_tournament, tournament_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Турнир не найден")
+    return tournament_info(row)
+
+
+def tournament_info(row: tuple) -> dict:
+    info = dict(zip(TOURNAMENT_COLUMNS, row))
+    info["games"] = [game for game in info["games"].split(",") if game]
+    info["prizes"] = json.loads(info["prizes"])
+    for key in ("starts_at", "ends_at", "closed_at"):
+        if info[key] is not None:
+            info[key] = datetime.utcfromtimestamp(info[key]).strftime("%Y-%m-%d %H:%M:%S")
+    return info
+
+
+FINAL_STANDING_COLUMNS = ("place", "username", "score", "rounds", "prize")
+
+
+@app.post("/api/admin/tournaments")
+async def create_tournament(request: TournamentCreate, authorization: Optional[str] = Header(None)):
+    require_admin(authorization)
+    unknown = [game for game in request.games if game not in GAMES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные игры: {', '.join(unknown)}")
+    if (not 0 < len(request.prizes) <= TOURNAMENT_MAX_PRIZES
+            or any(not 0 <= prize <= TOURNAMENT_MAX_PRIZE for prize in request.prizes)):
+        raise HTTPException(status_code=400,
+                            detail=f"Призы: от 1 до {TOURNAMENT_MAX_PRIZES} сумм по местам, "
+                                   f"каждая от 0 до {TOURNAMENT_MAX_PRIZE}")
+
+    starts_at = parse_history_time(request.starts_at, "starts_at")
+    starts_at = (int(datetime.strptime(starts_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp())
+                 if starts_at else int(time.time()))
+    ends_at = starts_at + int(request.days * 86400)
+    tournament_id = await adb.write(db.create_tournament, request.name, request.scoring,
+                                    sorted(set(request.games)), request.prizes,
+                                    starts_at, ends_at)
+    return {"success": True, "tournament": tournament_info(await adb.read(db.get_tournament, tournament_id))}
+
+
+@app.get("/api/tournaments")
+async def get_tournaments(status: Optional[Literal["active", "closed"]] = None,
+                          limit: int = Query(50, ge=1, le=500)):
+    rows = await adb.read(db.get_tournaments, status, limit)
+    return {"success": True, "tournaments": [tournament_info(row) for row in rows]}
+
+
+@app.get("/api/tournaments/{tournament_id}/standings")
+async def get_tournament_standings(tournament_id: int, limit: int = Query(10, ge=1, le=LEADERBOARD_MAX_LIMIT)):
+    """Таблица активного турнира — из памяти движка, закрытого — итоговая из базы"""
+    live = await tournament_call("top", tournament_id, limit)
+    info = await load_tournament(tournament_id)
+    if live is not None:
+        return dict(live, success=True, tournament=info)
+    if info["status"] != "closed":
+        raise HTTPException(status_code=503, detail="Таблица турнира еще не загружена")
+
+    rows = await adb.read(db.get_final_standings, tournament_id, 1, limit)
     return {
         "success": True,
-        "game": "dice",
-        "result": result,
-        "user": {
-            "username": user[1],
-            "new_balance": new_balance,
-            "new_rank": calculate_rank(new_balance)
-        }
+        "tournament": info,
+        "participants": await adb.read(db.count_final_places, tournament_id),
+        "standings": [dict(zip(FINAL_STANDING_COLUMNS, row)) for row in rows]
     }
 
 
-@app.post("/api/game/blackjack")
-def play_blackjack(game: GameRequest):
-    user = db.get_user(game.username)
+@app.get("/api/tournaments/{tournament_id}/standings/{username}")
+async def get_tournament_position(tournament_id: int, username: str, window: int = Query(5, ge=1, le=50)):
+    """Место игрока в турнире и соседи по таблице"""
+    user = await adb.get_user(username)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    if user[4] < game.bet:
-        raise HTTPException(status_code=400, detail="Недостаточно Рё")
+    live = await tournament_call("position", tournament_id, user.id, window)
+    info = await load_tournament(tournament_id)
+    if live is not None:
+        return dict(live, success=True, tournament=info, username=user.username)
+    if info["status"] != "closed":
+        raise HTTPException(status_code=503, detail="Таблица турнира еще не загружена")
+
+    final = await adb.read(db.get_final_place, tournament_id, user.id)
+    if final is None:
+        return {"success": True, "tournament": info, "username": user.username,
+                "participants": await adb.read(db.count_final_places, tournament_id),
+                "place": None, "standings": []}
+    place, participants = final
+    rows = await adb.read(db.get_final_standings, tournament_id, max(1, place - window), 2 * window + 1)
+    return {
+        "success": True,
+        "tournament": info,
+        "username": user.username,
+        "participants": participants,
+        "place": place,
+        "standings": [dict(zip(FINAL_STANDING_COLUMNS, row)) for row in rows]
+    }
 
-    result = game_system.play_blackjack(game.bet, user[3])
 
-    new_balance = user[4] - game.bet + result['win_amount']
-    db.update_balance(user[0], result['win_amount'] - game.bet)
-    db.add_game_record(user[0], "blackjack", game.bet, result['win_amount'], result['result'])
+@app.get("/api/stream/{username}")
+async def stream_updates(username: str, token: Optional[str] = None, authorization: Optional[str] = Header(None)):
+    """Server-Sent Events: баланс, ранг, выполненные миссии и изменения топа.
+
+    Только свой поток. EventSource в браузере не умеет ставить заголовки,
+    поэтому токен можно передать и параметром ?token=.
+    """
+    if not authorization and token:
+        authorization = f"Bearer {token}"
+    user = await current_user(authorization, username, token_required=True)
+
+    return StreamingResponse(stream_events(user.id, username), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/stats/{username}")
+async def get_stats(username: str, authorization: Optional[str] = Header(None)):
+    user = await current_user(authorization, username)
+
+    stats = await adb.read(db.get_stats, user.id) or (0, 0, 0, 0, None)
+    total_games, total_bet, total_win, biggest_win, last_played_at = stats
+
+    by_game = {}
+    for game_type, games_played, game_bet, game_win, game_biggest in await adb.read(db.get_game_stats, user.id):
+        by_game[game_type] = {
+            "games": games_played,
+            "total_bet": game_bet,
+            "total_win": game_win,
+            "biggest_win": game_biggest,
+            "profit": game_win - game_bet
+        }
 
     return {
         "success": True,
-        "game": "blackjack",
-        "result": result,
-        "user": {
-            "username": user[1],
-            "new_balance": new_balance,
-            "new_rank": calculate_rank(new_balance)
+        "stats": {
+            "total_games": total_games,
+            "total_bet": total_bet,
+            "total_win": total_win,
+            "total_earned": user.total_earned or 0,
+            "profit": total_win - total_bet,
+            "biggest_win": biggest_win,
+            "last_played_at": last_played_at,
+            "by_game": by_game
         }
     }
 
 
-@app.get("/api/missions/{username}")
-def get_missions(username: str):
-    user = db.get_user(username)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
+@app.get("/api/history/{username}")
+async def get_history(username: str,
+                      limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX),
+                      cursor: Optional[str] = None,
+                      game_type: Optional[str] = None,
+                      since: Optional[str] = None,
+                      until: Optional[str] = None,
+                      order: Literal["asc", "desc"] = "desc",
+                      format: Literal["json", "ndjson", "csv"] = "json",
+                      authorization: Optional[str] = Header(None)):
+    """История ставок — только своя, по токену сессии"""
+    user = await current_user(authorization, username, token_required=True)
+
+    after = decode_history_cursor(cursor) if cursor else None
+    descending = order == "desc"
+    filters = {
+        "game_type": game_type,
+        "since": parse_history_time(since, "since"),
+        "until": parse_history_time(until, "until")
+    }
 
-    missions = db.get_missions(user[0])
+    # Выгрузка: вся история по фильтрам потоком, limit не применяется
+    if format == "ndjson":
+        return StreamingResponse(history_ndjson(iter_history(user.id, after, descending, filters)),
+                                 media_type="application/x-ndjson")
+    if format == "csv":
+        return StreamingResponse(history_csv(iter_history(user.id, after, descending, filters)),
+                                 media_type="text/csv; charset=utf-8",
+                                 headers={"Content-Disposition": f'attachment; filename="history_{user.id}.csv"'})
+
+    rows = await adb.read(db.get_history, user.id, limit + 1, after,
+                          filters["game_type"], filters["since"], filters["until"], descending)
+    page = rows[:limit]
+    return {
+        "success": True,
+        "history": [dict(zip(HISTORY_COLUMNS, row)) for row in page],
+        "next_cursor": encode_history_cursor(page[-1]) if len(rows) > limit else None
+    }
 
-    mission_list = []
-    for mission in missions:
-        mission_list.append({
-            "id": mission[0],
-            "type": mission[2],
-            "progress": mission[3],
-            "completed": bool(mission[4]),
-            "reward": mission[5]
-        })
 
+@app.get("/api/admin/db-stats")
+async def get_db_stats(authorization: Optional[str] = Header(None)):
+    require_admin(authorization)
     return {
         "success": True,
-        "missions": mission_list
+        "pool": db.pool.stats(),
+        "user_cache": db.users.stats(),
+        "history_writer": db.history_writer.stats() if db.history_writer else None,
+        "archive": db.archive.stats(),
+        "ledger": db.ledger_stats(),
+        "analytics": db.analytics.stats(),
+        "missions": missions.stats() if missions else None,
+        "tournaments": tournaments.stats() if tournaments else None,
+        "rate_limiter": rate_limiter.stats(),
+        "idempotency": idempotency.stats() if not adb.remote else None,
+        "leaderboard": leaderboard.stats(),
+        "stream": stream_hub.stats(),
+        "kdf": password_hasher.stats(),
+        "sessions": session_tokens.stats(),
+        "async": adb.stats(),
+        "writer": await adb.remote.call("stats") if adb.remote else None,
+        "writer_client": adb.remote.stats() if adb.remote else None
     }
 
 
-@app.get("/api/leaderboard")
-def get_leaderboard(limit: int = 10):
-    leaderboard = db.get_leaderboard(limit)
-
-    result = []
-    for i, player in enumerate(leaderboard, 1):
-        result.append({
-            "rank": i,
-            "username": player[0],
-            "village": player[1],
-            "ryo": player[2],
-            "rank_title": player[3],
-            "total_earned": player[4]
-        })
+def analytics_since(since: Optional[str], resolution: str, default: str) -> str:
+    """Начало выборки, выровненное на начало своего интервала"""
+    return AnalyticsRollup.bucket(parse_history_time(since, "since") or default, resolution)
+
+
+@app.get("/api/admin/analytics")
+async def get_analytics(resolution: Literal["minute", "hour", "day"] = "hour",
+                        since: Optional[str] = None,
+                        until: Optional[str] = None,
+                        game_type: Optional[str] = None,
+                        village: Optional[str] = None,
+                        limit: int = Query(1000, ge=1, le=ANALYTICS_MAX_ROWS),
+                        authorization: Optional[str] = Header(None)):
+    """Сводки по интервалам, играм и деревням; читаются только таблицы сводок"""
+    require_admin(authorization)
+    default = (datetime.utcnow() - ANALYTICS_BUCKETS[resolution][3]).strftime("%Y-%m-%d %H:%M:%S")
+    since = analytics_since(since, resolution, default)
+    until = parse_history_time(until, "until")
+    rows = await adb.read(db.analytics.series, resolution, since, until, game_type, village, limit)
+    items = []
+    for row in rows:
+        item = dict(zip(ANALYTICS_COLUMNS, row))
+        item["house_take"] = item["wagered"] - item["paid"]
+        items.append(item)
+    return {
+        "success": True,
+        "resolution": resolution,
+        "since": since,
+        "until": until,
+        "pending_rows": await adb.read(db.analytics.pending),
+        "rows": items
+    }
+
 
+@app.get("/api/admin/analytics/summary")
+async def get_analytics_summary(by: Literal["game", "village"] = "village",
+                                resolution: Literal["minute", "hour", "day"] = "hour",
+                                since: Optional[str] = None,
+                                until: Optional[str] = None,
+                                authorization: Optional[str] = Header(None)):
+    """Итоги периода по играм или деревням (по умолчанию — с начала суток UTC), по доходу казино"""
+    require_admin(authorization)
+    since = analytics_since(since, resolution, datetime.utcnow().strftime("%Y-%m-%d 00:00:00"))
+    until = parse_history_time(until, "until")
+    rows = await adb.read(db.analytics.summary, resolution, "game_type" if by == "game" else "village",
+                          since, until)
     return {
         "success": True,
-        "leaderboard": result
+        "by": by,
+        "resolution": resolution,
+        "since": since,
+        "until": until,
+        "rows": [{
+            by: key,
+            "bets": bets,
+            "wagered": wagered,
+            "paid": paid,
+            "house_take": wagered - paid,
+            "rtp": round(paid / wagered, 4) if wagered else None,
+            "biggest_win": biggest_win
+        } for key, bets, wagered, paid, biggest_win in rows]
     }
 
 
-@app.get("/api/stats/{username}")
-def get_stats(username: str):
-    user = db.get_user(username)
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(authorization: Optional[str] = Header(None)):
+    require_admin(authorization)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*), SUM(bet_amount), SUM(win_amount) FROM game_history WHERE user_id = ?', (user[0],))
-    stats = cursor.fetchone()
-    conn.close()
 
+@app.get("/api/admin/slow-requests")
+def get_slow_requests(authorization: Optional[str] = Header(None)):
+    require_admin(authorization)
     return {
         "success": True,
-        "stats": {
-            "total_games": stats[0] or 0,
-            "total_bet": stats[1] or 0,
-            "total_win": stats[2] or 0,
-            "total_earned": user[7] or 0,
-            "profit": (stats[2] or 0) - (stats[1] or 0)
-        }
+        "sample_rate": profiler.sample_rate,
+        "slow_ms": profiler.slow_ms,
+        "profiles": list(profiler.profiles)
     }
 
+
 # Запуск сервера
-if __name__ == "__main__":
+def run_server(host: str = "127.0.0.1", port: int = 8000):
     print("=" * 50)
     print("🎌  Shinobi Casino 2.0 запускается...")
     print("✨  Новые функции:")
     print("   ✅ Система ежедневных наград")
     print("   ✅ Миссии и достижения")
     print("   ✅ Возможность заработка Рё")
-    print("🌐  Документация API: http://localhost:8000/docs")
+    print(f"🌐  Документация API: http://{host}:{port}/docs")
     print("🎮  Фронтенд: frontend/index.html")
     print("=" * 50)
 
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("main:app", host=host, port=port, reload=True, timeout_graceful_shutdown=STREAM_SHUTDOWN_SECONDS)
+
+
+def run_cluster(host: str, port: int, workers: int, socket_path: str) -> int:
+    """Боевой режим: N воркеров uvicorn (чтения и игры) и один процесс-писатель.
+
+    Писатель запускается первым в своей группе процессов — Ctrl+C получают
+    только воркеры, а писатель останавливается последним, дописав очередь.
+    """
+    db.close()  # надзирающий процесс с базой не работает
+    script = os.path.abspath(__file__)
+    writer = subprocess.Popen([sys.executable, script, "writer", "--socket", socket_path],
+                              env=dict(os.environ, SHINOBI_DB_MODE="async"), start_new_session=True)
+    server = None
+    try:
+        deadline = time.monotonic() + 60
+        while not writer_alive(socket_path):
+            if writer.poll() is not None or time.monotonic() > deadline:
+                print("❌ Процесс-писатель не запустился")
+                return 1
+            time.sleep(0.1)
+
+        print(f"🚀  {workers} воркеров на http://{host}:{port}, процесс-писатель: {socket_path}")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", host, "--port", str(port),
+             "--workers", str(workers), "--app-dir", os.path.dirname(script),
+             "--timeout-graceful-shutdown", str(STREAM_SHUTDOWN_SECONDS)],
+            env=dict(os.environ, SHINOBI_DB_MODE="remote", SHINOBI_WRITER_SOCKET=socket_path),
+        )
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.terminate())
+        try:
+            return server.wait()
+        except KeyboardInterrupt:
+            return server.wait()  # uvicorn тоже получил SIGINT и останавливает воркеры
+    finally:
+        if server is not None and server.poll() is None:
+            server.terminate()
+            server.wait()
+        writer.terminate()
+        writer.wait()
+
+
+def cli_writer(args):
+    if adb.mode != "async":
+        print("❌ Процесс-писатель работает только в режиме SHINOBI_DB_MODE=async")
+        return 1
+    asyncio.run(WriterService(adb, args.socket, missions, tournaments, idempotency).serve())
+
+
+def cli_rebuild_stats(args):
+    started = time.perf_counter()
+    players = db.rebuild_user_stats()
+    print(f"✅ Статистика пересчитана: {players} игроков за {time.perf_counter() - started:.2f} с")
+
+
+def cli_rebuild_analytics(args):
+    started = time.perf_counter()
+    rows = db.analytics.rebuild()
+    print(f"✅ Сводки аналитики пересчитаны: {rows} строк истории за {time.perf_counter() - started:.2f} с")
+
+
+def cli_archive(args):
+    cutoff = (datetime.utcnow() - timedelta(days=args.days)).strftime("%Y-%m-%d %H:%M:%S")
+    started = time.perf_counter()
+    moved = db.archive.run(cutoff)
+    print(f"✅ В архив перенесено строк истории: {moved} за {time.perf_counter() - started:.2f} с "
+          f"(старше {cutoff}, архив: {db.archive.directory})")
+
+
+def cli_check_stats(args):
+    mismatches = db.check_user_stats()
+    if not mismatches:
+        print("✅ Статистика совпадает с историей игр")
+        return 0
+
+    print(f"❌ Найдено расхождений: {len(mismatches)}")
+    for mismatch in mismatches[:args.limit]:
+        print(f"   игрок {mismatch['user_id']} {mismatch['game_type'] or 'все игры'}: "
+              f"история {mismatch['history']} / статистика {mismatch['stats']}")
+    return 1
+
+
+def cli_verify_ledger(args):
+    started = time.perf_counter()
+    report = db.verify_ledger(args.limit)
+    elapsed = time.perf_counter() - started
+    problems = {"mismatches": "балансов не сходится с журналом", "overdrafts": "ставок увели баланс в минус",
+                "gaps": "пропусков в номерах проводок", "orphans": "игроков из журнала нет в users"}
+    summary = f"{report['entries']} проводок, {report['users']} игроков за {elapsed:.2f} с"
+    if not any(report[kind] for kind in problems):
+        print(f"✅ Журнал Рё сходится с балансами: {summary}")
+        return 0
+
+    print(f"❌ Журнал Рё не сходится ({summary}):")
+    for kind, text in problems.items():
+        if report[kind]:
+            print(f"   {text}: {report[kind]}")
+    for example in report["examples"]:
+        print("   " + ", ".join(f"{key}={value}" for key, value in example.items()))
+    return 1
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shinobi Casino: сервер и служебные команды")
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser("serve", help="запустить сервер (по умолчанию — один процесс разработки)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--workers", type=int, default=1,
+                       help="процессов uvicorn; больше 1 — вместе с процессом-писателем")
+    serve.add_argument("--socket", default=WRITER_SOCKET, help="Unix-сокет процесса-писателя")
+    writer = commands.add_parser("writer", help="процесс-писатель для воркеров в режиме remote")
+    writer.add_argument("--socket", default=WRITER_SOCKET, help="Unix-сокет для воркеров")
+    commands.add_parser("rebuild-stats", help="пересчитать агрегаты статистики по истории игр")
+    commands.add_parser("rebuild-analytics", help="пересчитать сводки аналитики по истории игр и архиву")
+    check = commands.add_parser("check-stats", help="сверить агрегаты статистики с историей игр")
+    check.add_argument("--limit", type=int, default=20, help="сколько расхождений показать")
+    verify = commands.add_parser("verify-ledger", help="пересчитать балансы по журналу Рё и сверить с users")
+    verify.add_argument("--limit", type=int, default=20, help="сколько примеров расхождений показать")
+    archive = commands.add_parser("archive", help="перенести старую историю игр в помесячные архивы")
+    archive.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="переносить строки старше N дней")
+
+    args = parser.parse_args()
+    handlers = {
+        "rebuild-stats": cli_rebuild_stats,
+        "rebuild-analytics": cli_rebuild_analytics,
+        "check-stats": cli_check_stats,
+        "verify-ledger": cli_verify_ledger,
+        "archive": cli_archive,
+        "writer": cli_writer,
+    }
+    if args.command in handlers:
+        code = handlers[args.command](args)
+        db.close()
+        sys.exit(code or 0)
+
+    if args.command == "serve" and args.workers > 1:
+        sys.exit(run_cluster(args.host, args.port, args.workers, args.socket))
+    run_server(getattr(args, "host", "127.0.0.1"), getattr(args, "port", 8000))
@@ -0,0 +1,158 @@
+"""Монте-Карло симулятор RTP (возврата игроку) для игр из реестра main.GAMES.
+
+Раунд игры — один равновероятный исход из ее таблицы выплат, поэтому
+симуляция сводится к выборке индексов NumPy и поиску в массиве выплат
+(таблица деревни, пересчитанная для ставки). Для каждой пары игра × деревня
+симулятор выдает RTP, дисперсию выплаты, частоту выигрыша и доверительный
+интервал, а рядом — точный RTP, посчитанный по таблице. Раунды режутся на
+куски и раздаются процессам.
+
+Нужен numpy:
+    pip install numpy
+    python rtp_simulator.py --rounds 1e9 --workers 8
+    python rtp_simulator.py --games slots --villages suna,konoha --rounds 1e7
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# main создает базу при импорте — уводим ее во временный файл
+os.environ.setdefault("SHINOBI_DB_PATH", os.path.join(tempfile.mkdtemp(), "rtp_simulator.db"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main  # noqa: E402
+
+GAMES = list(main.GAMES)
+VILLAGES = list(main.VILLAGES)
+Z_95 = 1.959963984540054
+
+
+# Исходы: равномерные индексы в таблице выплат игры
+def draw(game: str, rng: np.random.Generator, n: int) -> np.ndarray:
+    if game not in main.GAMES:
+        raise ValueError(f"Неизвестная игра: {game}")
+    return rng.integers(0, main.GAMES[game].outcomes, n, dtype=np.int32)
+
+
+def payout_table(game: str, bet: int, village: str) -> np.ndarray:
+    """Выигрыш для каждого исхода при данной ставке (int64)"""
+    table = main.GAMES[game].tables.get(village) or main.GAMES[game].tables[None]
+    return np.fromiter((outcome.payout(bet) for outcome in table), dtype=np.int64, count=len(table))
+
+
+def payout(game: str, draws: np.ndarray, bet: int, village: str) -> np.ndarray:
+    """Выигрыш каждого раунда (int64) — по тем же таблицам, что и Game.play"""
+    return payout_table(game, bet, village)[draws]
+
+
+def exact_rtp(game: str, bet: int, village: str) -> float:
+    return float(payout_table(game, bet, village).mean()) / bet
+
+
+# Симуляция
+def simulate_chunk(task: tuple) -> dict:
+    game, village, bet, rounds, seed_seq = task
+    rng = np.random.default_rng(seed_seq)
+    win = payout(game, draw(game, rng, rounds), bet, village)
+    ratio = win / bet
+    return {
+        "rounds": rounds,
+        "sum": float(ratio.sum()),
+        "sum_sq": float(np.square(ratio).sum()),
+        "hits": int(np.count_nonzero(win > 0)),
+        "profits": int(np.count_nonzero(win > bet)),
+        "max_win": int(win.max()),
+    }
+
+
+def summarize(chunks: list, bet: int) -> dict:
+    n = sum(c["rounds"] for c in chunks)
+    total = sum(c["sum"] for c in chunks)
+    total_sq = sum(c["sum_sq"] for c in chunks)
+    mean = total / n
+    variance = max(total_sq / n - mean * mean, 0.0) * n / max(n - 1, 1)
+    half_width = Z_95 * math.sqrt(variance / n)
+    return {
+        "rounds": n,
+        "rtp": mean,
+        "house_edge": 1 - mean,
+        "variance": variance,
+        "std_dev": math.sqrt(variance),
+        "hit_frequency": sum(c["hits"] for c in chunks) / n,
+        "profit_frequency": sum(c["profits"] for c in chunks) / n,
+        "max_multiplier": max(c["max_win"] for c in chunks) / bet,
+        "ci95": [mean - half_width, mean + half_width],
+    }
+
+
+def run(games: list, villages: list, rounds: int, bet: int, chunk: int, workers: int, seed: int) -> dict:
+    pairs = [(game, village) for game in games for village in villages]
+    root = np.random.SeedSequence(seed)
+    tasks = {}
+    for (game, village), child in zip(pairs, root.spawn(len(pairs))):
+        counts = [chunk] * (rounds // chunk) + ([rounds % chunk] if rounds % chunk else [])
+        tasks[(game, village)] = [(game, village, bet, count, seq) for count, seq in zip(counts, child.spawn(len(counts)))]
+
+    flat = [task for key in pairs for task in tasks[key]]
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        outputs = list(pool.map(simulate_chunk, flat, chunksize=1))
+
+    position = 0
+    for key in pairs:
+        count = len(tasks[key])
+        chunks = outputs[position:position + count]
+        position += count
+        results[key] = summarize(chunks, bet)
+        results[key]["exact_rtp"] = exact_rtp(key[0], bet, key[1])
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=float, default=1e7, help="раундов на пару игра × деревня")
+    parser.add_argument("--games", default=",".join(GAMES))
+    parser.add_argument("--villages", default=",".join(VILLAGES))
+    parser.add_argument("--bet", type=int, default=100, help="ставка (выплаты округляются вниз)")
+    parser.add_argument("--chunk", type=int, default=2_000_000, help="раундов на задачу процесса")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=20240101)
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    games = args.games.split(",")
+    villages = args.villages.split(",")
+    rounds = int(args.rounds)
+
+    started = time.perf_counter()
+    results = run(games, villages, rounds, args.bet, args.chunk, args.workers, args.seed)
+    elapsed = time.perf_counter() - started
+    total = rounds * len(results)
+
+    print(f"\n{total:,} раундов за {elapsed:.1f} с ({total / elapsed / 1e6:.1f} млн/с, процессов: {args.workers})\n")
+    print(f"{'игра':<10}{'деревня':<9}{'RTP':>10}{'точный':>10}{'95% ДИ':>25}{'σ':>8}{'хиты':>8}{'в плюс':>8}{'макс x':>8}")
+    for (game, village), r in results.items():
+        low, high = r["ci95"]
+        print(f"{game:<10}{village:<9}{r['rtp']:>10.4%}{r['exact_rtp']:>10.4%}{f'[{low:.4%}, {high:.4%}]':>25}"
+              f"{r['std_dev']:>8.3f}{r['hit_frequency']:>8.2%}{r['profit_frequency']:>8.2%}{r['max_multiplier']:>8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "rounds_per_pair": rounds,
+                "bet": args.bet,
+                "seed": args.seed,
+                "elapsed_s": elapsed,
+                "results": [dict(game=game, village=village, **r) for (game, village), r in results.items()],
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,83 @@
+import itertools
+import os
+import sys
+import tempfile
+
+# Окружение задается до импорта main: модуль при импорте открывает базу
+_DATA_DIR = tempfile.mkdtemp(prefix="shinobi-tests-")
+os.environ["SHINOBI_DB_PATH"] = os.path.join(_DATA_DIR, "app.db")
+os.environ["SHINOBI_ADMIN_TOKEN"] = "test-admin"
+# scrypt подешевле и прямо в цикле событий: тестам не нужен пул процессов
+os.environ["SHINOBI_SCRYPT_N"] = "1024"
+os.environ["SHINOBI_KDF_WORKERS"] = "0"
+# Лимит частоты ставок тесты включают сами, где он проверяется
+os.environ["SHINOBI_RATE_LIMIT_PER_SECOND"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+ADMIN_HEADERS = {"Authorization": "Bearer test-admin"}
+_names = itertools.count(1)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "test.db")
+
+
+@pytest.fixture
+def make_db(tmp_path, db_path):
+    """Фабрика отдельных баз; все закрываются после теста"""
+    opened = []
+
+    def make(path=None, **kwargs):
+        kwargs.setdefault("buffer_history", False)
+        kwargs.setdefault("archive_dir", str(tmp_path / "archive"))
+        database = main.Database(path or db_path, **kwargs)
+        opened.append(database)
+        return database
+
+    yield make
+    for database in opened:
+        try:
+            database.close()
+        except Exception:
+            pass
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db()
+
+
+@pytest.fixture
+def new_user():
+    """new_user(база, ryo) — игрок с балансом ryo; возвращает id"""
+    def create(database, ryo=main.SIGNUP_RYO):
+        user_id = database.create_user(f"player{next(_names)}", "x", "konoha")
+        if ryo != main.SIGNUP_RYO:
+            database.update_balance(user_id, ryo - main.SIGNUP_RYO)
+        return user_id
+
+    return create
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Приложение целиком, один жизненный цикл на всю сессию тестов"""
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def player(client):
+    """Зарегистрированный игрок: (ник, заголовки с токеном сессии)"""
+    username = f"ninja{next(_names)}"
+    response = client.post("/api/register", json={"username": username, "password": "secret12"})
+    assert response.status_code == 200, response.text
+    token = client.post("/api/login", json={"username": username, "password": "secret12"}).json()["token"]
+    return username, {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from conftest import ADMIN_HEADERS
+
+
+@pytest.fixture
+def database(make_db):
+    """База без фонового прохода: сводки обновляются только вызовом run()"""
+    return make_db(background=False)
+
+
+def play(database, rows):
+    """rows: (user_id, игра, ставка, выигрыш, минут от начала часа два часа назад)"""
+    start = (datetime.utcnow() - timedelta(hours=2)).replace(minute=0, second=0, microsecond=0)
+    with database.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO game_history (user_id, game_type, bet_amount, win_amount, result, played_at)
+            VALUES (?, ?, ?, ?, 'x', ?)
+        ''', [(user_id, game, bet, win, (start + timedelta(minutes=minutes)).strftime("%Y-%m-%d %H:%M:%S"))
+              for user_id, game, bet, win, minutes in rows])
+    return start.strftime("%Y-%m-%d %H:%M:%S")
+
+
+@pytest.fixture
+def history(database):
+    konoha = database.create_user("rollup_konoha", "x", "konoha")
+    suna = database.create_user("rollup_suna", "x", "suna")
+    since = play(database, [
+        (konoha, "dice", 100, 0, 1),
+        (konoha, "dice", 50, 200, 2),
+        (suna, "dice", 10, 20, 3),
+        (konoha, "slots", 30, 0, 61),
+    ])
+    return since
+
+
+def test_run_folds_each_history_row_once(database, history):
+    analytics = database.analytics
+
+    assert analytics.run() == 4
+    assert analytics.run() == 0
+    assert analytics.pending() == 0
+
+    first = history
+    second = (datetime.strptime(first, "%Y-%m-%d %H:%M:%S") + timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
+    assert analytics.series("hour", history) == [
+        (first, "dice", "konoha", 2, 150, 200, 200, 1),
+        (first, "dice", "suna", 1, 10, 20, 20, 1),
+        (second, "slots", "konoha", 1, 30, 0, 0, 1),
+    ]
+    # По доходу казино: у konoha он -20, у suna -10
+    assert analytics.summary("hour", "village", history) == [("suna", 1, 10, 20, 20),
+                                                              ("konoha", 3, 180, 200, 200)]
+
+
+def test_players_are_counted_once_across_chunks(database, history):
+    analytics = main.AnalyticsRollup(database, interval=0, chunk_rows=1)
+
+    assert analytics.run() == 4
+    assert analytics.stats()["chunks"] == 4
+
+    day = analytics.series("day", history[:10] + " 00:00:00", game_type="dice", village="konoha")
+    assert [(bets, players) for _, _, _, bets, _, _, _, players in day] == [(2, 1)]
+
+
+def test_rebuild_matches_incremental_rollups(database, history):
+    analytics = database.analytics
+    analytics.run()
+    incremental = {resolution: analytics.series(resolution, history[:10]) for resolution in main.ANALYTICS_BUCKETS}
+
+    with database.transaction() as cursor:
+        cursor.execute('DELETE FROM analytics_rollups')
+
+    assert analytics.rebuild() == 4
+    assert {resolution: analytics.series(resolution, history[:10])
+            for resolution in main.ANALYTICS_BUCKETS} == incremental
+    assert analytics.run() == 0
+
+
+def test_analytics_endpoints_require_admin(client):
+    for path in ("/api/admin/analytics", "/api/admin/analytics/summary"):
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    response = client.get("/api/admin/analytics/summary", params={"by": "game"}, headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert response.json()["by"] == "game"
@@ -0,0 +1,89 @@
+import sqlite3
+from contextlib import closing
+
+import main
+
+
+def add_history(database, user_id, played_at_list, game_type="dice"):
+    rows = [(user_id, game_type, bet, 0, "lose", played_at) for bet, played_at in enumerate(played_at_list, 1)]
+    with database.transaction() as cursor:
+        cursor.executemany('INSERT INTO game_history (user_id, game_type, bet_amount, win_amount, result, played_at) '
+                           'VALUES (?, ?, ?, ?, ?, ?)', rows)
+    database.rebuild_user_stats()
+
+
+def hot_count(database):
+    with database.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM game_history').fetchone()[0]
+
+
+def read_all(database, user_id, limit, descending=True, **filters):
+    bets, after = [], None
+    while True:
+        rows = database.get_history(user_id, limit, after, descending=descending, **filters)
+        bets.extend(row[2] for row in rows)
+        if len(rows) < limit:
+            return bets
+        after = (rows[-1][5], rows[-1][0])
+
+
+PLAYED_AT = ["2024-01-05 10:00:00", "2024-01-20 10:00:00", "2024-02-01 00:00:00",
+             "2024-02-15 10:00:00", "2024-03-03 10:00:00", "2030-01-01 00:00:00"]
+
+
+def test_old_rows_move_to_monthly_files_in_chunks(make_db, new_user):
+    database = make_db()
+    database.archive.chunk_rows = 1
+    database.archive.pause = 0
+    user_id = new_user(database)
+    add_history(database, user_id, PLAYED_AT)
+
+    moved = database.archive.run(cutoff="2025-01-01 00:00:00")
+
+    assert moved == 5
+    assert database.archive.months() == ["2024-01", "2024-02", "2024-03"]
+    assert database.archive.stats()["chunks"] == 5
+    assert hot_count(database) == 1
+    # Повторный проход ничего не переносит
+    assert database.archive.run(cutoff="2025-01-01 00:00:00") == 0
+
+
+def test_history_reads_hot_table_and_archives_in_key_order(make_db, new_user):
+    database = make_db()
+    user_id = new_user(database)
+    add_history(database, user_id, PLAYED_AT)
+    database.archive.run(cutoff="2025-01-01 00:00:00")
+
+    assert read_all(database, user_id, limit=2) == [6, 5, 4, 3, 2, 1]
+    assert read_all(database, user_id, limit=4, descending=False) == [1, 2, 3, 4, 5, 6]
+    assert read_all(database, user_id, limit=10, since="2024-02-01 00:00:00", until="2024-03-01 00:00:00") == [4, 3]
+    assert database.archive.partitions("2024-02-01 00:00:00", None, None, True) == ["2024-03", "2024-02"]
+
+
+def test_stats_checks_include_archived_rows(make_db, new_user):
+    database = make_db()
+    user_id = new_user(database)
+    add_history(database, user_id, PLAYED_AT)
+    database.archive.run(cutoff="2025-01-01 00:00:00")
+
+    assert database.check_user_stats() == []
+    assert database.rebuild_user_stats() == 1
+    assert database.get_stats(user_id)[:2] == (6, 21)
+
+
+def test_interrupted_chunk_is_finished_without_duplicates(make_db, new_user):
+    """Сбой между файлами: строка уже в архиве, но еще в основной базе"""
+    database = make_db()
+    user_id = new_user(database)
+    add_history(database, user_id, PLAYED_AT[:2])
+    database.archive.run(cutoff="2024-01-10 00:00:00")
+    with database.connection() as conn:
+        row = conn.execute('SELECT * FROM game_history').fetchone()
+    with closing(sqlite3.connect(database.archive.path("2024-01"))) as conn:
+        conn.execute('INSERT INTO game_history VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+        conn.commit()
+
+    assert read_all(database, user_id, limit=10) == [2, 1]
+    database.archive.run(cutoff="2025-01-01 00:00:00")
+    assert hot_count(database) == 0
+    assert read_all(database, user_id, limit=10) == [2, 1]
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def adb(db):
+    adb = main.AsyncDatabase(db, mode="async", read_workers=2)
+    yield adb
+    adb._readers.shutdown(wait=True)
+    adb._writer_thread.shutdown(wait=True)
+
+
+def test_failed_write_reaches_only_its_caller(db, adb, new_user):
+    user_id = new_user(db, ryo=100)
+
+    def broken():
+        raise RuntimeError("сбой операции")
+
+    async def run():
+        return await asyncio.gather(
+            adb.write(db.settle_bet, user_id, "dice", 10, 0, "lose"),
+            adb.write(broken),
+            adb.write(db.settle_bet, user_id, "dice", 10, 0, "lose"),
+            return_exceptions=True)
+
+    first, failed, second = asyncio.run(run())
+
+    assert (first[0], second[0]) == (90, 80)
+    assert isinstance(failed, RuntimeError)
+
+
+def test_writes_run_in_one_thread(db, adb, new_user):
+    user_id = new_user(db, ryo=1000)
+    threads = set()
+
+    def bet():
+        threads.add(threading.current_thread().name)
+        return db.settle_bet(user_id, "dice", 10, 0, "lose")
+
+    async def run():
+        return await asyncio.gather(*[adb.write(bet) for _ in range(50)])
+
+    results = asyncio.run(run())
+
+    assert sorted(balance for balance, _ in results) == list(range(500, 1000, 10))
+    assert len(threads) == 1
+    assert adb.stats()["write_batches"] < 50
+
+
+def test_each_event_loop_gets_its_own_writer(db, adb, new_user):
+    """Несколько циклов сразу (TestClient из потоков): записи не теряются и не зависают"""
+    user_id = new_user(db, ryo=1000)
+    errors = []
+
+    def loop_worker():
+        async def run():
+            for _ in range(5):
+                await adb.write(db.settle_bet, user_id, "dice", 10, 0, "lose")
+        try:
+            asyncio.run(asyncio.wait_for(run(), timeout=10))
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=loop_worker) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert db.get_user_by_id(user_id).ryo == 800
+
+
+def test_reads_use_the_cache_first(db, adb, new_user):
+    user_id = new_user(db)
+    username = db.get_user_by_id(user_id).username
+
+    user = asyncio.run(adb.get_user(username))
+
+    assert user.id == user_id
+    assert adb.stats()["reads"] == 0
@@ -0,0 +1,60 @@
+import pytest
+
+import main
+
+
+LOSE = {"win_amount": 0, "result": "lose"}
+
+
+def test_settle_batch_plays_rounds_until_the_balance_runs_out(db, new_user):
+    user_id = new_user(db, ryo=250)
+
+    rounds, balance, rank = db.settle_batch(user_id, "dice", [100, 100, 100], [LOSE] * 3)
+
+    assert [r["balance"] for r in rounds] == [150, 50]
+    assert (balance, rank) == (50, main.calculate_rank(50))
+    assert db.get_stats(user_id)[:3] == (2, 200, 0)
+    with db.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM game_history WHERE user_id = ?', (user_id,)).fetchone()[0] == 2
+
+
+def test_settle_batch_writes_nothing_when_no_round_fits(db, new_user):
+    user_id = new_user(db, ryo=50)
+
+    assert db.settle_batch(user_id, "dice", [100], [LOSE]) == ([], 50, None)
+    assert db.get_stats(user_id) is None
+
+
+@pytest.fixture
+def batch_player(client):
+    client.post("/api/register", json={"username": "batcher", "password": "secret12"})
+    return "batcher"
+
+
+def test_batch_endpoint_plays_the_requested_rounds(client, batch_player):
+    response = client.post("/api/game/dice/batch", json={"username": batch_player, "bet": 1, "rounds": 5})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["rounds_played"] == 5
+    assert body["results"][-1]["balance"] == body["user"]["new_balance"]
+
+
+@pytest.mark.parametrize("payload", [
+    {"bet": 1, "rounds": main.BATCH_MAX_ROUNDS + 1},
+    {"bet": 1, "rounds": 10 ** 12},
+    {"bet": 1, "rounds": 0},
+    {"bet": 1, "rounds": -5},
+    {"bets": []},
+    {"bets": [1] * (main.BATCH_MAX_ROUNDS + 1)},
+])
+def test_batch_size_is_validated_before_playing(client, batch_player, payload):
+    response = client.post("/api/game/dice/batch", json=dict(payload, username=batch_player))
+
+    assert response.status_code == 422
+
+
+def test_batch_rejects_unknown_game_and_bad_bets(client, batch_player):
+    assert client.post("/api/game/poker/batch", json={"username": batch_player, "bet": 1}).status_code == 404
+    assert client.post("/api/game/dice/batch", json={"username": batch_player}).status_code == 400
+    assert client.post("/api/game/dice/batch", json={"username": batch_player, "bets": [5, 0]}).status_code == 400
@@ -0,0 +1,53 @@
+import argparse
+import json
+
+import main
+from benchmarks.__main__ import cmd_compare
+from benchmarks.common import measure
+from benchmarks.micro import run_micro
+from benchmarks.seed import seed_database
+
+
+def test_seed_fills_users_missions_and_ordered_history(db):
+    with db.connection() as conn:
+        seed_database(conn, users=20, history_rows=300)
+        assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 20
+        assert conn.execute('SELECT COUNT(*) FROM missions').fetchone()[0] == 60
+        played = [row[0] for row in conn.execute('SELECT played_at FROM game_history ORDER BY id')]
+    assert len(played) == 300
+    assert played == sorted(played)
+
+
+def test_micro_benchmarks_run_against_a_seeded_database(db, monkeypatch):
+    with db.connection() as conn:
+        seed_database(conn, users=20, history_rows=200)
+    db.rebuild_user_stats()
+    monkeypatch.setattr(main, "db", db)
+    monkeypatch.setattr(main, "leaderboard", main.Leaderboard(db))
+
+    results = run_micro(main, users=20, iterations=3, budget=1.0)
+
+    assert {"db.settle_bet", "leaderboard.top", "play_dice[iwa]"} <= set(results)
+    assert all(r["count"] == 3 for r in results.values())
+
+
+def test_measure_respects_iterations():
+    calls = []
+    summary = measure(lambda: calls.append(1), iterations=10, budget=5.0)
+
+    assert summary["count"] == len(calls) == 10
+    assert summary["p50_us"] <= summary["p99_us"]
+
+
+def test_compare_prints_relative_change(tmp_path, capsys):
+    def report(commit, p50):
+        path = tmp_path / f"{commit}.json"
+        row = {"p50_us": p50, "p99_us": p50 * 2, "throughput": 1000 / p50}
+        path.write_text(json.dumps({"meta": {"commit": commit}, "micro": {"db.get_stats": row}}))
+        return str(path)
+
+    cmd_compare(argparse.Namespace(old=report("aaa", 10.0), new=report("bbb", 5.0)))
+
+    out = capsys.readouterr().out
+    assert "aaa -> bbb" in out
+    assert "micro db.get_stats" in out and "-50%" in out
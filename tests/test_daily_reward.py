@@ -0,0 +1,58 @@
+import threading
+
+import main
+
+
+def test_concurrent_claims_credit_the_reward_once(db, new_user):
+    user_id = new_user(db)
+    start = threading.Barrier(8)
+    results = []
+
+    def claim():
+        start.wait()
+        results.append(db.claim_daily_reward(user_id))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    claimed = [result for result in results if result is not None]
+    assert len(claimed) == 1
+    assert claimed[0][0] == main.SIGNUP_RYO + main.DAILY_REWARD_AMOUNT
+    db.users.clear()
+    assert db.get_user_by_id(user_id).ryo == claimed[0][0]
+    with db.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM daily_rewards WHERE user_id = ?', (user_id,)).fetchone()[0] == 1
+        assert conn.execute('SELECT COUNT(*) FROM ryo_ledger WHERE user_id = ? AND reason = ?',
+                            (user_id, main.LEDGER_DAILY_REWARD)).fetchone()[0] == 1
+
+
+def test_reward_is_due_again_after_the_interval(db, new_user):
+    user_id = new_user(db)
+    assert db.claim_daily_reward(user_id) is not None
+    assert db.claim_daily_reward(user_id) is None
+
+    with db.transaction() as cursor:
+        cursor.execute('UPDATE users SET last_daily_reward = last_daily_reward - ? WHERE id = ?',
+                       (main.DAILY_REWARD_INTERVAL, user_id))
+    db.users.invalidate(user_id)
+
+    assert db.check_daily_reward(user_id)
+    assert db.claim_daily_reward(user_id)[0] == main.SIGNUP_RYO + 2 * main.DAILY_REWARD_AMOUNT
+
+
+def test_daily_reward_endpoints(client, player):
+    username, headers = player
+
+    status = client.get(f"/api/daily-reward/{username}").json()
+    assert status["can_claim"] is True and status["next_claim_at"] is None
+
+    claimed = client.post("/api/claim-daily-reward", json={"username": username}, headers=headers)
+    assert claimed.status_code == 200
+    assert client.post("/api/claim-daily-reward", json={"username": username}, headers=headers).status_code == 400
+
+    status = client.get(f"/api/daily-reward/{username}").json()
+    last = main.db.get_user(username).last_daily_reward
+    assert status["can_claim"] is False and status["next_claim_at"] == last + main.DAILY_REWARD_INTERVAL
@@ -0,0 +1,52 @@
+import pytest
+
+import legacy_games
+import main
+
+VILLAGES = main.VILLAGES + (None,)
+BETS = list(range(1, 400)) + [1000, 12345, 10 ** 6 + 1, 987654321]
+
+
+class FixedRandom:
+    """Подмена game_rng: всегда один и тот же исход"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def below(self, n):
+        return self.index
+
+
+@pytest.mark.parametrize("game", sorted(main.GAMES))
+def test_tables_reproduce_legacy_float_payouts(game):
+    """Каждый исход × деревня × ставка: выплата и поля совпадают со старой GameSystem"""
+    engine = main.GAMES[game]
+    mismatches = []
+    for village in VILLAGES:
+        for index in range(engine.outcomes):
+            outcome = engine.tables.get(village) or engine.tables[None]
+            outcome = outcome[index]
+            for bet in BETS:
+                expected = legacy_games.play(game, index, bet, village)["win_amount"]
+                if outcome.payout(bet) != expected:
+                    mismatches.append((village, index, bet))
+            played = engine.play(100, village, "fire", rng=FixedRandom(index))
+            legacy = legacy_games.play(game, index, 100, village)
+            if game == "slots":
+                legacy["results"] = tuple(legacy["results"])
+            if played != legacy:
+                mismatches.append((village, index, played, legacy))
+    assert mismatches == []
+
+
+def test_seeded_rng_is_reproducible_and_in_range():
+    first, second = main.BufferedRandom("audit", buffer_size=64), main.BufferedRandom("audit", buffer_size=64)
+    draws = [first.below(36) for _ in range(1000)]
+
+    assert draws == [second.below(36) for _ in range(1000)]
+    assert set(draws) == set(range(36))
+    assert draws != [main.BufferedRandom("other", buffer_size=64).below(36) for _ in range(1000)]
+
+
+def test_game_endpoint_rejects_unknown_game(client):
+    assert client.post("/api/game/poker", json={"username": "nobody", "bet": 10}).status_code == 404
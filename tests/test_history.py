@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import main
+
+GAMES = ("dice", "slots")
+
+
+@pytest.fixture
+def historian(player):
+    """Игрок с 25 строками истории (у многих строк одинаковое played_at) и его токен"""
+    username, headers = player
+    user_id = main.db.get_user(username).id
+    rows = [(user_id, GAMES[i % 2], i + 1, 0, "lose", f"2024-01-0{1 + i // 10} 12:00:00") for i in range(25)]
+    with main.db.transaction() as cursor:
+        cursor.executemany('INSERT INTO game_history (user_id, game_type, bet_amount, win_amount, result, played_at) '
+                           'VALUES (?, ?, ?, ?, ?, ?)', rows)
+    return username, headers
+
+
+def pages(client, historian, **params):
+    username, headers = historian
+    bets, cursor = [], None
+    while True:
+        body = client.get(f"/api/history/{username}", params=dict(params, cursor=cursor) if cursor else params,
+                          headers=headers).json()
+        bets.extend(row["bet_amount"] for row in body["history"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return bets
+
+
+def test_keyset_pages_cover_history_once_in_order(client, historian):
+    assert pages(client, historian, limit=7) == list(range(25, 0, -1))
+    assert pages(client, historian, limit=4, order="asc") == list(range(1, 26))
+
+
+def test_filters_apply_to_every_page(client, historian):
+    assert pages(client, historian, limit=3, game_type="dice") == list(range(25, 0, -2))
+    assert pages(client, historian, limit=3, since="2024-01-03", order="asc") == list(range(21, 26))
+
+
+def test_exports_stream_the_whole_history(client, historian, monkeypatch):
+    monkeypatch.setattr(main, "HISTORY_EXPORT_CHUNK", 4)
+
+    username, headers = historian
+    ndjson = client.get(f"/api/history/{username}", params={"format": "ndjson"}, headers=headers)
+    csv_lines = client.get(f"/api/history/{username}", params={"format": "csv", "order": "asc"},
+                           headers=headers).text.splitlines()
+
+    assert [json.loads(line)["bet_amount"] for line in ndjson.text.splitlines()] == list(range(25, 0, -1))
+    assert csv_lines[0].split(",") == list(main.HISTORY_COLUMNS)
+    assert len(csv_lines) == 26
+
+
+def test_bad_cursor_and_dates_are_rejected(client, historian):
+    username, headers = historian
+    assert client.get(f"/api/history/{username}", params={"cursor": "!!!"}, headers=headers).status_code == 400
+    assert client.get(f"/api/history/{username}", params={"since": "вчера"}, headers=headers).status_code == 400
+
+
+def test_history_is_only_given_to_its_owner(client, historian):
+    username, _ = historian
+    client.post("/api/register", json={"username": "history_peeker", "password": "secret12"})
+    token = client.post("/api/login", json={"username": "history_peeker", "password": "secret12"}).json()["token"]
+    other_headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get(f"/api/history/{username}").status_code == 401
+    assert client.get(f"/api/history/{username}", headers=other_headers).status_code == 403
+    assert client.get(f"/api/history/{username}", params={"format": "csv"}, headers=other_headers).status_code == 403
@@ -0,0 +1,76 @@
+import sqlite3
+import time
+
+import main
+
+
+def history_rows(database, user_id):
+    with database.connection() as conn:
+        return conn.execute('SELECT bet_amount, win_amount FROM game_history WHERE user_id = ? ORDER BY id',
+                            (user_id,)).fetchall()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "не дождались"
+        time.sleep(0.01)
+
+
+def test_buffered_history_is_written_by_close(make_db, new_user):
+    database = make_db(buffer_history=True)
+    user_id = new_user(database)
+
+    for bet in (10, 20, 30):
+        database.settle_bet(user_id, "dice", bet, 0, "lose")
+    database.close()
+
+    reopened = make_db()
+    assert history_rows(reopened, user_id) == [(10, 0), (20, 0), (30, 0)]
+
+
+def test_locked_batch_is_retried(make_db, new_user, monkeypatch):
+    """OperationalError: пачка остается в памяти и записывается следующей попыткой"""
+    monkeypatch.setattr(main, "HISTORY_RETRY_SECONDS", 0.01)
+    database = make_db(buffer_history=True)
+    writer = database.history_writer
+    user_id = new_user(database)
+    write = writer._write
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def flaky_write(rows):
+        if failures:
+            raise failures.pop()
+        write(rows)
+
+    monkeypatch.setattr(writer, "_write", flaky_write)
+    database.settle_bet(user_id, "dice", 10, 25, "win")
+
+    wait_for(lambda: writer.stats()["flushed_rows"] == 1)
+    assert writer.stats()["flush_errors"] == 1
+    assert history_rows(database, user_id) == [(10, 25)]
+
+
+def test_rejected_rows_are_parked_and_written_on_next_start(make_db, new_user, monkeypatch):
+    database = make_db(buffer_history=True)
+    writer = database.history_writer
+    first, second = new_user(database), new_user(database)
+    write = writer._write
+
+    def picky_write(rows):
+        if any(row[0] == second for row in rows):
+            raise sqlite3.IntegrityError("плохая строка")
+        write(rows)
+
+    monkeypatch.setattr(writer, "_write", picky_write)
+    database.settle_bet(first, "dice", 10, 0, "lose")
+    database.settle_bet(second, "dice", 20, 0, "lose")
+    database.close()
+    monkeypatch.undo()
+
+    assert writer.stats()["parked_rows"] == 1
+    assert history_rows(make_db(), first) == [(10, 0)]
+
+    restarted = make_db(buffer_history=True)
+    restarted.close()
+    assert history_rows(make_db(), second) == [(20, 0)]
@@ -0,0 +1,59 @@
+import main
+
+
+def ryo(username):
+    return main.db.get_user(username).ryo
+
+
+def test_retry_with_same_key_replays_the_stored_response(client, player):
+    username, headers = player
+    headers = dict(headers, **{"Idempotency-Key": "bet-1"})
+
+    first = client.post("/api/game/dice", json={"bet": 100}, headers=headers)
+    balance = ryo(username)
+    retry = client.post("/api/game/dice", json={"bet": 100}, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.content == first.content
+    assert first.json()["user"]["new_balance"] == balance == ryo(username)
+
+
+def test_same_key_with_another_body_is_rejected(client, player):
+    username, headers = player
+    headers = dict(headers, **{"Idempotency-Key": "bet-2"})
+
+    assert client.post("/api/game/dice", json={"bet": 100}, headers=headers).status_code == 200
+    balance = ryo(username)
+
+    assert client.post("/api/game/dice", json={"bet": 200}, headers=headers).status_code == 422
+    assert ryo(username) == balance
+
+
+def test_failed_request_is_not_stored(client, player):
+    username, headers = player
+    headers = dict(headers, **{"Idempotency-Key": "bet-3"})
+
+    assert client.post("/api/game/dice", json={"bet": 10 ** 9}, headers=headers).status_code == 400
+    retry = client.post("/api/game/dice", json={"bet": 10 ** 9}, headers=headers)
+
+    assert retry.status_code == 400
+    assert "Idempotent-Replayed" not in retry.headers
+
+
+def test_replay_is_not_rate_limited(client, player, monkeypatch):
+    username, headers = player
+    monkeypatch.setattr(main, "rate_limiter", main.RateLimiter(rate=0.001, burst=1))
+    keyed = dict(headers, **{"Idempotency-Key": "bet-4"})
+
+    first = client.post("/api/game/dice", json={"bet": 10}, headers=keyed)
+    retry = client.post("/api/game/dice", json={"bet": 10}, headers=keyed)
+    fresh = client.post("/api/game/dice", json={"bet": 10}, headers=dict(headers, **{"Idempotency-Key": "bet-5"}))
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.content == first.content
+    assert fresh.status_code == 429
+    # Отказ по лимиту снял резерв ключа: повтор потом выполнится, а не получит 409
+    monkeypatch.setattr(main, "rate_limiter", main.RateLimiter(rate=0))
+    assert client.post("/api/game/dice", json={"bet": 10},
+                       headers=dict(headers, **{"Idempotency-Key": "bet-5"})).status_code == 200
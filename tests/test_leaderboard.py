@@ -0,0 +1,56 @@
+import random
+
+import main
+
+
+def test_ranked_set_matches_a_sorted_list():
+    ranked, model = main.RankedSet(), []
+    rng = random.Random(7)
+    for _ in range(2000):
+        key = (rng.randrange(500), rng.randrange(50))
+        if key in model and rng.random() < 0.5:
+            ranked.remove(key)
+            model.remove(key)
+        elif key not in model:
+            ranked.add(key)
+            model.append(key)
+    model.sort()
+
+    assert len(ranked) == len(model)
+    assert ranked.slice(0, len(model)) == model
+    assert ranked.slice(10, 5) == model[10:15]
+    for position in (0, len(model) // 2, len(model) - 1):
+        assert ranked.index(model[position]) == position
+    assert ranked.index((-1, -1)) is None
+
+
+def test_leaderboard_follows_balance_events(db, new_user):
+    rich, poor = new_user(db, ryo=5000), new_user(db, ryo=100)
+    board = main.Leaderboard(db)
+    assert board.position(rich) == (1, 2)
+
+    db.settle_bet(poor, "dice", 100, 10000, "win")
+
+    assert [entry["ryo"] for entry in board.top(2)] == [10000, 5000]
+    assert board.position(poor) == (1, 2)
+    assert board.position(poor, "konoha") == (1, 2)
+    assert [entry["rank"] for entry in board.around(rich, window=1)] == [1, 2]
+    assert board.top(5, "kiri") == []
+
+
+def test_response_cache_is_bounded(db, new_user):
+    new_user(db)
+    board = main.Leaderboard(db, cache_ttl=60, cache_size=3)
+
+    for limit in range(1, 10):
+        board.top_response(limit)
+
+    assert board.stats()["cache_entries"] <= 3
+    board.top_response(9)
+    assert board.cache_hits == 1
+
+
+def test_endpoints_reject_unknown_villages(client):
+    assert client.get("/api/leaderboard", params={"village": "konoha"}).status_code == 200
+    assert client.get("/api/leaderboard", params={"village": "x" * 100}).status_code == 400
+    assert client.get("/api/leaderboard", params={"limit": main.LEADERBOARD_MAX_LIMIT + 1}).status_code == 422
@@ -0,0 +1,45 @@
+import main
+
+
+def stored_ryo(database, user_id):
+    """users.ryo как есть — баланс на момент последнего снимка"""
+    with database.connection() as conn:
+        return conn.execute('SELECT ryo FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+
+
+def test_balance_is_snapshot_plus_ledger_tail(db, new_user):
+    user_id = new_user(db)
+    db.snapshot()
+    db.settle_bet(user_id, "dice", 100, 0, "lose")
+    db.settle_bet(user_id, "dice", 50, 200, "win")
+
+    assert stored_ryo(db, user_id) == main.SIGNUP_RYO
+    db.users.clear()
+    assert db.get_user_by_id(user_id).ryo == main.SIGNUP_RYO + 50
+
+
+def test_snapshot_folds_the_tail_into_users(db, new_user):
+    user_id = new_user(db)
+    db.settle_bet(user_id, "dice", 100, 0, "lose")
+
+    assert db.snapshot() > 0
+    assert stored_ryo(db, user_id) == main.SIGNUP_RYO - 100
+    with db.connection() as conn:
+        assert main.ledger_tail(conn.cursor()) == {}
+    # Пустой хвост — снимок ничего не делает
+    assert db.snapshot() == 0
+
+
+def test_restart_recovers_balances_from_the_ledger(make_db, db_path, new_user):
+    """Остановка без снимка: при следующем запуске хвост журнала сворачивается в users"""
+    crashed = make_db(background=False)
+    user_id = new_user(crashed)
+    crashed.settle_bet(user_id, "dice", 300, 0, "lose")
+    crashed.close()  # не владелец журнала: снимок при закрытии не делается
+    assert stored_ryo(make_db(background=False), user_id) == 0
+
+    restarted = make_db()
+
+    assert stored_ryo(restarted, user_id) == main.SIGNUP_RYO - 300
+    assert restarted.get_user_by_id(user_id).ryo == main.SIGNUP_RYO - 300
+    assert restarted.ledger_stats()["tail"] == 0
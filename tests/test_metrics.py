@@ -0,0 +1,42 @@
+import main
+from conftest import ADMIN_HEADERS
+
+
+def test_sql_labels_are_operation_and_first_table():
+    assert main.sql_labels("SELECT ryo FROM users WHERE id = ?") == (("operation", "select"), ("table", "users"))
+    assert main.sql_labels("\n  insert into game_history (user_id) VALUES (?)") == \
+        (("operation", "insert"), ("table", "game_history"))
+    assert main.sql_labels('UPDATE "missions" SET progress = 1') == (("operation", "update"), ("table", "missions"))
+    assert main.sql_labels("SELECT * FROM archive_2024_01.game_history") == \
+        (("operation", "select"), ("table", "game_history"))
+    assert main.sql_labels("PRAGMA user_version") == (("operation", "pragma"), ("table", ""))
+
+
+def test_histograms_are_cumulative_and_labelled():
+    metrics = main.Metrics(buckets=(0.01, 0.1))
+    metrics.observe("shinobi_sql_statement_duration_seconds", main.sql_labels("SELECT 1 FROM users"), 0.05)
+    metrics.observe("shinobi_sql_statement_duration_seconds", main.sql_labels("SELECT 2 FROM users"), 5)
+    metrics.inc("shinobi_sql_commits_total")
+
+    text = metrics.render()
+
+    labels = 'operation="select",table="users"'
+    assert f'shinobi_sql_statement_duration_seconds_bucket{{{labels},le="0.1"}} 1' in text
+    assert f'shinobi_sql_statement_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f'shinobi_sql_statement_duration_seconds_count{{{labels}}} 2' in text
+    assert "shinobi_sql_commits_total 1" in text
+
+
+def test_metrics_endpoint_is_admin_only(client):
+    client.get("/api/leaderboard")
+
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert 'route="/api/leaderboard"' in response.text
+    assert "statement=" not in response.text
+
+
+def test_slow_requests_is_admin_only(client):
+    assert client.get("/api/admin/slow-requests").status_code == 401
+    assert client.get("/api/admin/slow-requests", headers=ADMIN_HEADERS).json()["success"] is True
@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import main
+
+
+def connect(path):
+    conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_fresh_database_reaches_latest_version(db_path):
+    with closing(connect(db_path)) as conn:
+        assert main.migrate(conn) == main.SCHEMA_VERSION
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == main.SCHEMA_VERSION
+        # Повторный запуск ничего не меняет
+        assert main.migrate(conn) == main.SCHEMA_VERSION
+
+
+def test_migrate_stops_at_target(db_path):
+    with closing(connect(db_path)) as conn:
+        assert main.migrate(conn, target=1) == 1
+        assert 'idx_game_history_user_played' not in indexes(conn)
+
+        assert main.migrate(conn) == main.SCHEMA_VERSION
+        assert 'idx_game_history_user_played' in indexes(conn)
+
+
+def test_concurrent_migrations_apply_each_step_once(db_path, monkeypatch):
+    """Версия перечитывается под BEGIN IMMEDIATE: неидемпотентный шаг не выполняется дважды"""
+    def seed(cursor):
+        time.sleep(0.05)
+        cursor.execute("INSERT INTO users (username, password_hash) VALUES ('seed', 'x')")
+
+    version = main.SCHEMA_VERSION + 1
+    monkeypatch.setattr(main, "MIGRATIONS", main.MIGRATIONS + [(version, "тестовая", [seed])])
+    monkeypatch.setattr(main, "SCHEMA_VERSION", version)
+    with closing(connect(db_path)) as conn:
+        main.migrate(conn, target=version - 1)
+
+    start = threading.Barrier(6)
+    errors = []
+
+    def run():
+        try:
+            with closing(connect(db_path)) as conn:
+                start.wait()
+                main.migrate(conn)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with closing(connect(db_path)) as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == version
+        assert conn.execute("SELECT COUNT(*) FROM users WHERE username = 'seed'").fetchone()[0] == 1
+
+
+def test_ledger_migration_opens_existing_balances(db_path):
+    """v7: остатки users становятся начальными проводками, индекс по ryo больше не нужен"""
+    with closing(connect(db_path)) as conn:
+        main.migrate(conn, target=6)
+        assert 'idx_users_ryo' in indexes(conn)
+        conn.executemany("INSERT INTO users (username, password_hash, ryo) VALUES (?, 'x', 1000)",
+                         [(f"user{i}",) for i in range(50)])
+
+        main.migrate(conn)
+
+        assert 'idx_users_ryo' not in indexes(conn)
+        assert conn.execute('SELECT COUNT(*), SUM(delta) FROM ryo_ledger WHERE reason = ?',
+                            (main.LEDGER_OPENING,)).fetchone() == (50, 50 * 1000)
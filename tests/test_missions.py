@@ -0,0 +1,64 @@
+import main
+
+
+def missions_by_type(database, user_id):
+    """mission_type -> (прогресс, выполнена) как в базе"""
+    return {row[2]: (row[3], bool(row[4])) for row in database.get_missions(user_id)}
+
+
+def test_bets_are_saved_at_checkpoints_and_flushed(db, new_user):
+    engine = main.MissionEngine(db)
+    user_id = new_user(db)
+
+    for _ in range(4):
+        db.settle_bet(user_id, "dice", 10, 0, "lose")
+    assert missions_by_type(db, user_id)["play_10_games"] == (0, False)
+    assert 4 in engine.progress(user_id).values()
+
+    db.settle_bet(user_id, "dice", 10, 0, "lose")
+    assert missions_by_type(db, user_id)["play_10_games"] == (5, False)
+
+    db.settle_bet(user_id, "dice", 10, 0, "lose")
+    engine.flush()
+    assert missions_by_type(db, user_id)["play_10_games"] == (6, False)
+
+
+def test_completion_pays_the_reward_once(db, new_user):
+    engine = main.MissionEngine(db)
+    user_id = new_user(db)
+    reward = main.MISSION_SPECS["play_10_games"].reward
+
+    for _ in range(12):
+        db.settle_bet(user_id, "dice", 10, 0, "lose")
+
+    assert missions_by_type(db, user_id)["play_10_games"] == (10, True)
+    assert db.get_user_by_id(user_id).ryo == 1000 - 120 + reward
+    assert engine.stats()["completions"] == 1
+    # Повторная отметка (второй процесс) награду не начисляет
+    mission_id = next(row[0] for row in db.get_missions(user_id) if row[2] == "play_10_games")
+    assert db.complete_mission(user_id, mission_id, 10, reward) is False
+
+
+def test_earned_and_rank_missions_follow_the_balance(db, new_user):
+    main.MissionEngine(db)
+    user_id = new_user(db)
+
+    db.settle_bet(user_id, "dice", 10, 2010, "win")  # +2000 ryo
+    assert missions_by_type(db, user_id)["earn_5000_ryo"] == (2000, False)
+    assert missions_by_type(db, user_id)["reach_chunin"] == (0, False)
+
+    db.settle_bet(user_id, "dice", 10, 7010, "win")  # 10000 ryo — chunin
+    missions = missions_by_type(db, user_id)
+    assert missions["earn_5000_ryo"] == (5000, True)
+    assert missions["reach_chunin"] == (1, True)
+
+
+def test_evicted_user_progress_is_written(db, new_user):
+    engine = main.MissionEngine(db, capacity=1)
+    first, second = new_user(db), new_user(db)
+
+    db.settle_bet(first, "dice", 10, 0, "lose")
+    db.settle_bet(second, "dice", 10, 0, "lose")
+
+    assert missions_by_type(db, first)["play_10_games"] == (1, False)
+    assert engine.stats()["users"] == 1
@@ -0,0 +1,54 @@
+import asyncio
+import hashlib
+
+import main
+
+
+def stored_hash(username):
+    with main.db.connection() as conn:
+        return conn.execute('SELECT password_hash FROM users WHERE username = ?', (username,)).fetchone()[0]
+
+
+def test_hash_is_salted_scrypt():
+    first, second = main.hash_password("secret"), main.hash_password("secret")
+
+    assert first != second
+    assert first.startswith(f"scrypt${main.PASSWORD_SCRYPT_N}$")
+    assert main.verify_password("secret", first)
+    assert not main.verify_password("wrong", first)
+    assert not main.password_needs_rehash(first)
+    assert main.password_needs_rehash(main.hash_password("secret", n=main.PASSWORD_SCRYPT_N * 2))
+
+
+def test_pool_computes_the_same_scrypt():
+    hasher = main.PasswordHasher(workers=1)
+    try:
+        digest = asyncio.run(hasher.scrypt("test", "secret", b"salt" * 4, 1024, 8, 1, 32))
+    finally:
+        hasher.close()
+
+    assert digest == hashlib.scrypt(b"secret", salt=b"salt" * 4, n=1024, r=8, p=1, dklen=32)
+
+
+def test_legacy_sha256_hash_is_upgraded_on_login(client):
+    legacy = hashlib.sha256(b"old-secret").hexdigest()
+    main.db.create_user("legacy_ninja", legacy, "konoha")
+
+    assert client.post("/api/login", params={"username": "legacy_ninja", "password": "wrong"}).status_code == 401
+    assert stored_hash("legacy_ninja") == legacy
+    assert client.post("/api/login", params={"username": "legacy_ninja", "password": "old-secret"}).status_code == 200
+
+    upgraded = stored_hash("legacy_ninja")
+    assert upgraded.startswith("scrypt$") and main.verify_password("old-secret", upgraded)
+    assert client.post("/api/login", params={"username": "legacy_ninja", "password": "old-secret"}).status_code == 200
+
+
+def test_full_kdf_queue_answers_503(client, monkeypatch):
+    client.post("/api/register", json={"username": "busy_ninja", "password": "secret12"})
+    monkeypatch.setattr(main, "password_hasher", main.PasswordHasher(workers=0, max_pending=0))
+
+    response = client.post("/api/login", params={"username": "busy_ninja", "password": "secret12"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert main.password_hasher.stats()["rejected"] == 1
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+import main
+from conftest import ADMIN_HEADERS
+
+
+def test_nested_calls_share_the_thread_connection(db_path):
+    pool = main.ConnectionPool(db_path, size=2)
+    with pool.connection() as outer:
+        with pool.connection() as inner:
+            assert inner is outer
+        assert pool.stats()["in_use"] == 1
+    assert pool.stats()["idle"] == 1
+    pool.close()
+
+
+def test_connection_is_reused_and_configured(db_path):
+    pool = main.ConnectionPool(db_path, size=2)
+    with pool.connection() as first:
+        assert first.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert first.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    with pool.connection() as second:
+        assert second is first
+
+    stats = pool.stats()
+    assert (stats["open"], stats["misses"], stats["hits"]) == (1, 1, 1)
+    pool.close()
+
+
+def test_pool_never_exceeds_its_size(db_path):
+    pool = main.ConnectionPool(db_path, size=1, timeout=0.05)
+    taken, release = threading.Event(), threading.Event()
+
+    def hold():
+        with pool.connection():
+            taken.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    taken.wait()
+    with pytest.raises(TimeoutError):
+        with pool.connection():
+            pass
+    release.set()
+    holder.join()
+
+    with pool.connection():
+        pass
+    stats = pool.stats()
+    assert (stats["open"], stats["timeouts"]) == (1, 1)
+    pool.close()
+
+
+def test_closed_pool_refuses_new_connections(db_path):
+    pool = main.ConnectionPool(db_path, size=1)
+    pool.close()
+    with pytest.raises(RuntimeError):
+        with pool.connection():
+            pass
+
+
+def test_unfinished_transaction_is_rolled_back_on_checkin(db):
+    with db.connection() as conn:
+        conn.execute("INSERT INTO users (username, password_hash) VALUES ('ghost', 'x')")
+    assert db.get_user("ghost") is None
+
+
+def test_db_stats_is_admin_only(client):
+    assert client.get("/api/admin/db-stats").status_code == 401
+    assert client.get("/api/admin/db-stats", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    response = client.get("/api/admin/db-stats", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert response.json()["pool"]["size"] == main.DB_POOL_SIZE
+
+
+def test_db_stats_is_closed_without_admin_token(client, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    assert client.get("/api/admin/db-stats", headers=ADMIN_HEADERS).status_code == 403
@@ -0,0 +1,30 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import legacy_games  # noqa: E402
+import main  # noqa: E402
+import rtp_simulator  # noqa: E402
+
+
+@pytest.mark.parametrize("game", rtp_simulator.GAMES)
+@pytest.mark.parametrize("village", rtp_simulator.VILLAGES)
+def test_exact_rtp_matches_legacy_games(game, village):
+    """Точный RTP таблицы — среднее выплат старой GameSystem по всем исходам"""
+    for bet in (1, 7, 100):
+        outcomes = main.GAMES[game].outcomes
+        legacy = sum(legacy_games.play(game, index, bet, village)["win_amount"] for index in range(outcomes))
+        assert rtp_simulator.exact_rtp(game, bet, village) == pytest.approx(legacy / outcomes / bet)
+
+
+def test_summary_of_chunks_matches_direct_computation():
+    seed = np.random.SeedSequence(1)
+    chunks = [rtp_simulator.simulate_chunk(("dice", "iwa", 100, 5000, child)) for child in seed.spawn(2)]
+
+    summary = rtp_simulator.summarize(chunks, 100)
+
+    assert summary["rounds"] == 10000
+    low, high = summary["ci95"]
+    assert low < summary["rtp"] < high
+    assert low < rtp_simulator.exact_rtp("dice", 100, "iwa") < high
+    assert 0 < summary["hit_frequency"] <= 1
@@ -0,0 +1,68 @@
+import base64
+
+import main
+
+
+def test_token_plays_without_username_and_is_checked_in_memory(client, player):
+    username, headers = player
+
+    response = client.post("/api/game/dice", json={"bet": 10}, headers=headers)
+
+    assert response.status_code == 200
+    assert client.get(f"/api/stats/{username}", headers=headers).status_code == 200
+    hits = main.session_tokens.stats()["cache_hits"]
+    assert client.get(f"/api/missions/{username}", headers=headers).status_code == 200
+    assert main.session_tokens.stats()["cache_hits"] == hits + 1
+
+
+def test_forged_and_expired_tokens_are_rejected(client, player, monkeypatch):
+    username, headers = player
+    token = headers["Authorization"].split()[1]
+    raw = bytearray(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    raw[1] ^= 1  # другой id игрока, подпись та же
+    forged = base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode()
+
+    assert client.post("/api/game/dice", json={"bet": 10},
+                       headers={"Authorization": f"Bearer {forged}"}).status_code == 401
+    expires_at = main.session_tokens.decode(token)[1]
+    monkeypatch.setattr(main.time, "time", lambda: expires_at + 1)
+    assert client.post("/api/game/dice", json={"bet": 10}, headers=headers).status_code == 401
+
+
+def test_token_of_another_player_is_refused(client, player):
+    _, headers = player
+    client.post("/api/register", json={"username": "token_victim", "password": "secret12"})
+
+    assert client.get("/api/stats/token_victim", headers=headers).status_code == 403
+    assert client.post("/api/game/dice", json={"username": "token_victim", "bet": 10},
+                       headers=headers).status_code == 403
+
+
+def test_logout_revokes_the_token(client, player):
+    username, headers = player
+
+    assert client.post("/api/logout", headers=headers).status_code == 200
+
+    assert client.post("/api/game/dice", json={"bet": 10}, headers=headers).status_code == 401
+    # Отзыв хранится в базе: новый кэш (другой процесс) тоже его видит
+    main.session_tokens.clear()
+    assert client.get(f"/api/stats/{username}", headers=headers).status_code == 401
+    assert client.post("/api/logout", headers={"Authorization": "Bearer garbage"}).status_code == 401
+
+
+def test_username_only_requests_can_be_switched_off(client, player, monkeypatch):
+    username, _ = player
+    assert client.post("/api/game/dice", json={"username": username, "bet": 10}).status_code == 200
+
+    monkeypatch.setattr(main, "SESSION_REQUIRED", True)
+
+    assert client.post("/api/game/dice", json={"username": username, "bet": 10}).status_code == 401
+
+
+def test_login_accepts_json_and_query(client, player):
+    username, _ = player
+
+    body = client.post("/api/login", json={"username": username, "password": "secret12"}).json()
+    assert main.session_tokens.decode(body["token"])[0] == body["user"]["id"]
+    assert client.post("/api/login", params={"username": username, "password": "secret12"}).status_code == 200
+    assert client.post("/api/login", json={"username": username, "password": "wrong"}).status_code == 401
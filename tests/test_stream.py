@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import main
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def hub_for(database, **kwargs):
+    return main.StreamHub(database, main.Leaderboard(database), **kwargs)
+
+
+def test_balance_updates_coalesce_into_one_message(db, new_user):
+    user_id = new_user(db)
+    hub = hub_for(db)
+
+    async def scenario():
+        subscriber = hub.subscribe(user_id)
+        for _ in range(3):
+            db.settle_bet(user_id, "dice", 10, 0, "lose")
+        await asyncio.sleep(0.05)
+        return subscriber.queue.qsize(), await subscriber.get()
+
+    size, (kind, data) = run(scenario())
+
+    assert size == 1
+    assert (kind, data["ryo"]) == ("balance", 970)
+
+
+def test_slow_subscriber_is_dropped_when_its_queue_overflows(db, new_user):
+    user_id = new_user(db)
+    hub = hub_for(db, queue_size=2)
+
+    async def scenario():
+        subscriber = hub.subscribe(user_id)
+        for mission_id in range(3):
+            hub.on_mission({"user_id": user_id, "mission_id": mission_id, "mission_type": "play_10_games",
+                            "reward": 500})
+        await asyncio.sleep(0.05)
+        return subscriber
+
+    subscriber = run(scenario())
+
+    assert subscriber.dropped
+    assert hub.stats()["dropped"] == 1 and hub.stats()["subscribers"] == 0
+
+
+def test_leaderboard_delta_has_only_changed_places(db, new_user):
+    leader, second = new_user(db, ryo=5000), new_user(db, ryo=3000)
+    hub = hub_for(db)
+
+    async def scenario():
+        subscriber = hub.subscribe(leader)
+        hub.refresh()
+        await asyncio.sleep(0.05)
+        _, first = await subscriber.get()
+        db.update_balance(second, 10000)  # второй обходит лидера
+        hub.refresh()
+        await asyncio.sleep(0.05)
+        return first, await subscriber.get()
+
+    first, (kind, delta) = run(scenario())
+
+    assert set(first) == {"1", "2"}
+    assert kind == "leaderboard"
+    assert {place: entry["ryo"] for place, entry in delta.items()} == {"1": 13000, "2": 5000}
+
+
+def test_stream_starts_with_a_snapshot(player):
+    username, _ = player
+    user = main.db.get_user(username)
+
+    async def first_frames():
+        events = main.stream_events(user.id, username)
+        try:
+            return [await events.__anext__() for _ in range(3)]
+        finally:
+            await events.aclose()
+
+    retry, balance, leaderboard = run(first_frames())
+
+    assert retry == b"retry: 3000\n\n"
+    assert balance.startswith(b"event: balance\n")
+    assert json.loads(balance.split(b"data: ", 1)[1])["ryo"] == user.ryo
+    assert leaderboard.startswith(b"event: leaderboard\n")
+    assert main.stream_hub.stats()["users"] == 0
+
+
+def test_stream_needs_the_owners_token(client, player):
+    username, headers = player
+    client.post("/api/register", json={"username": "stream_owner", "password": "secret12"})
+
+    assert client.get("/api/stream/stream_owner").status_code == 401
+    assert client.get("/api/stream/stream_owner", params={"token": "forged"}).status_code == 401
+    assert client.get("/api/stream/stream_owner", headers=headers).status_code == 403
+    token = headers["Authorization"].split()[1]
+    assert client.get("/api/stream/stream_owner", params={"token": token}).status_code == 403
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+import main
+from conftest import ADMIN_HEADERS
+
+
+@pytest.fixture
+def engine(db):
+    engine = main.TournamentEngine(db, persist_interval=0)
+    engine.start()
+    yield engine
+    engine.close()
+
+
+def test_close_pays_prizes_by_place_once(db, engine, new_user):
+    now = int(time.time())
+    tournament_id = db.create_tournament("Неделя кубиков", "net_win", ["dice"], [300, 100], now - 10, now + 3600)
+    first, second, third = new_user(db), new_user(db), new_user(db)
+    db.settle_bet(first, "dice", 10, 110, "win")     # +100
+    db.settle_bet(second, "dice", 10, 40, "win")     # +30
+    db.settle_bet(third, "dice", 10, 0, "lose")      # -10
+    db.settle_bet(third, "slots", 10, 500, "win")    # не та игра — не в зачет
+
+    engine.close_finished(now=now + 3600)
+
+    db.users.clear()
+    assert db.get_user_by_id(first).ryo == main.SIGNUP_RYO + 100 + 300
+    assert db.get_user_by_id(second).ryo == main.SIGNUP_RYO + 30 + 100
+    assert db.get_user_by_id(third).ryo == main.SIGNUP_RYO - 10 + 490
+    standings = db.get_final_standings(tournament_id, 1, 10)
+    assert [(place, score, prize) for place, _, score, _, prize in standings] == [
+        (1, 100, 300), (2, 30, 100), (3, -10, None)]
+    assert dict(zip(main.TOURNAMENT_COLUMNS, db.get_tournament(tournament_id)))["status"] == "closed"
+
+    # Повторное закрытие (второй процесс, перезапуск) ничего не выплачивает
+    assert db.close_tournament(tournament_id, [(first, 100, 1, 1)], [300]) is None
+    assert db.get_user_by_id(first).ryo == main.SIGNUP_RYO + 100 + 300
+
+
+def test_prize_above_limit_is_refused(db):
+    with pytest.raises(ValueError):
+        db.create_tournament("x", "net_win", [], [main.TOURNAMENT_MAX_PRIZE + 1], 0, 3600)
+
+
+def test_create_tournament_requires_admin_and_sane_values(client):
+    tournament = {"name": "Турнир", "games": ["dice"], "prizes": [500, 100]}
+
+    assert client.post("/api/admin/tournaments", json=tournament).status_code == 401
+    assert client.post("/api/admin/tournaments", json=tournament,
+                       headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.post("/api/admin/tournaments", json=dict(tournament, prizes=[10 ** 15]),
+                       headers=ADMIN_HEADERS).status_code == 400
+    assert client.post("/api/admin/tournaments", json=dict(tournament, days=0.001),
+                       headers=ADMIN_HEADERS).status_code == 422
+
+    created = client.post("/api/admin/tournaments", json=tournament, headers=ADMIN_HEADERS)
+    assert created.status_code == 200
+    assert created.json()["tournament"]["prizes"] == [500, 100]
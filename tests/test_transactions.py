@@ -0,0 +1,120 @@
+import threading
+
+import pytest
+
+import main
+
+
+def balance(database, user_id):
+    return database.get_user_by_id(user_id).ryo
+
+
+def test_settle_bet_moves_balance_and_records_history(db, new_user):
+    user_id = new_user(db, ryo=100)
+
+    assert db.settle_bet(user_id, "dice", 30, 90, "win") == (160, main.calculate_rank(160))
+    assert db.settle_bet(user_id, "dice", 200, 0, "lose") is None
+    assert balance(db, user_id) == 160
+
+    with db.connection() as conn:
+        history = conn.execute('SELECT bet_amount, win_amount FROM game_history WHERE user_id = ?',
+                               (user_id,)).fetchall()
+    assert history == [(30, 90)]
+
+
+def test_concurrent_bets_never_overdraw(db, new_user):
+    """BEGIN IMMEDIATE: проверка баланса и списание под одной блокировкой записи"""
+    user_id = new_user(db, ryo=100)
+    start = threading.Barrier(8)
+    accepted = []
+
+    def bettor():
+        start.wait()
+        for _ in range(5):
+            if db.settle_bet(user_id, "dice", 10, 0, "lose") is not None:
+                accepted.append(1)
+
+    threads = [threading.Thread(target=bettor) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(accepted) == 10
+    db.users.clear()
+    assert balance(db, user_id) == 0
+
+
+def test_rank_is_persisted_with_the_snapshot(db, new_user):
+    user_id = new_user(db, ryo=9990)
+
+    db.settle_bet(user_id, "slots", 10, 100, "win")
+    assert db.get_user_by_id(user_id).rank == main.calculate_rank(10080)
+
+    db.snapshot()
+    with db.connection() as conn:
+        assert conn.execute('SELECT rank FROM users WHERE id = ?', (user_id,)).fetchone()[0] == \
+            main.calculate_rank(10080)
+
+
+def test_game_endpoint_rejects_bad_bets(client):
+    assert client.post("/api/register", json={"username": "bettor", "password": "secret12"}).status_code == 200
+
+    for bet in (0, -10, 10 ** 9):
+        response = client.post("/api/game/dice", json={"username": "bettor", "bet": bet})
+        assert response.status_code == 400
+    assert client.post("/api/game/dice", json={"username": "bettor", "bet": 10}).status_code == 200
+
+
+def test_group_commit_rolls_back_only_the_failed_operation(db, new_user, monkeypatch):
+    first, second = new_user(db), new_user(db)
+    balance_event = db._balance_event
+
+    def failing_event(cursor, user_id):
+        if user_id == second:
+            raise RuntimeError("сбой после проводки")
+        return balance_event(cursor, user_id)
+
+    monkeypatch.setattr(db, "_balance_event", failing_event)
+    with db.group_commit():
+        db.settle_bet(first, "dice", 10, 0, "lose")
+        with pytest.raises(RuntimeError):
+            db.settle_bet(second, "dice", 10, 50, "win")
+        db.settle_bet(first, "dice", 10, 30, "win")
+    monkeypatch.undo()
+
+    db.users.clear()
+    assert balance(db, first) == main.SIGNUP_RYO - 10 + 20
+    assert balance(db, second) == main.SIGNUP_RYO
+    with db.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM game_history WHERE user_id = ?', (second,)).fetchone()[0] == 0
+        assert conn.execute('SELECT COUNT(*) FROM ryo_ledger WHERE user_id = ? AND reason = ?',
+                            (second, main.LEDGER_BET)).fetchone()[0] == 0
+
+
+def test_group_commit_publishes_events_after_commit(db, new_user):
+    user_id = new_user(db)
+    seen = []
+    db.events.subscribe('balance', lambda event: seen.append(event["ryo"]))
+
+    with db.group_commit():
+        db.settle_bet(user_id, "dice", 10, 0, "lose")
+        db.settle_bet(user_id, "dice", 10, 0, "lose")
+        assert seen == []
+
+    assert seen == [main.SIGNUP_RYO - 10, main.SIGNUP_RYO - 20]
+
+
+def test_group_commit_failure_discards_writes_and_events(db, new_user):
+    user_id = new_user(db)
+    seen = []
+    db.events.subscribe('balance', lambda event: seen.append(event))
+
+    with pytest.raises(RuntimeError):
+        with db.group_commit():
+            db.settle_bet(user_id, "dice", 10, 0, "lose")
+            raise RuntimeError("отказ всей пачки")
+
+    assert seen == []
+    db.users.clear()
+    assert balance(db, user_id) == main.SIGNUP_RYO
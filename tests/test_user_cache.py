@@ -0,0 +1,77 @@
+import threading
+
+import main
+
+
+def test_read_racing_a_write_is_not_cached(db, new_user, monkeypatch):
+    """Ставка коммитится между чтением строки и put: старый снимок в кэш не попадает"""
+    user_id = new_user(db)
+    db.users.invalidate(user_id)
+    record = main.UserRecord
+
+    def racing_record(*row):
+        monkeypatch.setattr(main, "UserRecord", record)
+        writer = threading.Thread(target=db.settle_bet, args=(user_id, "dice", 900, 0, "lose"))
+        writer.start()
+        writer.join()
+        return record(*row)
+
+    monkeypatch.setattr(main, "UserRecord", racing_record)
+    stale = db.get_user_by_id(user_id)
+
+    assert stale.ryo == main.SIGNUP_RYO  # читатель сам получил снимок до ставки
+    assert db.users.get(user_id) is None
+    assert db.users.stats()["stale_puts"] == 1
+    assert db.get_user_by_id(user_id).ryo == main.SIGNUP_RYO - 900
+
+
+def test_quiet_read_is_cached(db, new_user):
+    user_id = new_user(db)
+    db.users.invalidate(user_id)
+
+    user = db.get_user_by_id(user_id)
+
+    assert db.users.get(user_id) == user
+    assert db.get_user(user.username) is user
+
+
+def test_write_through_keeps_cached_balance_current(db, new_user):
+    user_id = new_user(db)
+    db.get_user_by_id(user_id)
+
+    db.settle_bet(user_id, "dice", 100, 250, "win")
+
+    assert db.users.get(user_id).ryo == main.SIGNUP_RYO + 150
+
+
+def test_events_are_applied_in_seq_order(db, new_user):
+    user_id = new_user(db)
+    db.get_user_by_id(user_id)
+    event = {"user_id": user_id, "rank": "genin", "total_earned": 0, "last_daily_reward": None}
+
+    db.users.apply(dict(event, seq=10 ** 9, ryo=1))
+    db.users.apply(dict(event, seq=1, ryo=2))  # опоздавшее старое событие
+
+    assert db.users.get(user_id).ryo == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = main.UserCache(capacity=2, ttl=60)
+    for user_id in (1, 2, 3):
+        cache.put(main.UserRecord(user_id, f"u{user_id}", "x", "konoha", 0, "genin", None, 0, None))
+
+    assert cache.get(1) is None
+    assert cache.get_by_username("u3").id == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_read_started_before_clear_is_not_cached(db, new_user):
+    """clear() после переподключения к писателю: начатое до него чтение в кэш не попадает"""
+    record = db.get_user_by_id(new_user(db))
+    cache = main.UserCache()
+    since = cache.generation()
+
+    cache.clear()
+    cache.put(record, since=since)
+
+    assert cache.get(record.id) is None
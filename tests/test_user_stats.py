@@ -0,0 +1,41 @@
+import main
+
+
+def test_settlement_keeps_aggregates_in_step(db, new_user):
+    user_id = new_user(db)
+
+    db.settle_bet(user_id, "dice", 10, 0, "lose")
+    db.settle_bet(user_id, "dice", 20, 60, "win")
+    db.settle_bet(user_id, "slots", 30, 300, "win")
+
+    games, total_bet, total_win, biggest_win, last_played_at = db.get_stats(user_id)
+    assert (games, total_bet, total_win, biggest_win) == (3, 60, 360, 300)
+    assert last_played_at is not None
+    assert sorted(db.get_game_stats(user_id)) == [("dice", 2, 30, 60, 60), ("slots", 1, 30, 300, 300)]
+    assert db.check_user_stats() == []
+
+
+def test_check_and_rebuild_repair_drifted_aggregates(db, new_user):
+    user_id = new_user(db)
+    db.settle_bet(user_id, "dice", 10, 25, "win")
+    with db.connection() as conn:
+        conn.execute('UPDATE user_stats SET total_bet = 999 WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM user_game_stats WHERE user_id = ?', (user_id,))
+        conn.commit()
+
+    assert len(db.check_user_stats()) == 2
+
+    assert db.rebuild_user_stats() == 1
+    assert db.check_user_stats() == []
+    assert db.get_stats(user_id)[:4] == (1, 10, 25, 25)
+
+
+def test_stats_endpoint_reports_breakdown(client):
+    client.post("/api/register", json={"username": "statist", "password": "secret12"})
+    user_id = main.db.get_user("statist").id
+    main.db.settle_bet(user_id, "blackjack", 100, 200, "win")
+
+    stats = client.get("/api/stats/statist").json()["stats"]
+
+    assert (stats["total_games"], stats["profit"], stats["biggest_win"]) == (1, 100, 200)
+    assert stats["by_game"]["blackjack"]["profit"] == 100
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def writer(make_db, db_path, tmp_path):
+    """Процесс-писатель (python main.py writer) и база воркера на том же файле"""
+    socket_path = str(tmp_path / "writer.sock")
+    worker_db = make_db()
+    process = subprocess.Popen(
+        [sys.executable, main.__file__, "writer", "--socket", socket_path],
+        env=dict(os.environ, SHINOBI_DB_PATH=db_path, SHINOBI_DB_MODE="async"),
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while not main.writer_alive(socket_path):
+            assert process.poll() is None and time.monotonic() < deadline, "писатель не запустился"
+            time.sleep(0.05)
+        yield worker_db, socket_path
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def run_remote(worker_db, socket_path, scenario):
+    """scenario(adb) в своем цикле событий с AsyncDatabase в режиме remote"""
+    async def run():
+        adb = main.AsyncDatabase(worker_db, "remote", read_workers=1, socket_path=socket_path)
+        try:
+            await adb.remote.connect()
+            return await scenario(adb)
+        finally:
+            await adb.close()
+
+    return asyncio.run(run())
+
+
+def test_pipelined_writes_are_committed_and_events_come_back(writer):
+    worker_db, socket_path = writer
+    balances, bets = [], []
+    # Миссии работают в писателе: 10 ставок закрывают play_10_games
+    final = 1000 - 200 + main.MISSION_SPECS["play_10_games"].reward
+    worker_db.events.subscribe('balance', lambda event: balances.append(event["ryo"]))
+    worker_db.events.subscribe('bet_settled', lambda event: bets.append(event["rounds"]))
+
+    async def scenario(adb):
+        user_id = await adb.write(worker_db.create_user, "remote_player", "x", "konoha")
+        results = await asyncio.gather(*[adb.write(worker_db.settle_bet, user_id, "dice", 10, 0, "lose")
+                                         for _ in range(20)])
+        # События идут следом за ответами по тому же сокету
+        deadline = time.monotonic() + 5
+        while (len(bets) < 20 or final not in balances) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        return user_id, results
+
+    user_id, results = run_remote(worker_db, socket_path, scenario)
+
+    assert None not in results
+    assert worker_db.get_user_by_id(user_id).ryo == final
+    assert len(bets) == 20 and final in balances
+
+
+def test_errors_reach_only_their_caller(writer):
+    worker_db, socket_path = writer
+
+    async def scenario(adb):
+        with pytest.raises(ValueError):
+            await adb.remote.call("drop_database")
+        missing = await adb.write(worker_db.settle_bet, 10 ** 9, "dice", 10, 0, "lose")
+        stats = await adb.remote.call("stats")
+        return missing, stats
+
+    missing, stats = run_remote(worker_db, socket_path, scenario)
+
+    assert missing is None
+    assert stats["clients"] == 1 and stats["requests"] == 3
+
+
+def test_socket_is_private(writer):
+    _, socket_path = writer
+
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600